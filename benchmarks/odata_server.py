@@ -0,0 +1,128 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlparse
+
+COUNTRIES = ["AFG", "AGO", "ALB", "ARG", "AUS", "BGD", "BRA", "CAN", "CHN", "COD", "EGY", "ETH", "FRA", "GHA",
+             "IDN", "IND", "IRN", "KEN", "MEX", "NGA", "PAK", "PER", "RUS", "TZA", "UGA", "USA", "VNM", "ZAF"]
+REGIONS = {"AFR": "Africa", "AMR": "Americas", "EMR": "Eastern Mediterranean", "EUR": "Europe",
+           "SEAR": "South-East Asia", "WPR": "Western Pacific"}
+
+
+def synthetic_record(indicator: str, index: int) -> Dict[str, Any]:
+    """
+    A GHO-shaped record, generated deterministically from its position so any page can be served
+    without holding the whole indicator in memory
+    """
+    rng = random.Random(index)
+    region = rng.choice(list(REGIONS))
+    year = 1990 + index % 33
+    value = round(rng.uniform(0, 100), 1)
+    low, high = round(value * 0.8, 1), round(value * 1.2, 1)
+    return {
+        "Id": 10000000 + index,
+        "IndicatorCode": indicator,
+        "SpatialDimType": "COUNTRY",
+        "SpatialDim": rng.choice(COUNTRIES),
+        "TimeDimType": "YEAR",
+        "ParentLocationCode": region,
+        "ParentLocation": REGIONS[region],
+        "Dim1Type": "SEX",
+        "TimeDim": year,
+        "Dim1": rng.choice(["SEX_BTSX", "SEX_MLE", "SEX_FMLE"]),
+        "Dim2Type": None,
+        "Dim2": None,
+        "Dim3Type": None,
+        "Dim3": None,
+        "DataSourceDimType": None,
+        "DataSourceDim": None,
+        "Value": f"{value} [{low}-{high}]",
+        "NumericValue": value,
+        "Low": low,
+        "High": high,
+        "Comments": None,
+        "Date": f"20{15 + index % 8}-06-01T13:06:16.897+02:00",
+        "TimeDimensionValue": str(year),
+        "TimeDimensionBegin": f"{year}-01-01T00:00:00+01:00",
+        "TimeDimensionEnd": f"{year}-12-31T00:00:00+01:00",
+    }
+
+
+class FakeGHOServer():
+    """
+    Local fake of the GHO OData API serving 'records' synthetic records for any indicator.
+
+    Every response is delayed by 'latency' seconds plus up to 'jitter' seconds, to stand in for the
+    round trip to the real API. 'max_page_size' caps $top like the real server does.
+    """
+    def __init__(self, records: int, latency: float = 0.0, jitter: float = 0.0, max_page_size: int = 10000):
+        self.records = records
+        self.latency = latency
+        self.jitter = jitter
+        self.max_page_size = max_page_size
+        self.requests = 0
+        self.bytes_sent = 0
+        self._counter_lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are separate writes, don't let them wait on delayed ACKs of kept alive connections
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                indicator = url.path.rstrip("/").rsplit("/", 1)[-1]
+                query = parse_qs(url.query)
+                top = min(int(query.get("$top", [str(server.max_page_size)])[0]), server.max_page_size)
+                skip = int(query.get("$skip", ["0"])[0])
+                body = server.page(indicator, skip, top)
+
+                if server.latency or server.jitter:
+                    time.sleep(server.latency + random.uniform(0, server.jitter))
+                with server._counter_lock:
+                    server.requests += 1
+                    server.bytes_sent += len(body)
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def page(self, indicator: str, skip: int, top: int) -> bytes:
+        records: List[Dict[str, Any]] = [synthetic_record(indicator, index)
+                                         for index in range(skip, min(skip + top, self.records))]
+        return json.dumps({"@odata.context": f"{self.url}/$metadata#{indicator}",
+                           "@odata.count": self.records,
+                           "value": records}).encode()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/api"
+
+    def start(self) -> "FakeGHOServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "FakeGHOServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,212 @@
+"""
+Throughput benchmark for the ghotopostgres ETL.
+
+Runs ETL.start against a local fake GHO OData server for every combination of the given settings and
+reports rows/sec, per-stage latency percentiles and peak RSS. Each scenario runs in a fresh process so
+peak RSS is per scenario. Results can be saved and compared against a previous run:
+
+    python -m benchmarks.run --records 20000 --page-sizes 100,1000 --workers 1,4 --output baseline.json
+    python -m benchmarks.run --records 20000 --page-sizes 100,1000 --workers 1,4 --baseline baseline.json
+
+Without --database-url rows are loaded into a SQLite file with the to_sql loader; with a postgres url
+the copy loader is used.
+"""
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from sqlalchemy import create_engine, text
+from benchmarks.odata_server import FakeGHOServer
+from core.checkpoint import CheckpointStore
+from plugins.ghotopostgres.etl.etl import ETL
+
+INDICATOR = "BENCHMARK"
+# ru_maxrss is in bytes on macOS and kilobytes on linux
+RSS_UNITS_PER_MB = 2 ** 20 if sys.platform == "darwin" else 2 ** 10
+COLUMNS = {
+    "Id": "Id",
+    "SpatialDim": "Country",
+    "ParentLocationCode": "Region",
+    "TimeDim": "TimeDim",
+    "Value": "Value",
+    "NumericValue": "NumericValue",
+    "Date": "Date",
+}
+
+
+class TimedETL(ETL):
+    """
+    ETL recording how long every call of each pipeline stage takes
+    """
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.timings: Dict[str, List[float]] = {"extract": [], "transform": [], "load": []}
+        self.rows_loaded = 0
+
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage].append(time.perf_counter() - started)
+
+    def extract_stage(self, item):
+        with self.timed("extract"):
+            return super().extract_stage(item)
+
+    def transform_stage(self, item):
+        with self.timed("transform"):
+            return super().transform_stage(item)
+
+    def load_stage(self, item):
+        with self.timed("load"):
+            super().load_stage(item)
+        self.rows_loaded += item[1]
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.messages: List[str] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.messages.append(record.getMessage())
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_scenario(scenario: Dict[str, Any], settings: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run one ETL against a fresh fake server and database, returning its measurements
+    """
+    logger = logging.getLogger(f"benchmark.{os.getpid()}")
+    errors = ErrorCounter()
+    logger.addHandler(errors)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    with FakeGHOServer(settings["records"], settings["latency"], settings["jitter"]) as server, \
+            tempfile.TemporaryDirectory() as directory:
+        database_url = settings["database_url"] or f"sqlite:///{os.path.join(directory, 'benchmark.db')}"
+        postgres = database_url.startswith("postgresql")
+        if postgres:
+            with create_engine(database_url).begin() as connection:
+                connection.execute(text(f'DROP TABLE IF EXISTS "{INDICATOR}"'))
+
+        config = {
+            "indicator": INDICATOR,
+            "api": server.url,
+            "page_size": scenario["page_size"],
+            "extractor": scenario["extractor"],
+            "prefetch": {"workers": scenario["workers"], "depth": scenario["workers"] * 2},
+            "pipeline": {"transform_workers": scenario["transform_workers"]},
+            "transform": {"columns": COLUMNS},
+            "destination": {"postgres": {"url": database_url, "loader": "copy" if postgres else "to_sql"}},
+        }
+        etl = TimedETL(config, INDICATOR, logger)
+        etl.checkpoints = CheckpointStore(os.path.join(directory, "status.yaml"), "Benchmark", logger)
+
+        started = time.perf_counter()
+        etl.start()
+        elapsed = time.perf_counter() - started
+        etl.engine.dispose()
+
+    result = dict(scenario)
+    result.update({
+        "rows": etl.rows_loaded,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(etl.rows_loaded / elapsed, 1) if elapsed else 0.0,
+        "requests": server.requests,
+        "mb_fetched": round(server.bytes_sent / 2 ** 20, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / RSS_UNITS_PER_MB, 1),
+        "errors": errors.messages,
+    })
+    for stage, timings in etl.timings.items():
+        for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            result[f"{stage}_{name}_ms"] = round(percentile(timings, fraction) * 1000, 2)
+    return result
+
+
+def scenario_key(result: Dict[str, Any]) -> str:
+    return (f"page_size={result['page_size']} workers={result['workers']} "
+            f"transform_workers={result['transform_workers']} extractor={result['extractor']}")
+
+
+def print_results(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Dict[str, Any]]] = None):
+    header = (f"{'scenario':<70} {'rows':>8} {'rows/s':>10} {'vs base':>8} "
+              f"{'extract p50/p95 ms':>19} {'transform p50/p95 ms':>21} {'load p50/p95 ms':>17} {'rss MB':>7}")
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        change = ""
+        if baseline and scenario_key(result) in baseline:
+            base = baseline[scenario_key(result)]["rows_per_sec"]
+            change = f"{(result['rows_per_sec'] - base) / base * 100:+.1f}%" if base else ""
+        print(f"{scenario_key(result):<70} {result['rows']:>8} {result['rows_per_sec']:>10} {change:>8} "
+              f"{result['extract_p50_ms']:>9}/{result['extract_p95_ms']:<9} "
+              f"{result['transform_p50_ms']:>10}/{result['transform_p95_ms']:<10} "
+              f"{result['load_p50_ms']:>8}/{result['load_p95_ms']:<8} {result['peak_rss_mb']:>7}")
+        for error in result["errors"]:
+            print(f"    error: {error}")
+
+
+def parse_list(value: str, cast=int) -> List[Any]:
+    return [cast(item) for item in value.split(",") if item]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=20000, help="synthetic records served by the fake API")
+    parser.add_argument("--page-sizes", type=parse_list, default=[100, 1000])
+    parser.add_argument("--workers", type=parse_list, default=[1, 4], help="extract (prefetch) workers")
+    parser.add_argument("--transform-workers", type=parse_list, default=[1])
+    parser.add_argument("--extractors", type=lambda value: parse_list(value, str), default=["requests"],
+                        help="'requests' and/or 'async'")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every API response")
+    parser.add_argument("--jitter", type=float, default=0.01, help="random extra seconds per API response")
+    parser.add_argument("--database-url", default=None, help="postgres url, SQLite in a temp dir by default")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare rows/sec against results saved with --output")
+    args = parser.parse_args(argv)
+
+    settings = {"records": args.records, "latency": args.latency, "jitter": args.jitter,
+                "database_url": args.database_url}
+    scenarios = [
+        {"page_size": page_size, "workers": workers, "transform_workers": transform_workers, "extractor": extractor}
+        for page_size, workers, transform_workers, extractor
+        in itertools.product(args.page_sizes, args.workers, args.transform_workers, args.extractors)
+    ]
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for scenario in scenarios:
+        with context.Pool(1) as pool:
+            results.append(pool.apply(run_scenario, (scenario, settings)))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = {scenario_key(result): result for result in json.load(file)["results"]}
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"settings": settings, "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
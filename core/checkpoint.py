@@ -0,0 +1,169 @@
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+import yaml
+from core.exceptions import StatusFileReadError, StatusFileWriteError
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None  # type: ignore
+
+# serializes flushes of stores sharing a file within this process, the file lock covers other processes
+_path_locks: Dict[str, threading.Lock] = {}
+_path_locks_guard = threading.Lock()
+
+
+def _path_lock(full_path: str) -> threading.Lock:
+    with _path_locks_guard:
+        return _path_locks.setdefault(full_path, threading.Lock())
+
+
+def status_file_path(file_path: str) -> str:
+    """
+    Absolute path of a status file, relative paths live in the home directory
+    """
+    return os.path.join(os.path.expanduser("~"), file_path)
+
+
+def read_status(full_path: str) -> Dict[str, Any]:
+    """
+    Read a status file, an empty or missing file holds no plugin status yet
+    """
+    try:
+        if os.path.exists(full_path) and os.path.getsize(full_path) > 0:
+            with open(full_path, 'r') as file:
+                status_data = yaml.safe_load(file) or {}
+        else:
+            status_data = {}
+    except yaml.YAMLError as e:
+        raise StatusFileReadError(f"Error reading YAML file: {e}")
+    except OSError as e:
+        raise StatusFileReadError(f"Error reading status file {full_path}: {e}")
+    status_data.setdefault('plugins', {})
+    return status_data
+
+
+def write_status_atomically(full_path: str, status_data: Any):
+    """
+    Write a status file through a temporary file renamed over it, so readers and crashes
+    never see a partially written file
+    """
+    directory = os.path.dirname(full_path) or "."
+    try:
+        descriptor, temp_path = tempfile.mkstemp(prefix=".status-", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(descriptor, 'w') as file:
+                yaml.safe_dump(status_data, file, default_flow_style=False)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    except OSError as e:
+        raise StatusFileWriteError(f"Error writing status file {full_path}: {e}")
+
+
+@contextmanager
+def locked_status_file(full_path: str) -> Iterator[None]:
+    """
+    Hold the lock of a status file, shared by all threads and processes of the integration
+    """
+    with _path_lock(full_path):
+        if fcntl is None:
+            yield
+            return
+        with open(f"{full_path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class CheckpointStore():
+    """
+    Progress of one plugin's jobs, kept under the plugin's key of the shared status file.
+
+    Updates are kept in memory and written together once 'flush_every' updates are pending or
+    'flush_interval' seconds after the first pending update, whichever comes first. A flush re-reads the
+    file under a lock and only replaces this store's entries, so plugins running in other threads or
+    processes keep their progress, and the file is replaced atomically.
+    A crash can lose at most the pending updates, so jobs must tolerate replaying a few batches.
+    """
+    def __init__(self,
+                 file_path: str,
+                 plugin_key: str,
+                 logger: logging.Logger,
+                 flush_every: int = 1,
+                 flush_interval: float = 0.0):
+        self.full_path = status_file_path(file_path)
+        self.plugin_key = plugin_key
+        self.logger = logger
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._entries: Dict[str, Any] = {}
+        self._dirty: Dict[str, Any] = {}
+        self._updates = 0
+        self._timer: Optional[threading.Timer] = None
+        self.reload()
+
+    def reload(self):
+        """
+        Read the plugin's entries from the status file, keeping updates that were not flushed yet
+        """
+        with self._lock:
+            with locked_status_file(self.full_path):
+                status_data = read_status(self.full_path)
+            self._entries = dict(status_data['plugins'].get(self.plugin_key) or {})
+            self._entries.update(self._dirty)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            return self._entries.get(key, default)
+
+    def set(self, key: str, value: Any):
+        """
+        Record the progress of a job, flushing to the file when a flush is due
+        """
+        with self._lock:
+            self._entries[key] = value
+            self._dirty[key] = value
+            self._updates += 1
+            if self._updates >= self.flush_every:
+                self.flush()
+            elif self._timer is None and self.flush_interval > 0:
+                self._timer = threading.Timer(self.flush_interval, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        except (StatusFileReadError, StatusFileWriteError) as e:
+            self.logger.error(f"Error flushing checkpoints: {e}")
+
+    def flush(self):
+        """
+        Write pending updates to the status file
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._updates = 0
+            if not self._dirty:
+                return
+            with locked_status_file(self.full_path):
+                status_data = read_status(self.full_path)
+                plugin_status = status_data['plugins'].get(self.plugin_key) or {}
+                plugin_status.update(self._dirty)
+                status_data['plugins'][self.plugin_key] = plugin_status
+                write_status_atomically(self.full_path, status_data)
+            self._dirty = {}
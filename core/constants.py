@@ -2,3 +2,12 @@ from typing import Final
 
 PLUGINS_DIRECTORY: Final = "plugins"
 HOME_DIRECTORY_INTEGRATION_FOLDER: Final = ".psystem"
+STATUS_FILE: Final = f"{HOME_DIRECTORY_INTEGRATION_FOLDER}/status.yaml"
+PROFILES_DIRECTORY: Final = f"{HOME_DIRECTORY_INTEGRATION_FOLDER}/profiles"
+MANIFEST_FILE: Final = f"{HOME_DIRECTORY_INTEGRATION_FOLDER}/manifest.json"
+CACHE_DIRECTORY: Final = f"{HOME_DIRECTORY_INTEGRATION_FOLDER}/cache"
+DEAD_LETTER_FILE: Final = f"{HOME_DIRECTORY_INTEGRATION_FOLDER}/dead_letters.sqlite"
+STOP_DEADLINE: Final = 60
+SCHEDULER_WORKERS: Final = 4
+HEALTH_CHECK_INTERVAL: Final = 300
+PROCESS_START_TIMEOUT: Final = 60
@@ -15,3 +15,26 @@ class NoDataFoundException(Exception):
     and no data is returnd. This can happen when all the data has been exhausted
     """
     pass
+
+
+class CancelledError(Exception):
+    """
+    Raised by work that checks its cancellation token after it was cancelled
+    """
+    pass
+
+
+class TooManyBadRecordsError(Exception):
+    """
+    Raised when a job rejected more records than it is configured to set aside, which points to a broken
+    destination or configuration rather than a few bad records
+    """
+    pass
+
+
+class SchemaMismatchError(Exception):
+    """
+    Raised when an existing table has a column that can't hold the values of the type the config
+    declares for it
+    """
+    pass
@@ -0,0 +1,92 @@
+import ast
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+# files whose changes invalidate a plugin's cached manifest entry
+FINGERPRINT_FILES = ("plugin.py", "config.yaml")
+
+
+def plugin_fingerprint(plugin_path: str) -> List[Any]:
+    """
+    Modification time and size of the files that describe a plugin
+    """
+    fingerprint: List[Any] = []
+    for file_name in FINGERPRINT_FILES:
+        try:
+            stat = os.stat(os.path.join(plugin_path, file_name))
+            fingerprint.append([file_name, stat.st_mtime_ns, stat.st_size])
+        except FileNotFoundError:
+            fingerprint.append([file_name, None, None])
+    return fingerprint
+
+
+def find_plugin_classes(module_path: str, interface_name: str = "PluginInterface") -> Optional[List[str]]:
+    """
+    Names of the classes in a plugin module that directly subclass the plugin interface, found by parsing
+    the source instead of importing it. Returns None when the module cannot be parsed.
+    """
+    try:
+        with open(module_path, 'r') as file:
+            tree = ast.parse(file.read(), filename=module_path)
+    except (OSError, SyntaxError):
+        return None
+
+    classes = []
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        for base in node.bases:
+            base_name = base.attr if isinstance(base, ast.Attribute) else getattr(base, "id", None)
+            if base_name == interface_name:
+                classes.append(node.name)
+                break
+    return classes
+
+
+class PluginManifest():
+    """
+    Cache of plugin discovery results, keyed on the plugin directory and invalidated by its fingerprint
+    """
+    def __init__(self, path: Optional[str], logger: logging.Logger):
+        self.path = path
+        self.logger = logger
+        self.entries: Dict[str, Any] = {}
+        self._changed = False
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    self.entries = json.load(file).get("plugins", {})
+            except (OSError, ValueError) as e:
+                self.logger.debug(f"Ignoring unreadable plugin manifest {path}: {e}")
+
+    def get(self, plugin_path: str, fingerprint: List[Any]) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(plugin_path)
+        if entry is not None and entry.get("fingerprint") == fingerprint:
+            return entry
+        return None
+
+    def put(self, plugin_path: str, fingerprint: List[Any], class_names: List[str], metadata: Dict[str, Any]):
+        self.entries[plugin_path] = {"fingerprint": fingerprint, "classes": class_names, "metadata": metadata}
+        self._changed = True
+
+    def prune(self, plugin_paths: List[str]):
+        """
+        Forget plugins that are no longer in the plugin directory
+        """
+        for plugin_path in set(self.entries) - set(plugin_paths):
+            del self.entries[plugin_path]
+            self._changed = True
+
+    def save(self):
+        if self.path is None or not self._changed:
+            return
+        try:
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w') as file:
+                json.dump({"plugins": self.entries}, file, indent=2, default=str)
+            os.replace(temp_path, self.path)
+            self._changed = False
+        except OSError as e:
+            self.logger.debug(f"Could not write plugin manifest {self.path}: {e}")
@@ -0,0 +1,277 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Histogram():
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry():
+    """
+    Thread-safe counters and latency histograms, labelled e.g. by plugin and stage.
+    Recording is a dict update under a lock, cheap enough for per-page hot paths.
+    """
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: Any):
+        """
+        Add 'value' to a counter
+        """
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: Any):
+        """
+        Record a duration in a histogram
+        """
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = _Histogram(self.buckets)
+            series[key].observe(seconds)
+
+    @contextmanager
+    def time(self, name: str, **labels: Any) -> Iterator[None]:
+        """
+        Record how long the block takes in a histogram
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        JSON serializable view of every metric
+        """
+        with self._lock:
+            counters = {name: [{"labels": dict(labels), "value": value} for labels, value in series.items()]
+                        for name, series in self._counters.items()}
+            histograms = {
+                name: [{"labels": dict(labels),
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], histogram.counts))}
+                       for labels, histogram in series.items()]
+                for name, series in self._histograms.items()
+            }
+        return {"timestamp": time.time(), "counters": counters, "histograms": histograms}
+
+    def render_prometheus(self) -> str:
+        """
+        Every metric in the Prometheus text exposition format
+        """
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in series.items():
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            for name, histograms in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in histograms.items():
+                    cumulative = 0
+                    for bound, count in zip([str(bound) for bound in self.buckets] + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', bound))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+# metrics of everything running in this process, exposed by PluginCore.metrics
+registry = MetricsRegistry()
+
+
+class PrometheusExporter():
+    """
+    Serves a registry at http://host:port/metrics in the Prometheus text format
+    """
+    def __init__(self, metrics: MetricsRegistry, port: int, host: str = "127.0.0.1"):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics-exporter", daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_port
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class JsonFileExporter():
+    """
+    Writes a registry snapshot to a JSON file every 'interval' seconds, and once more on stop
+    """
+    def __init__(self, metrics: MetricsRegistry, path: str, interval: float = 30.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-json-exporter", daemon=True)
+
+    def dump(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.metrics.snapshot(), file, indent=2)
+        os.replace(temp_path, self.path)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.dump()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        self.dump()
+
+
+class _ProfileSession():
+    """
+    Profiles of the worker threads started on behalf of a profiled() block
+    """
+    def __init__(self):
+        self.profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def add(self, profile: cProfile.Profile):
+        with self._lock:
+            self.profiles.append(profile)
+
+
+# the profiled() block a thread works for, inherited by the workers it starts through profile_worker()
+_profiling = threading.local()
+
+
+def profile_worker(target: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Wrap the target of a worker thread, or of a task of a thread pool, so that when it is started from a
+    profiled() block it is profiled too and its stats are merged into the block's. cProfile only sees
+    the thread it is enabled in, and pipelines do their work on threads of their own. Returns 'target'
+    unchanged outside profiled() blocks.
+    """
+    session = getattr(_profiling, "session", None)
+    if session is None:
+        return target
+
+    def run(*args: Any, **kwargs: Any) -> Any:
+        profile = cProfile.Profile()
+        _profiling.session = session
+        profile.enable()
+        try:
+            return target(*args, **kwargs)
+        finally:
+            profile.disable()
+            _profiling.session = None
+            session.add(profile)
+    return run
+
+
+@contextmanager
+def profiled(name: str, directory: str, logger: Optional[logging.Logger] = None) -> Iterator[None]:
+    """
+    Profile the calling thread, and the worker threads started from it with profile_worker(), with cProfile
+    for the duration of the block and write the merged stats, readable with pstats or snakeviz, to
+    '<directory>/<name>-<timestamp>.prof'. Workers still running when the block ends are left out.
+    """
+    session = _ProfileSession()
+    previous = getattr(_profiling, "session", None)
+    _profiling.session = session
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        _profiling.session = previous
+        stats = pstats.Stats(profile)
+        with session._lock:
+            for worker_profile in session.profiles:
+                stats.add(worker_profile)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{threading.get_ident()}.prof")
+        stats.dump_stats(path)
+        if logger is not None:
+            logger.info(f"Wrote profile of {name} to {path}")
+
+
+def profiled_target(target: Callable[..., Any], name: str, directory: str,
+                    logger: Optional[logging.Logger] = None) -> Callable[..., Any]:
+    """
+    Wrap a thread target so it runs under profiled()
+    """
+    def run(*args: Any, **kwargs: Any) -> Any:
+        with profiled(name, directory, logger):
+            return target(*args, **kwargs)
+    return run
@@ -0,0 +1,223 @@
+import heapq
+import logging
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from core.metrics import MetricsRegistry, profile_worker
+from core.thread import CancellationToken
+
+# marks the end of the stream on a stage queue
+_DONE = object()
+
+
+class Stage():
+    """
+    A named step of a pipeline, run by one or more worker threads.
+
+    The stage function receives the output of the previous stage and returns the input of the next one.
+    Returning None drops the item from the rest of the pipeline. An ordered stage sees items in the
+    order the source produced them, which needs a single worker.
+    """
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1, ordered: bool = False):
+        if workers < 1:
+            raise ValueError(f"Stage '{name}' needs at least one worker")
+        if ordered and workers != 1:
+            raise ValueError(f"Ordered stage '{name}' must run on a single worker")
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.ordered = ordered
+
+
+class _Envelope():
+    """
+    An item travelling through the pipeline, tagged with its position in the source
+    """
+    __slots__ = ("seq", "value", "dropped")
+
+    def __init__(self, seq: int, value: Any, dropped: bool = False):
+        self.seq = seq
+        self.value = value
+        self.dropped = dropped
+
+    def __lt__(self, other: "_Envelope") -> bool:
+        return self.seq < other.seq
+
+
+class Pipeline():
+    """
+    Runs a source and a list of stages concurrently, connected by bounded queues.
+
+    Each stage gets its own worker threads, so a slow stage only holds back the stages feeding it once
+    its queue is full. At most 'max_in_flight' items are between the source and the end of the last stage,
+    which bounds memory even when an ordered stage is waiting for an earlier item.
+    The first exception raised by the source or a stage stops the pipeline and is re-raised by run().
+    Cancelling 'token' stops the pipeline like stop(): no new items are fed and the items in flight drain.
+    With a metrics registry, the duration of every stage call is recorded as 'pipeline_stage_seconds'.
+    """
+    def __init__(self,
+                 source: Iterable[Any],
+                 stages: List[Stage],
+                 queue_size: int = 4,
+                 max_in_flight: Optional[int] = None,
+                 logger: Optional[logging.Logger] = None,
+                 metrics: Optional[MetricsRegistry] = None,
+                 labels: Optional[Dict[str, Any]] = None,
+                 token: Optional[CancellationToken] = None):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.source = source
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.max_in_flight = max_in_flight or self.queue_size * (len(stages) + 1)
+        self.logger = logger or logging.getLogger(__name__)
+        self.metrics = metrics
+        self.labels = labels or {}
+        self.token = token
+        self._stop_event = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._error_lock = threading.Lock()
+        self._in_flight = threading.Semaphore(self.max_in_flight)
+
+    def stop(self):
+        """
+        Stop feeding new items from the source. Items already in the pipeline are drained.
+        """
+        self._stop_event.set()
+
+    def stopped(self) -> bool:
+        return self._stop_event.is_set() or (self.token is not None and self.token.cancelled())
+
+    def _fail(self, stage_name: str, error: BaseException):
+        with self._error_lock:
+            if self._error is None:
+                self._error = error
+                self.logger.debug(f"Pipeline stage '{stage_name}' failed: {error}")
+        self._stop_event.set()
+
+    def _feed(self, out_queue: queue.Queue, consumers: int):
+        seq = 0
+        try:
+            for value in self.source:
+                while not self._in_flight.acquire(timeout=0.1):
+                    if self.stopped():
+                        break
+                if self.stopped():
+                    break
+                out_queue.put(_Envelope(seq, value))
+                seq += 1
+        except BaseException as e:
+            self._fail("source", e)
+        finally:
+            for _ in range(consumers):
+                out_queue.put(_DONE)
+
+    def _work(self, index: int, in_queue: queue.Queue, out_queue: Optional[queue.Queue], finished: List[int],
+              finished_lock: threading.Lock):
+        stage = self.stages[index]
+        pending: List[_Envelope] = []
+        next_seq = 0
+
+        def handle(envelope: _Envelope):
+            if not envelope.dropped and self._error is None:
+                started = time.perf_counter()
+                try:
+                    result = stage.func(envelope.value)
+                except BaseException as e:
+                    self._fail(stage.name, e)
+                    result = None
+                if self.metrics is not None:
+                    self.metrics.observe("pipeline_stage_seconds", time.perf_counter() - started,
+                                         stage=stage.name, **self.labels)
+                envelope.value = result
+                envelope.dropped = result is None
+            if out_queue is None:
+                self._in_flight.release()
+            else:
+                out_queue.put(envelope)
+
+        while True:
+            envelope = in_queue.get()
+            if envelope is _DONE:
+                break
+            if not stage.ordered:
+                handle(envelope)
+                continue
+            heapq.heappush(pending, envelope)
+            while pending and pending[0].seq == next_seq:
+                handle(heapq.heappop(pending))
+                next_seq += 1
+
+        # leftovers can only remain in an ordered stage after a failure upstream
+        for envelope in sorted(pending):
+            envelope.dropped = True
+            handle(envelope)
+
+        with finished_lock:
+            finished[index] += 1
+            last_worker = finished[index] == stage.workers
+        if last_worker and out_queue is not None:
+            for _ in range(self.stages[index + 1].workers):
+                out_queue.put(_DONE)
+
+    def run(self):
+        """
+        Run the pipeline until the source is exhausted or a stage fails, blocking the calling thread
+        """
+        queues: List[queue.Queue] = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        finished = [0] * len(self.stages)
+        finished_lock = threading.Lock()
+
+        # workers of a profiled run are profiled along with it
+        threads = [threading.Thread(target=profile_worker(self._feed), args=(queues[0], self.stages[0].workers),
+                                    daemon=True)]
+        for index, stage in enumerate(self.stages):
+            out_queue = queues[index + 1] if index + 1 < len(self.stages) else None
+            for worker in range(stage.workers):
+                threads.append(threading.Thread(target=profile_worker(self._work),
+                                                args=(index, queues[index], out_queue, finished, finished_lock),
+                                                name=f"{stage.name}-{worker}",
+                                                daemon=True))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+
+class StagedJob(ABC):
+    """
+    Interface for jobs, typically the ETL of a plugin, that declare their source and stages
+    and are run by the core pipeline engine.
+    """
+
+    @abstractmethod
+    def source(self) -> Iterable[Any]:
+        """
+        Items fed to the first stage, e.g. the page offsets to extract.
+        """
+        pass
+
+    @abstractmethod
+    def stages(self) -> List[Stage]:
+        """
+        The stages of the job in order, e.g. extract, transform and load.
+        """
+        pass
+
+    def run_pipeline(self,
+                     queue_size: int = 4,
+                     logger: Optional[logging.Logger] = None,
+                     metrics: Optional[MetricsRegistry] = None,
+                     labels: Optional[Dict[str, Any]] = None,
+                     token: Optional[CancellationToken] = None):
+        """
+        Run the declared stages with the pipeline engine.
+        """
+        Pipeline(self.source(), self.stages(), queue_size=queue_size, logger=logger, metrics=metrics,
+                 labels=labels, token=token).run()
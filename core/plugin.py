@@ -1,12 +1,18 @@
 from abc import ABC, abstractmethod
 import importlib.util
 import os
-from typing import List, Callable, Any
+from typing import Dict, List, Callable, Any, Optional
 import inspect
 import yaml
 import logging
-from core.constants import HOME_DIRECTORY_INTEGRATION_FOLDER
+from core.checkpoint import (CheckpointStore, locked_status_file, read_status, status_file_path,
+                             write_status_atomically)
+from core.constants import HOME_DIRECTORY_INTEGRATION_FOLDER, MANIFEST_FILE, STATUS_FILE
+from core.manifest import PluginManifest, find_plugin_classes, plugin_fingerprint
+from core.metrics import JsonFileExporter, MetricsRegistry, PrometheusExporter, registry
+from core.resources import ResourceRegistry, registry as resources
 from core.exceptions import StatusFileReadError, StatusFileWriteError
+from core.thread import CancellationToken
 
 
 class PluginInterface(ABC):
@@ -29,9 +35,11 @@ class PluginInterface(ABC):
         pass
 
     @abstractmethod
-    def execute(self):
+    def execute(self, token: Optional[CancellationToken] = None, job: Optional[str] = None):
         """
-        Execute the plugin ETL job.
+        Execute the plugin ETL job. Plugins that take a cancellation token should return soon after
+        it is cancelled, once in-flight work is finished and progress is saved. 'job' is one of the
+        jobs of schedules() when the scheduler runs only that job, None to run the whole plugin.
         """
         pass
 
@@ -42,6 +50,100 @@ class PluginInterface(ABC):
         """
         pass
 
+    def schedules(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Schedules of jobs the plugin runs separately in daemon mode, {job: {interval | cron, priority}}.
+        Each job is run with execute(token, job=job). Without any, the plugin runs as a whole on the
+        'schedule' of its config.
+        """
+        return {}
+
+    def close(self):
+        """
+        Release resources kept between runs, e.g. connection pools. Called once the plugin won't run again.
+        """
+        pass
+
+
+class _MetadataLoader(yaml.SafeLoader):
+    """
+    Safe loader that reads plugin configs without the plugin's custom constructors, e.g. for secrets
+    """
+    pass
+
+
+_MetadataLoader.add_multi_constructor("!", lambda loader, suffix, node: None)
+
+
+class PluginSpec():
+    """
+    A discovered plugin: where it lives, which class implements it and its config.yaml metadata
+    """
+    def __init__(self, name: str, path: str, module_name: str, class_name: str, metadata: Dict[str, Any]):
+        self.name = name
+        self.path = path
+        self.module_name = module_name
+        self.class_name = class_name
+        self.metadata = metadata
+
+    @property
+    def profile(self) -> bool:
+        """
+        Whether the plugin's run is profiled with cProfile, off unless 'profile: true'
+        """
+        return bool(self.metadata.get("profile", False))
+
+    @property
+    def executor(self) -> str:
+        """
+        How the plugin is run, 'thread' (default) or 'process'
+        """
+        return self.metadata.get("executor", "thread")
+
+    @property
+    def schedule(self) -> Optional[Dict[str, Any]]:
+        """
+        When the plugin runs in daemon mode, an 'interval' in seconds or a 'cron' expression
+        """
+        return self.metadata.get("schedule")
+
+    @property
+    def priority(self) -> int:
+        """
+        Runs of plugins with a higher priority start first when more are due than there are workers
+        """
+        return int(self.metadata.get("priority", 0))
+
+    def create(self, logger: logging.Logger) -> PluginInterface:
+        """
+        Import the plugin module and instantiate the plugin
+        """
+        plugin_module = importlib.import_module(self.module_name)
+        return getattr(plugin_module, self.class_name)(self.path, logger)
+
+
+def execute_plugin(plugin: PluginInterface, token: CancellationToken, job: Optional[str] = None):
+    """
+    Run a plugin's execute(), handing it the cancellation token when it accepts one, and the job to run
+    when a scheduled job of the plugin is due
+    """
+    if job is not None:
+        plugin.execute(token, job=job)
+    elif len(inspect.signature(plugin.execute).parameters) > 0:
+        plugin.execute(token)
+    else:
+        plugin.execute()
+
+
+def run_plugin(plugin: PluginInterface, token: CancellationToken):
+    """
+    Run a plugin once and release its resources
+    """
+    try:
+        execute_plugin(plugin, token)
+    finally:
+        plugin.close()
+
 
 class PluginCore():
     """
@@ -49,33 +151,116 @@ class PluginCore():
     """
     def __init__(self,
                  logger: logging.Logger,
-                 plugin_directory: str, create_home_dir_func: Callable[[str, logging.Logger], None]):
+                 plugin_directory: str, create_home_dir_func: Callable[[str, logging.Logger], None],
+                 manifest_path: Optional[str] = MANIFEST_FILE):
         self.logger = logger
         self.plugin_directory = plugin_directory
+        # cached discovery results, None disables the cache
+        self.manifest_path = status_file_path(manifest_path) if manifest_path else None
+        # plugins record their timers and counters in the process wide registry
+        self.metrics: MetricsRegistry = registry
+        # and share database engines and HTTP sessions through the process wide resource registry
+        self.resources: ResourceRegistry = resources
         create_home_dir_func(HOME_DIRECTORY_INTEGRATION_FOLDER, self.logger)
 
-    def load_plugins(self) -> List[PluginInterface]:
+    def start_metrics_exporters(self,
+                                prometheus_port: Optional[int] = None,
+                                json_path: Optional[str] = None,
+                                json_interval: float = 30.0) -> List[Any]:
+        """
+        Export plugin metrics on a local Prometheus endpoint and/or as a periodic JSON dump.
+        Returns the started exporters, stop them on shutdown.
+        """
+        exporters: List[Any] = []
+        if prometheus_port is not None:
+            exporter = PrometheusExporter(self.metrics, prometheus_port)
+            exporter.start()
+            self.logger.info(f"Serving metrics on http://127.0.0.1:{exporter.port}/metrics")
+            exporters.append(exporter)
+        if json_path is not None:
+            json_exporter = JsonFileExporter(self.metrics, json_path, json_interval)
+            json_exporter.start()
+            self.logger.info(f"Writing metrics to {json_path} every {json_interval}s")
+            exporters.append(json_exporter)
+        return exporters
+
+    def configure_resources(self, db_pool_size: Optional[int] = None, db_max_overflow: Optional[int] = None,
+                            http_pool_size: Optional[int] = None):
         """
-        Loads plugins given a path
+        Cap the connection pools plugins get from the resource registry
+        """
+        self.resources.configure(db_pool_size, db_max_overflow, http_pool_size)
+
+    def shutdown(self):
+        """
+        Close the connection pools and sessions shared by the plugins
+        """
+        self.resources.close()
+
+    @staticmethod
+    def read_plugin_metadata(plugin_path: str) -> Dict[str, Any]:
+        """
+        Read a plugin's config.yaml without running its custom YAML constructors.
+        Returns an empty dict when the plugin has no config.
+        """
+        config_path = os.path.join(plugin_path, "config.yaml")
+        if not os.path.exists(config_path):
+            return {}
+        with open(config_path, 'r') as yaml_file:
+            return yaml.load(yaml_file, Loader=_MetadataLoader) or {}
+
+    def discover_plugins(self) -> List[PluginSpec]:
         """
-        plugins = []
+        Finds the enabled plugins in the plugin directory without importing or instantiating them.
 
-        for plugin_name in os.listdir(self.plugin_directory):
+        Each plugin's config.yaml is read first and plugins with 'enabled: false' are skipped. The plugin
+        class is found by parsing plugin.py, and results are cached in the plugin manifest until the plugin's
+        files change, so modules (and their heavy dependencies) are only imported by PluginSpec.create.
+        """
+        manifest = PluginManifest(self.manifest_path, self.logger)
+        specs = []
+        plugin_paths = []
+
+        for plugin_name in sorted(os.listdir(self.plugin_directory)):
             plugin_path = os.path.join(self.plugin_directory, plugin_name)
+            if not os.path.isdir(plugin_path) or not os.path.exists(os.path.join(plugin_path, "plugin.py")):
+                continue
+            plugin_paths.append(plugin_path)
 
-            if os.path.isdir(plugin_path):
-                module_name = f"{self.plugin_directory}.{plugin_name}.plugin"
-                plugin_module = importlib.import_module(module_name)
+            module_name = f"{self.plugin_directory}.{plugin_name}.plugin"
+            fingerprint = plugin_fingerprint(plugin_path)
+            entry = manifest.get(plugin_path, fingerprint)
+            if entry is None:
+                metadata = self.read_plugin_metadata(plugin_path)
+                class_names = find_plugin_classes(os.path.join(plugin_path, "plugin.py"))
+                if not class_names and metadata.get("enabled", True):
+                    # e.g. the plugin class inherits the interface indirectly
+                    class_names = self._import_plugin_classes(module_name)
+                entry = {"classes": class_names or [], "metadata": metadata}
+                manifest.put(plugin_path, fingerprint, entry["classes"], metadata)
 
-                plugin_classes = inspect.getmembers(plugin_module, inspect.isclass)
+            if not entry["metadata"].get("enabled", True):
+                self.logger.info(f"Plugin '{plugin_name}' is disabled, skipping it")
+                continue
 
-                for name, cls in plugin_classes:
-                    if (
-                        issubclass(cls, PluginInterface) and cls is not PluginInterface
-                    ):
-                        plugins.append(cls(plugin_path, self.logger))
+            for class_name in entry["classes"]:
+                specs.append(PluginSpec(plugin_name, plugin_path, module_name, class_name, entry["metadata"]))
 
-        return plugins
+        manifest.prune(plugin_paths)
+        manifest.save()
+        return specs
+
+    @staticmethod
+    def _import_plugin_classes(module_name: str) -> List[str]:
+        plugin_module = importlib.import_module(module_name)
+        return [name for name, cls in inspect.getmembers(plugin_module, inspect.isclass)
+                if issubclass(cls, PluginInterface) and cls is not PluginInterface]
+
+    def load_plugins(self) -> List[PluginInterface]:
+        """
+        Loads the enabled plugins given a path
+        """
+        return [spec.create(self.logger) for spec in self.discover_plugins()]
 
     @staticmethod
     def read_status_file(file_path: str, logger: logging.Logger):
@@ -83,36 +268,34 @@ class PluginCore():
         Read a status file that lives in the home directory where plugins can write
         status information about the jobs they are running
         """
+        full_path = status_file_path(file_path)
         try:
-            full_path = os.path.join(os.path.expanduser("~"), file_path)
-
-            if os.path.exists(full_path) and os.path.getsize(full_path) > 0:
-                with open(full_path, 'r') as file:
-                    status_data = yaml.safe_load(file)
-            else:
-                status_data = {'plugins': {}}
-
-        except FileNotFoundError:
-            logger.error(f"Error: File not found - {full_path}")
-            raise StatusFileReadError(f"File not found - {full_path}")
-
-        except yaml.YAMLError as e:
-            logger.error(f"Error reading YAML file: {e}")
-            raise StatusFileReadError(f"Error reading YAML file: {e}")
-
+            with locked_status_file(full_path):
+                return read_status(full_path)
+        except StatusFileReadError as e:
+            logger.error(f"Error reading status file: {e}")
+            raise
         except Exception as e:
             raise StatusFileReadError(f"An unexpected error occurred: {e}")
 
-        return status_data
-
     @staticmethod
     def write_status_file(file_path: str, status_data: Any):
         """
-        Plugin ETL jobs use this function tio write their status data
+        Plugin ETL jobs use this function tio write their status data.
+        Prefer a CheckpointStore, which only replaces the plugin's own entries.
         """
+        full_path = status_file_path(file_path)
         try:
-            full_path = os.path.join(os.path.expanduser("~"), file_path)
-            with open(full_path, 'w') as file:
-                yaml.dump(status_data, file, default_flow_style=False)
+            with locked_status_file(full_path):
+                write_status_atomically(full_path, status_data)
+        except StatusFileWriteError:
+            raise
         except Exception as e:
             raise StatusFileWriteError(f"An unexpected error occurred: {e}")
+
+    @staticmethod
+    def checkpoint_store(plugin_key: str, logger: logging.Logger, **settings: Any) -> CheckpointStore:
+        """
+        Checkpoint store for a plugin's jobs, backed by the integration's status file
+        """
+        return CheckpointStore(STATUS_FILE, plugin_key, logger, **settings)
@@ -0,0 +1,255 @@
+import itertools
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from core.constants import PROFILES_DIRECTORY
+from core.metrics import JsonFileExporter, profiled, registry
+from core.plugin import PluginInterface, PluginSpec, execute_plugin, run_plugin
+from core.resources import pool_caps_from_environment, registry as resources
+from core.thread import CancellationToken
+
+
+def start_log_listener(logger: logging.Logger) -> Tuple[Any, logging.handlers.QueueListener]:
+    """
+    Start forwarding log records put on the returned queue by plugin processes to 'logger'
+    """
+    log_queue = multiprocessing.get_context("spawn").Queue()
+
+    class ForwardHandler(logging.Handler):
+        def emit(self, record: logging.LogRecord):
+            logger.handle(record)
+
+    listener = logging.handlers.QueueListener(log_queue, ForwardHandler())
+    listener.start()
+    return log_queue, listener
+
+
+def plugin_process_logger(spec: PluginSpec, log_queue: Any) -> logging.Logger:
+    """
+    Logger of a plugin process, sending its records back to the parent through 'log_queue'
+    """
+    logger = logging.getLogger(f"{__name__}.{spec.name}")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    return logger
+
+
+def start_process_exporter(spec: PluginSpec) -> Optional[JsonFileExporter]:
+    """
+    Metrics of a plugin process live in that process, dump them next to the parent's
+    """
+    json_path = os.environ.get("PSYSTEM_METRICS_JSON")
+    if not json_path:
+        return None
+    exporter = JsonFileExporter(registry, f"{json_path}.{spec.name}",
+                                float(os.environ.get("PSYSTEM_METRICS_INTERVAL", 30)))
+    exporter.start()
+    return exporter
+
+
+def create_process_plugin(spec: PluginSpec, stop_event: Any, logger: logging.Logger) -> PluginInterface:
+    """
+    Instantiate the plugin of a plugin process, whose stop function is called once 'stop_event' is set
+    """
+    # the parent handles CTRL + C and forwards it through the stop event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # the registry of this process starts empty, it gets the same pool caps as the parent's
+    resources.configure(**pool_caps_from_environment())
+    plugin = spec.create(logger)
+
+    def wait_for_stop():
+        stop_event.wait()
+        plugin.stop()
+
+    threading.Thread(target=wait_for_stop, daemon=True).start()
+    return plugin
+
+
+def run_plugin_process(spec: PluginSpec, stop_event: Any, log_queue: Any):
+    """
+    Entry point of a plugin process. Logs go back to the parent through 'log_queue' and
+    setting 'stop_event' in the parent cancels the plugin's token and calls its stop function here.
+    """
+    logger = plugin_process_logger(spec, log_queue)
+    plugin = create_process_plugin(spec, stop_event, logger)
+    token = CancellationToken(stop_event)
+    exporter = start_process_exporter(spec)
+
+    try:
+        if spec.profile:
+            with profiled(spec.name, os.path.join(os.path.expanduser("~"), PROFILES_DIRECTORY), logger):
+                run_plugin(plugin, token)
+        else:
+            run_plugin(plugin, token)
+    finally:
+        resources.close()
+        if exporter is not None:
+            exporter.stop()
+
+
+def serve_plugin_process(spec: PluginSpec, stop_event: Any, log_queue: Any, jobs: Any, events: Any):
+    """
+    Entry point of a plugin process in daemon mode. The plugin is created once and runs every
+    (run id, job) put on 'jobs' on a thread of its own, so its connection pools and sessions stay warm
+    between runs. The plugin's schedules are sent first on 'events', then ("done", run id, error) when
+    a run finished. Setting 'stop_event' cancels the runs, the process exits once they are finished.
+    """
+    logger = plugin_process_logger(spec, log_queue)
+    plugin = create_process_plugin(spec, stop_event, logger)
+    token = CancellationToken(stop_event)
+    exporter = start_process_exporter(spec)
+
+    def run(run_id: int, job: Optional[str]):
+        error = None
+        try:
+            if job is None and spec.profile:
+                with profiled(spec.name, os.path.join(os.path.expanduser("~"), PROFILES_DIRECTORY), logger):
+                    execute_plugin(plugin, token)
+            else:
+                execute_plugin(plugin, token, job)
+        except Exception as e:
+            error = str(e)
+        finally:
+            events.put(("done", run_id, error))
+
+    runs: List[threading.Thread] = []
+    try:
+        events.put(("schedules", plugin.schedules()))
+        while not stop_event.is_set():
+            try:
+                run_id, job = jobs.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            thread = threading.Thread(target=run, args=(run_id, job), name=f"{spec.name}-{job or 'plugin'}",
+                                      daemon=True)
+            thread.start()
+            runs = [run for run in runs if run.is_alive()] + [thread]
+        for thread in runs:
+            thread.join()
+    finally:
+        plugin.close()
+        resources.close()
+        if exporter is not None:
+            exporter.stop()
+
+
+class StoppableProcess():
+    """
+    Runs a plugin in its own process, with the same start/join/stop interface as StoppableThread.
+    The plugin is instantiated in the child from its spec, so CPU bound work does not share the GIL
+    with other plugins.
+    """
+
+    def __init__(self, spec: PluginSpec, log_queue: Any):
+        context = multiprocessing.get_context("spawn")
+        self._stop_event = context.Event()
+        self._process = context.Process(target=run_plugin_process,
+                                        args=(spec, self._stop_event, log_queue),
+                                        name=f"plugin-{spec.name}")
+
+    @property
+    def name(self) -> str:
+        return self._process.name
+
+    def start(self):
+        self._process.start()
+
+    def join(self, timeout=None):
+        self._process.join(timeout)
+
+    def is_alive(self) -> bool:
+        return self._process.is_alive()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def terminate(self):
+        """
+        Kill a plugin process that did not stop in time
+        """
+        self._process.terminate()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+
+class PluginProcess(StoppableProcess):
+    """
+    A plugin kept loaded in its own process in daemon mode, so its runs reuse the warm connection pools
+    and sessions of that process instead of starting a new process each time. run() sends the plugin,
+    or one of its jobs, to the process and waits for it.
+    """
+
+    def __init__(self, spec: PluginSpec, log_queue: Any):
+        context = multiprocessing.get_context("spawn")
+        self._stop_event = context.Event()
+        self._jobs = context.Queue()
+        self._events = context.Queue()
+        self._process = context.Process(target=serve_plugin_process,
+                                        args=(spec, self._stop_event, log_queue, self._jobs, self._events),
+                                        name=f"plugin-{spec.name}")
+        self._schedules: Optional[Dict[str, Dict[str, Any]]] = None
+        self._started = threading.Event()
+        # runs waiting for the process, by run id, and the error each finished run reported
+        self._runs: Dict[int, threading.Event] = {}
+        self._errors: Dict[int, Optional[str]] = {}
+        self._run_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def start(self):
+        super().start()
+        threading.Thread(target=self._collect, name=f"{self.name}-events", daemon=True).start()
+
+    def _collect(self):
+        while True:
+            try:
+                event = self._events.get(timeout=0.5)
+            except queue.Empty:
+                if not self._process.is_alive():
+                    break
+                continue
+            if event[0] == "schedules":
+                self._schedules = event[1]
+                self._started.set()
+                continue
+            _, run_id, error = event
+            with self._lock:
+                self._errors[run_id] = error
+                finished = self._runs.pop(run_id)
+            finished.set()
+        self._started.set()
+
+    def schedules(self, timeout: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        The schedules() of the plugin, once the process created it
+        """
+        self._started.wait(timeout)
+        if self._schedules is None:
+            raise RuntimeError(f"{self.name} did not start")
+        return self._schedules
+
+    def run(self, token: CancellationToken, job: Optional[str] = None):
+        """
+        Run the plugin, or its job 'job', in the process and wait for it. Once 'token' is cancelled the
+        process is stopped, and returns after its runs saved their progress.
+        """
+        finished = threading.Event()
+        with self._lock:
+            run_id = next(self._run_ids)
+            self._runs[run_id] = finished
+        self._jobs.put((run_id, job))
+        while not finished.wait(0.5):
+            if token.cancelled() and not self.stopped():
+                self.stop()
+            if not self._process.is_alive() and not finished.wait(0.5):
+                raise RuntimeError(f"{self.name} exited before running {job or 'the plugin'}")
+        with self._lock:
+            error = self._errors.pop(run_id)
+        if error is not None:
+            raise RuntimeError(error)
@@ -0,0 +1,148 @@
+import logging
+import os
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine, make_url
+
+DEFAULT_DB_POOL_SIZE = 5
+DEFAULT_DB_MAX_OVERFLOW = 10
+# connections idle for longer are replaced, before servers or proxies drop them
+DEFAULT_DB_POOL_RECYCLE = 1800
+DEFAULT_HTTP_POOL_SIZE = 10
+HEALTH_CHECK_TIMEOUT = 10
+
+
+def database_key(url: str) -> str:
+    """
+    A database url without its password, to log and report it
+    """
+    return make_url(url).render_as_string(hide_password=True)
+
+
+def pool_caps_from_environment() -> Dict[str, Optional[int]]:
+    """
+    The pool sizes set with PSYSTEM_DB_POOL_SIZE, PSYSTEM_DB_MAX_OVERFLOW and PSYSTEM_HTTP_POOL_SIZE,
+    as keyword arguments of ResourceRegistry.configure()
+    """
+    def env_int(name: str) -> Optional[int]:
+        value = os.environ.get(name)
+        return int(value) if value else None
+
+    return {"db_pool_size": env_int("PSYSTEM_DB_POOL_SIZE"),
+            "db_max_overflow": env_int("PSYSTEM_DB_MAX_OVERFLOW"),
+            "http_pool_size": env_int("PSYSTEM_HTTP_POOL_SIZE")}
+
+
+def host_key(url: str) -> str:
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+class ResourceRegistry():
+    """
+    Pooled connections shared by every plugin of the process: one SQLAlchemy engine per database url and
+    one requests session per API host, so plugins and indicators targeting the same server share a
+    bounded pool instead of opening their own.
+
+    Engines check connections with a ping when they are taken from the pool. Pool sizes set with
+    configure() apply to every engine or session, otherwise the size asked for by the first plugin to use
+    a resource is kept. Each process has its own registry, so the sizes cap the connections of a process.
+    """
+    def __init__(self, logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.db_pool_size: Optional[int] = None
+        self.db_max_overflow: Optional[int] = None
+        self.http_pool_size: Optional[int] = None
+        self._engines: Dict[str, Engine] = {}
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, db_pool_size: Optional[int] = None, db_max_overflow: Optional[int] = None,
+                  http_pool_size: Optional[int] = None):
+        """
+        Pool sizes for the resources created from now on, used instead of the sizes plugins ask for,
+        e.g. to cap the connections of all plugins to a database
+        """
+        self.db_pool_size = db_pool_size
+        self.db_max_overflow = db_max_overflow
+        self.http_pool_size = http_pool_size
+
+    def engine(self, url: str, pool_size: Optional[int] = None, max_overflow: Optional[int] = None) -> Engine:
+        """
+        The engine of the database at 'url', created on first use
+        """
+        with self._lock:
+            if url not in self._engines:
+                pool_size = self.db_pool_size or pool_size or DEFAULT_DB_POOL_SIZE
+                max_overflow = self.db_max_overflow if self.db_max_overflow is not None else (
+                    max_overflow if max_overflow is not None else DEFAULT_DB_MAX_OVERFLOW)
+                self._engines[url] = create_engine(url, pool_size=pool_size, max_overflow=max_overflow,
+                                                   pool_pre_ping=True, pool_recycle=DEFAULT_DB_POOL_RECYCLE)
+                self.logger.debug(f"Created a pool of {pool_size} connections to {database_key(url)}")
+            return self._engines[url]
+
+    def session(self, url: str, pool_size: Optional[int] = None) -> requests.Session:
+        """
+        The HTTP session of the host of 'url', created on first use. Connections are kept alive and
+        at most 'pool_size' of them are kept open.
+        """
+        key = host_key(url)
+        with self._lock:
+            if key not in self._sessions:
+                pool_size = self.http_pool_size or pool_size or DEFAULT_HTTP_POOL_SIZE
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+                session.mount(f"{urlparse(url).scheme}://", adapter)
+                self._sessions[key] = session
+                self.logger.debug(f"Created a session with {pool_size} connections to {key}")
+            return self._sessions[key]
+
+    def health_check(self) -> Dict[str, Optional[str]]:
+        """
+        Check every database with a query and every host with a HEAD request. Returns the error of each
+        resource, None when healthy. The pool of an unhealthy database is emptied, so no broken
+        connection is handed out again.
+        """
+        with self._lock:
+            engines = dict(self._engines)
+            sessions = dict(self._sessions)
+        results: Dict[str, Optional[str]] = {}
+        for url, engine in engines.items():
+            key = database_key(url)
+            try:
+                with engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+                results[key] = None
+            except Exception as e:
+                results[key] = str(e)
+                engine.dispose()
+                self.logger.warning(f"Database {key} failed its health check: {e}")
+        for key, session in sessions.items():
+            try:
+                response = session.head(key, timeout=HEALTH_CHECK_TIMEOUT)
+                results[key] = None if response.status_code < 500 else f"HTTP {response.status_code}"
+            except Exception as e:
+                results[key] = str(e)
+            if results[key] is not None:
+                self.logger.warning(f"Host {key} failed its health check: {results[key]}")
+        return results
+
+    def close(self):
+        """
+        Close every pool and session, e.g. on shutdown
+        """
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            for session in self._sessions.values():
+                session.close()
+            self._engines = {}
+            self._sessions = {}
+
+
+# resources of every plugin of the process
+registry = ResourceRegistry()
@@ -0,0 +1,244 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from core.constants import SCHEDULER_WORKERS
+from core.metrics import registry as metrics
+from core.thread import CancellationToken
+
+# how often the scheduler wakes up without a due job, so schedules added later are picked up
+MAX_SLEEP = 60.0
+CRON_FIELDS = (
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 6),
+)
+
+
+class IntervalSchedule():
+    """
+    Runs a job every 'seconds' seconds, the first time as soon as the scheduler starts
+    """
+    def __init__(self, seconds: float):
+        if seconds <= 0:
+            raise ValueError(f"A schedule interval must be positive, got {seconds}")
+        self.seconds = seconds
+
+    def first_run(self, now: float) -> float:
+        return now
+
+    def next_run(self, previous: float, now: float) -> float:
+        # runs missed while the previous one was in flight are not made up for
+        return max(previous + self.seconds, now)
+
+
+def _cron_field(text: str, name: str, low: int, high: int) -> Set[int]:
+    values: Set[int] = set()
+    for part in text.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+        if part == "*":
+            start, stop = low, high
+        elif "-" in part:
+            start, stop = (int(value) for value in part.split("-", 1))
+        else:
+            start = stop = int(part)
+            if step > 1:
+                stop = high
+        if start < low or stop > high or start > stop or step < 1:
+            raise ValueError(f"Invalid cron {name} '{text}'")
+        values.update(range(start, stop + 1, step))
+    return values
+
+
+class CronSchedule():
+    """
+    Runs a job at the local times matching a 5 field cron expression: minute, hour, day of month,
+    month and day of week (0 or 7 is Sunday), with '*', lists, ranges and '/' steps. As in cron, a job
+    restricted on both days of month and days of week runs on either.
+    """
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"A cron expression needs 5 fields, got '{expression}'")
+        parsed = []
+        for text, (name, low, high) in zip(fields, CRON_FIELDS):
+            try:
+                values = _cron_field(text, name, low, 7 if name == "weekday" else high)
+            except ValueError as e:
+                raise ValueError(f"Invalid cron expression '{expression}': {e}") from e
+            if name == "weekday" and 7 in values:
+                values = (values - {7}) | {0}
+            parsed.append(values)
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = parsed
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def matches_day(self, moment: datetime) -> bool:
+        in_days = moment.day in self.days
+        # python counts weekdays from Monday, cron from Sunday
+        in_weekdays = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_time(self, after: datetime) -> datetime:
+        moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # a matching minute is at most a few years away, e.g. February 29th
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self.matches_day(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f"Cron expression '{self.expression}' never matches")
+
+    def first_run(self, now: float) -> float:
+        return self.next_time(datetime.fromtimestamp(now)).timestamp()
+
+    def next_run(self, previous: float, now: float) -> float:
+        return self.next_time(datetime.fromtimestamp(max(previous, now))).timestamp()
+
+
+def schedule_from(config: Dict[str, Any]) -> Any:
+    """
+    Schedule of a config section with an 'interval' in seconds or a 'cron' expression
+    """
+    if "interval" in config:
+        return IntervalSchedule(float(config["interval"]))
+    if "cron" in config:
+        return CronSchedule(str(config["cron"]))
+    raise ValueError(f"A schedule needs an 'interval' or a 'cron' expression, got {config}")
+
+
+class Job():
+    """
+    Work run by the scheduler: 'run' is called with the scheduler's cancellation token
+    """
+    def __init__(self, key: str, run: Callable[[CancellationToken], Any], schedule: Any, priority: int = 0):
+        self.key = key
+        self.run = run
+        self.schedule = schedule
+        # jobs with a higher priority are started first when more jobs are due than there are workers
+        self.priority = priority
+        self.next_run: Optional[float] = None
+
+
+class Scheduler():
+    """
+    Runs jobs on their schedules with a bounded pool of 'workers' threads, until the token is cancelled.
+
+    Due jobs wait in a priority queue for a free worker. A job that is due while its previous run is
+    still queued or running is skipped, so a slow sync never piles up runs of the same key.
+    """
+    def __init__(self, logger: logging.Logger, workers: int = SCHEDULER_WORKERS,
+                 token: Optional[CancellationToken] = None, clock: Callable[[], float] = time.time):
+        self.logger = logger
+        self.workers = max(1, workers)
+        self.token = token if token is not None else CancellationToken()
+        self.clock = clock
+        self.jobs: List[Job] = []
+        self._queue: List[Tuple[int, int, Job]] = []
+        self._order = itertools.count()
+        self._in_flight: Set[str] = set()
+        self._condition = threading.Condition()
+        self._threads: List[threading.Thread] = []
+
+    def add(self, job: Job):
+        if any(existing.key == job.key for existing in self.jobs):
+            raise ValueError(f"A job '{job.key}' is already scheduled")
+        job.next_run = job.schedule.first_run(self.clock())
+        with self._condition:
+            self.jobs.append(job)
+            self._condition.notify_all()
+
+    def in_flight(self, key: str) -> bool:
+        with self._condition:
+            return key in self._in_flight
+
+    def dispatch(self, now: float) -> Optional[float]:
+        """
+        Queue the jobs due at 'now'. Returns when the next job is due, None without jobs.
+        """
+        with self._condition:
+            for job in self.jobs:
+                assert job.next_run is not None
+                if job.next_run > now:
+                    continue
+                if job.key in self._in_flight:
+                    self.logger.info(f"Skipping the run of {job.key}, the previous one is still in flight")
+                    metrics.inc("scheduler_skipped_total", job=job.key)
+                else:
+                    self._in_flight.add(job.key)
+                    heapq.heappush(self._queue, (-job.priority, next(self._order), job))
+                    self._condition.notify()
+                job.next_run = job.schedule.next_run(job.next_run, now)
+            return min((job.next_run for job in self.jobs if job.next_run is not None), default=None)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self.token.cancelled():
+                    self._condition.wait()
+                if self.token.cancelled():
+                    return
+                _, _, job = heapq.heappop(self._queue)
+            self.logger.info(f"Running {job.key}")
+            try:
+                with metrics.time("scheduler_run_seconds", job=job.key):
+                    job.run(self.token)
+                metrics.inc("scheduler_runs_total", job=job.key)
+            except Exception as e:
+                metrics.inc("scheduler_failures_total", job=job.key)
+                self.logger.error(f"Scheduled run of {job.key} failed: {e}")
+            finally:
+                with self._condition:
+                    self._in_flight.discard(job.key)
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._work, name=f"scheduler-{index}", daemon=True)
+                         for index in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def run(self):
+        """
+        Run due jobs until the token is cancelled
+        """
+        self.start()
+        while not self.token.cancelled():
+            now = self.clock()
+            next_run = self.dispatch(now)
+            sleep = MAX_SLEEP if next_run is None else min(MAX_SLEEP, max(0.0, next_run - now))
+            self.token.wait(sleep)
+
+    def stop(self, timeout: Optional[float] = None) -> List[str]:
+        """
+        Cancel the token, drop queued runs and wait up to 'timeout' seconds for running jobs.
+        Returns the keys of the jobs still running.
+        """
+        self.token.cancel()
+        with self._condition:
+            for _, _, job in self._queue:
+                self._in_flight.discard(job.key)
+            self._queue = []
+            self._condition.notify_all()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        with self._condition:
+            return sorted(self._in_flight)
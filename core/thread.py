@@ -1,23 +1,54 @@
 import threading
+from typing import Any, Optional
+from core.exceptions import CancelledError
+
+
+class CancellationToken():
+    """
+    Cooperative cancellation signal handed to a plugin's execute(). Long running work checks
+    cancelled() at safe points, e.g. between pages, finishes what is in flight and returns.
+    The token can wrap a multiprocessing event so a parent process can cancel work in a child.
+    """
+
+    def __init__(self, event: Optional[Any] = None):
+        self._event = event if event is not None else threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the token is cancelled or 'timeout' seconds passed. Returns True if cancelled.
+        """
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        if self.cancelled():
+            raise CancelledError("Cancelled")
 
 
 class StoppableThread(threading.Thread):
     """
     Thread class with a stop() method. The thread itself has to check
-    regularly for the stopped() condition. When the thread is signaled
-    to stop, it also runs a custom stop function that might do some clean up.
+    regularly for the stopped() condition, e.g. through the cancellation token
+    it was given. When the thread is signaled to stop, it also runs a custom
+    stop function that might do some clean up.
     """
 
     def __init__(self, *args, **kwargs):
         stop_func = kwargs["stop"]
         del kwargs["stop"]
+        token = kwargs.pop("token", None)
         super(StoppableThread, self).__init__(*args, **kwargs)
-        self._stop_event = threading.Event()
+        self.token = token if token is not None else CancellationToken()
         self.stop_func = stop_func
 
     def stop(self):
-        self._stop_event.set()
+        self.token.cancel()
         self.stop_func()
 
     def stopped(self):
-        return self._stop_event.is_set()
+        return self.token.cancelled()
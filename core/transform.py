@@ -0,0 +1,208 @@
+import logging
+import operator
+import os
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+# leading number of GHO 'Value' strings such as "12.3 [10.5-14.2]" or "1 234", once spaces are removed
+NUMBER_PATTERN = r"^([-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)"
+
+COMPARISONS: Dict[str, Callable[[Any, Any], Any]] = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "lt": operator.lt,
+    "le": operator.le,
+    "gt": operator.gt,
+    "ge": operator.ge,
+}
+
+Step = Callable[[DataFrame], DataFrame]
+
+
+def _mapping(section: str, value: Any) -> Dict[str, str]:
+    """
+    A {source: target} mapping from a mapping, or a list of columns transformed in place
+    """
+    if isinstance(value, dict):
+        return {str(key): str(target if target is not None else key) for key, target in value.items()}
+    if isinstance(value, list):
+        return {str(column): str(column) for column in value}
+    raise ValueError(f"Transform '{section}' must be a mapping or a list of columns")
+
+
+def select_columns(columns: Dict[str, str]) -> Step:
+    selected = list(columns.keys())
+
+    def step(df: DataFrame) -> DataFrame:
+        return df[selected].rename(columns=columns)
+    return step
+
+
+def parse_numbers(columns: Dict[str, str]) -> Step:
+    def step(df: DataFrame) -> DataFrame:
+        for source, target in columns.items():
+            text = df[source].astype("string").str.replace(r"\s+", "", regex=True)
+            df[target] = pd.to_numeric(text.str.extract(NUMBER_PATTERN, expand=False), errors="coerce")
+        return df
+    return step
+
+
+def parse_dates(columns: Dict[str, str], date_format: Optional[str] = None) -> Step:
+    def step(df: DataFrame) -> DataFrame:
+        for source, target in columns.items():
+            df[target] = pd.to_datetime(df[source], utc=True, errors="coerce", format=date_format or "ISO8601")
+        return df
+    return step
+
+
+def cast_columns(casts: Dict[str, str]) -> Step:
+    numeric = {}
+    for column, dtype in casts.items():
+        try:
+            pandas_dtype = pd.api.types.pandas_dtype(dtype)
+        except TypeError as e:
+            raise ValueError(f"Unknown dtype '{dtype}' for column '{column}'") from e
+        numeric[column] = pandas_dtype.kind in "iuf"
+
+    def step(df: DataFrame) -> DataFrame:
+        for column, dtype in casts.items():
+            values = pd.to_numeric(df[column], errors="coerce") if numeric[column] else df[column]
+            df[column] = values.astype(dtype)
+        return df
+    return step
+
+
+def derive_columns(expressions: Dict[str, str]) -> Step:
+    def step(df: DataFrame) -> DataFrame:
+        for column, expression in expressions.items():
+            df[column] = df.eval(expression)
+        return df
+    return step
+
+
+def filter_rows(filters: List[Dict[str, Any]]) -> Step:
+    conditions = []
+    for condition in filters:
+        column, op, value = condition.get("column"), condition.get("op", "eq"), condition.get("value")
+        if column is None:
+            raise ValueError(f"Transform filter {condition} needs a 'column'")
+        if op not in COMPARISONS and op not in ("in", "not_in", "null", "not_null"):
+            raise ValueError(f"Unknown transform filter operator '{op}'")
+        conditions.append((column, op, value))
+
+    def step(df: DataFrame) -> DataFrame:
+        mask = np.ones(len(df), dtype=bool)
+        for column, op, value in conditions:
+            series = df[column]
+            if op == "in":
+                matches = series.isin(value)
+            elif op == "not_in":
+                matches = ~series.isin(value)
+            elif op == "null":
+                matches = series.isna()
+            elif op == "not_null":
+                matches = series.notna()
+            else:
+                matches = COMPARISONS[op](series, value).fillna(False)
+            mask &= np.asarray(matches, dtype=bool)
+        return df.take(np.flatnonzero(mask))
+    return step
+
+
+def lookup(config: Dict[str, Any], base_directory: Optional[str] = None) -> Step:
+    """
+    Map a column through an inline 'values' table, or left join a small dimension table read once
+    from a CSV 'path' on the 'on' column
+    """
+    on = config.get("on") or config.get("column")
+    if on is None:
+        raise ValueError(f"Transform lookup {config} needs an 'on' column")
+
+    if "values" in config:
+        table = pd.Series(config["values"])
+        target = config.get("target", on)
+        default = config.get("default")
+
+        def map_step(df: DataFrame) -> DataFrame:
+            mapped = df[on].map(table)
+            df[target] = mapped if default is None else mapped.fillna(default)
+            return df
+        return map_step
+
+    if "path" not in config:
+        raise ValueError(f"Transform lookup on '{on}' needs 'values' or a 'path'")
+    path = os.path.join(base_directory or "", os.path.expanduser(config["path"]))
+    dimension = pd.read_csv(path, dtype={config.get("key", on): "string"})
+    dimension = dimension.rename(columns={config.get("key", on): on})
+    columns = config.get("columns") or [column for column in dimension.columns if column != on]
+    dimension = dimension[[on] + list(columns)].drop_duplicates(on)
+
+    def join_step(df: DataFrame) -> DataFrame:
+        keys = df[on].astype("string")
+        joined = dimension.set_index(on).reindex(keys)
+        for column in columns:
+            df[column] = joined[column].to_numpy()
+        return df
+    return join_step
+
+
+class TransformPlan():
+    """
+    A transform section of a plugin config compiled once into vectorized pandas steps.
+
+    The sections are applied to every batch in the order they appear in the config:
+
+    columns   {source: target} columns to keep, renamed
+    numeric   {source: target} numbers parsed from text, e.g. GHO 'Value' strings like "12.3 [10.5-14.2]"
+    dates     {source: target} ISO 8601 strings parsed as UTC timestamps
+    casts     {column: dtype} pandas dtypes, e.g. Int64, float64, category
+    derive    {column: expression} columns computed with DataFrame.eval, e.g. "TimeDim // 10 * 10"
+    lookups   list of {on, values | path, target | columns} maps or joins against small dimension tables
+    filters   list of {column, op, value} rows to keep, op one of eq, ne, lt, le, gt, ge, in, not_in,
+              null, not_null
+
+    Steps work on whole columns, never on single rows, so plugins don't need 'apply' based code.
+    """
+    def __init__(self, steps: List[Step], source_columns: Optional[List[str]] = None):
+        self.steps = steps
+        # the fields a batch needs before the plan runs, None when every field is kept
+        self.source_columns = source_columns
+
+    @classmethod
+    def compile(cls, config: Dict[str, Any], base_directory: Optional[str] = None) -> "TransformPlan":
+        steps: List[Step] = []
+        source_columns = None
+        for section, value in (config or {}).items():
+            if section == "columns":
+                columns = _mapping(section, value)
+                # fields read by the steps before it are only known once they ran, so a batch is only
+                # projected when 'columns' is the first step
+                if not steps:
+                    source_columns = list(columns.keys())
+                steps.append(select_columns(columns))
+            elif section == "numeric":
+                steps.append(parse_numbers(_mapping(section, value)))
+            elif section == "dates":
+                steps.append(parse_dates(_mapping(section, value), config.get("date_format")))
+            elif section == "casts":
+                steps.append(cast_columns(dict(value)))
+            elif section == "derive":
+                steps.append(derive_columns(dict(value)))
+            elif section == "lookups":
+                steps.extend(lookup(item, base_directory) for item in value)
+            elif section == "filters":
+                steps.append(filter_rows(list(value)))
+            elif section != "date_format":
+                raise ValueError(f"Unknown transform section '{section}'")
+        return cls(steps, source_columns)
+
+    def apply(self, df: DataFrame, logger: Optional[logging.Logger] = None) -> DataFrame:
+        # steps assign whole columns, which a shallow copy keeps off the caller's data frame
+        df = df.copy(deep=False)
+        for step in self.steps:
+            df = step(df)
+        if logger is not None:
+            logger.debug(f"Applied {len(self.steps)} transform steps to {len(df)} rows")
+        return df
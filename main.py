@@ -1,7 +1,25 @@
-from core.plugin import PluginCore
-from core.thread import StoppableThread
+import logging
+import os
+import time
+from functools import partial
+from typing import Any, Callable, List
+from core.metrics import profiled_target
+from core.plugin import PluginCore, PluginSpec, execute_plugin, run_plugin
+from core.process import PluginProcess, StoppableProcess, start_log_listener
+from core.resources import pool_caps_from_environment
+from core.scheduler import IntervalSchedule, Job, Scheduler, schedule_from
+from core.thread import CancellationToken, StoppableThread
 from core.setup import configure_logger, create_directory_with_empty_status_file
-from core.constants import PLUGINS_DIRECTORY
+from core.constants import (HEALTH_CHECK_INTERVAL, PLUGINS_DIRECTORY, PROCESS_START_TIMEOUT, PROFILES_DIRECTORY,
+                            SCHEDULER_WORKERS, STOP_DEADLINE)
+
+
+def stop_deadline() -> float:
+    return float(os.environ.get("PSYSTEM_STOP_DEADLINE", STOP_DEADLINE))
+
+
+def profile_directory() -> str:
+    return os.path.join(os.path.expanduser("~"), PROFILES_DIRECTORY)
 
 
 def run():
@@ -12,14 +30,52 @@ def run():
     logger = configure_logger()
 
     core = PluginCore(logger, PLUGINS_DIRECTORY, create_directory_with_empty_status_file)
-    plugins = core.load_plugins()
+    # plugin processes apply the same caps to their own registry
+    core.configure_resources(**pool_caps_from_environment())
+    specs = core.discover_plugins()
+
+    metrics_port = os.environ.get("PSYSTEM_METRICS_PORT")
+    exporters = core.start_metrics_exporters(
+        prometheus_port=int(metrics_port) if metrics_port else None,
+        json_path=os.environ.get("PSYSTEM_METRICS_JSON"),
+        json_interval=float(os.environ.get("PSYSTEM_METRICS_INTERVAL", 30)))
+
+    # plugins configured with 'executor: process' log through a queue back to this logger
+    log_queue, log_listener = start_log_listener(logger)
 
-    threads = []
+    try:
+        if os.environ.get("PSYSTEM_DAEMON"):
+            run_daemon(core, specs, logger, log_queue)
+        else:
+            run_once(specs, logger, log_queue)
+    finally:
+        # connection pools shared by the plugins are closed once none of them runs
+        core.shutdown()
+        for exporter in exporters:
+            exporter.stop()
+        log_listener.stop()
+
+
+def run_once(specs: List[PluginSpec], logger: logging.Logger, log_queue: Any):
+    """
+    Run every plugin once, concurrently, and return when all of them finished
+    """
+    threads: List[Any] = []
 
-    for plugin in plugins:
-        # plugins run ETL jobs that are independent of each other, therefore run them in threads
-        thread = StoppableThread(target=plugin.execute, stop=plugin.stop)
-        threads.append(thread)
+    for spec in specs:
+        if spec.executor == "process":
+            # CPU heavy plugins run in their own process so they don't compete for the GIL
+            threads.append(StoppableProcess(spec, log_queue))
+        else:
+            # plugins run ETL jobs that are independent of each other, therefore run them in threads
+            plugin = spec.create(logger)
+            token = CancellationToken()
+            target = run_plugin
+            if spec.profile:
+                target = profiled_target(target, spec.name, profile_directory(), logger)
+            # daemon threads so a plugin that does not stop within the deadline can't keep the program alive
+            threads.append(StoppableThread(target=target, args=(plugin, token), stop=plugin.stop, token=token,
+                                           name=f"plugin-{spec.name}", daemon=True))
 
     try:
         # Start all threads
@@ -35,8 +91,89 @@ def run():
         # run some stop function like saving the current status of the ETL job
         # before exiting gracefully.
         # TODO(allan): Investigate this mechanism further and improve
+        # Plugins get a cancellation token, they finish their in-flight batches and save
+        # their status, and are given up on after PSYSTEM_STOP_DEADLINE seconds.
         for thread in threads:
             thread.stop()
+        deadline = time.monotonic() + stop_deadline()
+        # keep forwarding plugin process logs until they are done
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        for thread in threads:
+            if thread.is_alive():
+                logger.warning(f"{thread.name} did not stop within the deadline, exiting without it")
+                if isinstance(thread, StoppableProcess):
+                    thread.terminate()
+
+
+def run_daemon(core: PluginCore, specs: List[PluginSpec], logger: logging.Logger, log_queue: Any):
+    """
+    Keep the plugins loaded and run them, or their own jobs, on their schedules until CTRL + C.
+    Plugins stay instantiated between runs, in this process or in a plugin process of their own, so their
+    connection pools and sessions stay warm.
+    """
+    scheduler = Scheduler(logger, workers=int(os.environ.get("PSYSTEM_WORKERS", SCHEDULER_WORKERS)))
+    plugins = []
+    processes = []
+
+    for spec in specs:
+        run_plugin_job: Callable[..., Any]
+        if spec.executor == "process":
+            # the plugin process runs every job of the plugin, and profiles its runs itself
+            process = PluginProcess(spec, log_queue)
+            process.start()
+            processes.append(process)
+            try:
+                schedules = process.schedules(PROCESS_START_TIMEOUT)
+            except RuntimeError as e:
+                logger.error(f"Plugin '{spec.name}' won't run in daemon mode: {e}")
+                continue
+            run_plugin_job = process.run
+        else:
+            plugin = spec.create(logger)
+            plugins.append(plugin)
+            schedules = plugin.schedules()
+            run_plugin_job = partial(execute_plugin, plugin)
+
+        for job, schedule in schedules.items():
+            scheduler.add(Job(f"{spec.name}/{job}", partial(run_plugin_job, job=job), schedule_from(schedule),
+                              int(schedule.get("priority", spec.priority))))
+        if schedules:
+            continue
+        if spec.schedule is None:
+            logger.warning(f"Plugin '{spec.name}' has no schedule, it won't run in daemon mode")
+            continue
+        target = run_plugin_job
+        if spec.profile and spec.executor != "process":
+            target = profiled_target(target, spec.name, profile_directory(), logger)
+        scheduler.add(Job(spec.name, target, schedule_from(spec.schedule), spec.priority))
+
+    # broken pooled connections are dropped between runs rather than found by the next run
+    health_interval = float(os.environ.get("PSYSTEM_HEALTH_INTERVAL", HEALTH_CHECK_INTERVAL))
+    scheduler.add(Job("resources/health", lambda token: core.resources.health_check(),
+                      IntervalSchedule(health_interval), priority=-1))
+
+    logger.info(f"Running {len(scheduler.jobs)} scheduled jobs with {scheduler.workers} workers")
+    deadline = None
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        # runs in flight get the cancelled token, finish their batches and save their status
+        deadline = time.monotonic() + stop_deadline()
+        for plugin in plugins:
+            plugin.stop()
+        for key in scheduler.stop(stop_deadline()):
+            logger.warning(f"{key} did not stop within the deadline, exiting without it")
+    finally:
+        for plugin in plugins:
+            plugin.close()
+        for process in processes:
+            process.stop()
+        for process in processes:
+            process.join(stop_deadline() if deadline is None else max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"{process.name} did not stop within the deadline, exiting without it")
+                process.terminate()
 
 
 if __name__ == "__main__":
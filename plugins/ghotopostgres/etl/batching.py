@@ -0,0 +1,124 @@
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from pandas import DataFrame
+
+DEFAULT_MIN_PAGE_SIZE = 100
+DEFAULT_MAX_PAGE_SIZE = 10000
+DEFAULT_TARGET_LATENCY = 2.0
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+DEFAULT_BATCH_ROWS = 50000
+DEFAULT_BATCH_BYTES = 64 * 1024 * 1024
+# weight of the latest page in the moving averages
+SMOOTHING = 0.3
+
+
+class AdaptivePageSize():
+    """
+    Picks the OData '$top' of the next page from the pages fetched so far.
+
+    The page size doubles while full pages come back in under half of 'target_latency' seconds, and
+    shrinks in proportion when they take longer than it. It never exceeds what fits 'memory_budget'
+    bytes with 'pages_in_flight' pages fetched, decoded or waiting to be loaded at once, using the
+    moving average of response bytes per row, and stays between 'minimum' and 'maximum'.
+
+    A page that comes back short of a '$top' larger than any page returned in full, e.g. when the server
+    caps '$top', caps the page size at the largest size returned in full, or at the rows of that page.
+    """
+    def __init__(self, initial: int, minimum: int = DEFAULT_MIN_PAGE_SIZE, maximum: int = DEFAULT_MAX_PAGE_SIZE,
+                 target_latency: float = DEFAULT_TARGET_LATENCY, memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                 pages_in_flight: int = 1):
+        if minimum < 1 or maximum < minimum:
+            raise ValueError(f"Page sizes need 1 <= min_page_size <= max_page_size, got {minimum} and {maximum}")
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.memory_budget = memory_budget
+        self.pages_in_flight = max(1, pages_in_flight)
+        self.latency: Optional[float] = None
+        self.bytes_per_row: Optional[float] = None
+        # the largest '$top' the server answered in full, and the page size it caps growth at
+        self.largest_full = 0
+        self.ceiling: Optional[int] = None
+        self._size = self.clamp(initial)
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def clamp(self, size: float) -> int:
+        limit = self.maximum
+        if self.bytes_per_row:
+            limit = min(limit, int(self.memory_budget / (self.bytes_per_row * self.pages_in_flight)))
+        size = max(self.minimum, min(limit, int(size)))
+        # the server's cap wins over 'minimum', larger pages come back short anyway
+        return size if self.ceiling is None else min(size, self.ceiling)
+
+    def observe(self, requested: int, rows: int, seconds: float, payload_bytes: int) -> int:
+        """
+        Record a page of 'rows' rows fetched with '$top' 'requested', and return the next page size
+        """
+        with self._lock:
+            if rows > 0:
+                bytes_per_row = payload_bytes / rows
+                self.bytes_per_row = bytes_per_row if self.bytes_per_row is None else (
+                    SMOOTHING * bytes_per_row + (1 - SMOOTHING) * self.bytes_per_row)
+            self.latency = seconds if self.latency is None else (
+                SMOOTHING * seconds + (1 - SMOOTHING) * self.latency)
+            if rows >= requested:
+                self.largest_full = max(self.largest_full, requested)
+                if self.ceiling is not None and requested > self.ceiling:
+                    # the short page was the last one rather than a cap
+                    self.ceiling = None
+            elif 0 < rows and requested > self.largest_full:
+                self.ceiling = max(self.largest_full, rows)
+            size: float = self._size
+            # pages of other sizes, or the short last page, say little about the current size
+            if requested == self._size and rows == requested:
+                if self.latency > self.target_latency:
+                    size = size * max(0.5, self.target_latency / self.latency)
+                elif self.latency < self.target_latency / 2:
+                    size = size * 2
+            self._size = self.clamp(size)
+            return self._size
+
+
+class PageBatcher():
+    """
+    Collects consecutive transformed pages until they hold 'max_rows' rows or 'max_bytes' bytes of
+    data frame memory, so they are loaded as a single batch
+    """
+    def __init__(self, max_rows: int = DEFAULT_BATCH_ROWS, max_bytes: int = DEFAULT_BATCH_BYTES):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self._pages: List[Tuple[Any, int, DataFrame]] = []
+        self._rows = 0
+        self._bytes = 0
+
+    def add(self, page: Tuple[Any, int, DataFrame]) -> Optional[List[Tuple[Any, int, DataFrame]]]:
+        """
+        Add a (position, rows, data frame) page. Returns the pages of the batch once it is full.
+        """
+        df = page[2]
+        self._pages.append(page)
+        self._rows += len(df)
+        self._bytes += int(df.memory_usage(index=False, deep=True).sum())
+        if self._rows >= self.max_rows or self._bytes >= self.max_bytes:
+            return self.drain()
+        return None
+
+    def drain(self) -> List[Tuple[Any, int, DataFrame]]:
+        pages = self._pages
+        self._pages = []
+        self._rows = 0
+        self._bytes = 0
+        return pages
+
+
+def adaptive_page_size(config: Dict[str, Any], page_size: int, pages_in_flight: int) -> AdaptivePageSize:
+    return AdaptivePageSize(page_size,
+                            minimum=int(config.get("min_page_size", min(page_size, DEFAULT_MIN_PAGE_SIZE))),
+                            maximum=int(config.get("max_page_size", max(page_size, DEFAULT_MAX_PAGE_SIZE))),
+                            target_latency=float(config.get("target_latency", DEFAULT_TARGET_LATENCY)),
+                            memory_budget=int(config.get("memory_budget", DEFAULT_MEMORY_BUDGET)),
+                            pages_in_flight=pages_in_flight)
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class CachedResponse():
+    """
+    A response body read from the cache, with the validators the server sent along with it
+    """
+    __slots__ = ("body", "etag", "last_modified", "fresh")
+
+    def __init__(self, body: bytes, etag: Optional[str], last_modified: Optional[str], fresh: bool):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fresh = fresh
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """
+        Headers asking the server to answer 304 Not Modified if the cached body is still current
+        """
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache():
+    """
+    Compressed API responses on local disk, keyed on the request url.
+
+    Entries are fresh for 'ttl' seconds. Stale entries with an ETag or Last-Modified validator are
+    revalidated with a conditional request instead of downloaded again. Once the cache holds more than
+    'max_bytes' of compressed bodies the least recently used entries are evicted. Files are written
+    through a temporary file and replaced atomically, so ETLs in other threads or processes can share
+    a directory.
+    """
+    def __init__(self, directory: str, logger: logging.Logger, ttl: float = DEFAULT_TTL,
+                 max_bytes: int = DEFAULT_MAX_BYTES, compression_level: int = 6):
+        self.directory = directory
+        self.logger = logger
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.compression_level = compression_level
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith(".z"))
+
+    def _paths(self, url: str):
+        name = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, f"{name}.z"), os.path.join(self.directory, f"{name}.json")
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        """
+        The cached response for 'url', fresh or stale, or None
+        """
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, "r") as file:
+                meta = json.load(file)
+            with open(body_path, "rb") as file:
+                body = zlib.decompress(file.read())
+            # the body file's mtime is its last use, for eviction
+            os.utime(body_path)
+        except (OSError, ValueError, zlib.error):
+            return None
+        if meta.get("url") != url:
+            return None
+        fresh = time.time() - meta["stored_at"] < self.ttl
+        return CachedResponse(body, meta.get("etag"), meta.get("last_modified"), fresh)
+
+    def put(self, url: str, body: bytes, headers: Optional[Dict[str, Any]] = None):
+        """
+        Store a response body with the validators found in its headers
+        """
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        body_path, meta_path = self._paths(url)
+        compressed = zlib.compress(body, self.compression_level)
+        try:
+            previous = os.path.getsize(body_path)
+        except OSError:
+            previous = 0
+        try:
+            self._write(body_path, compressed)
+            self._write(meta_path, json.dumps({"url": url,
+                                               "stored_at": time.time(),
+                                               "etag": headers.get("etag"),
+                                               "last_modified": headers.get("last-modified")}).encode())
+        except OSError as e:
+            self.logger.warning(f"Could not cache response of {url}: {e}")
+            return
+        with self._lock:
+            self._size += len(compressed) - previous
+            over_budget = self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def refresh(self, url: str):
+        """
+        Mark a cached response as fresh again, after the server answered 304 Not Modified
+        """
+        _, meta_path = self._paths(url)
+        try:
+            with open(meta_path, "r") as file:
+                meta = json.load(file)
+            meta["stored_at"] = time.time()
+            self._write(meta_path, json.dumps(meta).encode())
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Could not refresh cached response of {url}: {e}")
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is back under 'max_bytes'
+        """
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".z"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            size = sum(entry_size for _, entry_size, _ in entries)
+            for _, entry_size, body_path in sorted(entries):
+                if size <= self.max_bytes:
+                    break
+                for path in (body_path, f"{body_path[:-2]}.json"):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                size -= entry_size
+            self._size = size
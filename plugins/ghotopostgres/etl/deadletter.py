@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Any, Callable, List, Optional, Tuple
+import pandas as pd
+import psycopg2
+from pandas import DataFrame
+from sqlalchemy import exc
+from core.exceptions import CancelledError, SchemaMismatchError, TooManyBadRecordsError
+
+DEFAULT_MAX_BAD_ROWS = 1000
+# failures of the destination itself rather than of the rows, bisecting a batch would not get past them
+UNISOLATED_ERRORS = (OSError, MemoryError, CancelledError, SchemaMismatchError, psycopg2.OperationalError,
+                     psycopg2.InterfaceError, exc.OperationalError, exc.InterfaceError, exc.DisconnectionError)
+
+
+class DeadLetter():
+    """
+    A record that failed to be extracted, transformed or loaded, with the error it failed with.
+    'record' is the url of a page that could not be decoded, or a row as JSON.
+    """
+    __slots__ = ("id", "etl", "stage", "destination", "position", "record", "dtypes", "error")
+
+    def __init__(self, id: int, etl: str, stage: str, destination: str, position: str, record: str,
+                 dtypes: Optional[str], error: str):
+        self.id = id
+        self.etl = etl
+        self.stage = stage
+        self.destination = destination
+        self.position = position
+        self.record = record
+        self.dtypes = dtypes
+        self.error = error
+
+    def frame(self) -> DataFrame:
+        """
+        The row as a single row data frame with its original dtypes
+        """
+        df = pd.DataFrame([json.loads(self.record)])
+        dtypes = json.loads(self.dtypes) if self.dtypes else {}
+        for column, dtype in dtypes.items():
+            if column in df.columns:
+                try:
+                    df[column] = df[column].astype(dtype)
+                except (TypeError, ValueError):
+                    pass
+        return df
+
+
+class DeadLetterStore():
+    """
+    Records that failed to transform or load, kept in a local SQLite database so they can be inspected
+    and replayed instead of stopping the run they were part of. Each operation opens its own connection,
+    so ETLs in other threads or processes can share a database.
+    """
+    def __init__(self, path: str, logger: logging.Logger):
+        self.path = path
+        self.logger = logger
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letters ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, etl TEXT NOT NULL, stage TEXT NOT NULL, "
+                "destination TEXT NOT NULL, position TEXT, record TEXT NOT NULL, dtypes TEXT, "
+                "error TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 1, created REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS dead_letters_etl ON dead_letters (etl)")
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        return _Transaction(connection)
+
+    def add_rows(self, etl: str, stage: str, destination: str, position: Any, df: DataFrame, error: BaseException):
+        """
+        Record every row of 'df' as failing with 'error'
+        """
+        records = df.to_json(orient="records", date_format="iso", date_unit="us")
+        dtypes = json.dumps({str(column): str(dtype) for column, dtype in df.dtypes.items()})
+        now = time.time()
+        rows = [(etl, stage, destination, json.dumps(position, default=str), json.dumps(record), dtypes,
+                 f"{type(error).__name__}: {error}", now) for record in json.loads(records)]
+        self._insert(rows)
+
+    def add_page(self, etl: str, uri: str, position: Any, error: BaseException):
+        """
+        Record a page that could not be extracted, to be requested again on replay
+        """
+        self._insert([(etl, "extract", "", json.dumps(position, default=str), uri, None,
+                       f"{type(error).__name__}: {error}", time.time())])
+
+    def _insert(self, rows: List[Tuple[Any, ...]]):
+        with self._lock, self._connect() as connection:
+            connection.executemany(
+                "INSERT INTO dead_letters (etl, stage, destination, position, record, dtypes, error, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def pending(self, etl: str) -> List[DeadLetter]:
+        with self._lock, self._connect() as connection:
+            rows = connection.execute(
+                "SELECT id, etl, stage, destination, position, record, dtypes, error FROM dead_letters "
+                "WHERE etl = ? ORDER BY id", (etl,)).fetchall()
+        return [DeadLetter(*row) for row in rows]
+
+    def count(self, etl: Optional[str] = None) -> int:
+        with self._lock, self._connect() as connection:
+            if etl is None:
+                return connection.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+            return connection.execute("SELECT COUNT(*) FROM dead_letters WHERE etl = ?", (etl,)).fetchone()[0]
+
+    def remove(self, ids: List[int]):
+        with self._lock, self._connect() as connection:
+            connection.executemany("DELETE FROM dead_letters WHERE id = ?", [(letter_id,) for letter_id in ids])
+
+    def failed_again(self, letter_id: int, error: BaseException):
+        with self._lock, self._connect() as connection:
+            connection.execute("UPDATE dead_letters SET error = ?, attempts = attempts + 1 WHERE id = ?",
+                               (f"{type(error).__name__}: {error}", letter_id))
+
+
+class _Transaction():
+    """
+    A sqlite connection committed on success, rolled back on error and always closed
+    """
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with closing(self.connection):
+            if exc_type is None:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+
+
+def bisect_rows(df: DataFrame, action: Callable[[DataFrame], Any],
+                reject: Callable[[DataFrame, BaseException], None]) -> List[Any]:
+    """
+    Run 'action' on 'df', and when it fails on halves of it, down to the single rows it fails on, which
+    are handed to 'reject'. Returns the results of the parts 'action' succeeded on, in row order.
+    Errors of the destination itself, such as a lost connection, are raised rather than bisected.
+    """
+    try:
+        return [action(df)]
+    except UNISOLATED_ERRORS:
+        raise
+    except Exception as e:
+        if len(df) <= 1:
+            reject(df, e)
+            return []
+    middle = len(df) // 2
+    return bisect_rows(df.iloc[:middle], action, reject) + bisect_rows(df.iloc[middle:], action, reject)
+
+
+class RecoveringLoader():
+    """
+    Wraps a loader so a batch that fails to load is bisected: its good rows are committed in smaller
+    batches and the rows that fail on their own are recorded in the dead letter store.
+
+    The data frames written since the loader last committed are kept, since a failing commit can be
+    caused by any of them. Once more than 'max_bad_rows' rows were recorded in a run, the run is stopped
+    with TooManyBadRecordsError, as that points to a broken destination or config rather than bad rows.
+    """
+    def __init__(self, loader: Any, store: DeadLetterStore, etl_key: str, destination: str,
+                 logger: logging.Logger, max_bad_rows: int = DEFAULT_MAX_BAD_ROWS):
+        self.loader = loader
+        self.store = store
+        self.etl_key = etl_key
+        self.destination = destination
+        self.logger = logger
+        self.max_bad_rows = max_bad_rows
+        self.bad_rows = 0
+        self._pending: List[DataFrame] = []
+
+    def write(self, df: DataFrame) -> bool:
+        try:
+            committed = self.loader.write(df)
+        except UNISOLATED_ERRORS:
+            raise
+        except Exception as e:
+            return self.recover(df, e)
+        self._pending = [] if committed else self._pending + [df]
+        return committed
+
+    def flush(self) -> bool:
+        try:
+            committed = self.loader.flush()
+        except UNISOLATED_ERRORS:
+            raise
+        except Exception as e:
+            return self.recover(None, e)
+        self._pending = []
+        return committed
+
+    def discard(self):
+        self._pending = []
+        self.loader.discard()
+
+    def _commit(self, df: DataFrame):
+        try:
+            self.loader.write(df)
+            self.loader.flush()
+        except Exception:
+            self.loader.discard()
+            raise
+
+    def _reject(self, df: DataFrame, error: BaseException):
+        self.store.add_rows(self.etl_key, "load", self.destination, None, df, error)
+        self.bad_rows += len(df)
+        self.logger.warning(f"Sent a row of {self.etl_key} that {self.destination} rejected to the dead letter "
+                            f"store: {error}")
+        if self.bad_rows > self.max_bad_rows:
+            raise TooManyBadRecordsError(f"More than {self.max_bad_rows} rows of {self.etl_key} were rejected "
+                                         f"by {self.destination}, the last one with: {error}")
+
+    def recover(self, df: Optional[DataFrame], error: BaseException) -> bool:
+        """
+        Load the rows of the failed batch that can be loaded and record the others. Returns True since
+        every row of the batch is then either committed or recorded.
+        """
+        frames = self._pending + ([df] if df is not None else [])
+        self._pending = []
+        self.loader.discard()
+        if not frames:
+            raise error
+        batch = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        self.logger.warning(f"Loading {len(batch)} rows of {self.etl_key} into {self.destination} failed, "
+                            f"isolating the bad rows: {error}")
+        bisect_rows(batch, self._commit, self._reject)
+        return True
@@ -0,0 +1,87 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+import pandas as pd
+from pandas import DataFrame
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+def _skip_whitespace(text: str, index: int) -> int:
+    return _whitespace.match(text, index).end()  # type: ignore
+
+
+def _expect(text: str, index: int, char: str) -> int:
+    index = _skip_whitespace(text, index)
+    if index >= len(text) or text[index] != char:
+        raise json.JSONDecodeError(f"Expecting '{char}'", text, index)
+    return index + 1
+
+
+def _decode_records(text: str, index: int, columns: Optional[Sequence[str]]) -> Tuple[Dict[str, List[Any]], int, int]:
+    """
+    Decode the records of a JSON array starting at 'index' one at a time, appending the wanted fields
+    to per column buffers. Returns the buffers, the number of records and the index after the array.
+    """
+    buffers: Dict[str, List[Any]] = {column: [] for column in columns or []}
+    rows = 0
+    index = _expect(text, index, '[')
+    index = _skip_whitespace(text, index)
+    if text[index] == ']':
+        return buffers, rows, index + 1
+
+    while True:
+        record, index = _decoder.raw_decode(text, _skip_whitespace(text, index))
+        if columns is None:
+            for key in record:
+                if key not in buffers:
+                    # a field first seen in a later record is missing from the earlier ones
+                    buffers[key] = [None] * rows
+            for key, values in buffers.items():
+                values.append(record.get(key))
+        else:
+            for column in columns:
+                buffers[column].append(record.get(column))
+        rows += 1
+
+        index = _skip_whitespace(text, index)
+        if text[index] == ']':
+            return buffers, rows, index + 1
+        index = _expect(text, index, ',')
+
+
+def decode_page(payload: Union[bytes, str], columns: Optional[Sequence[str]] = None) -> Tuple[DataFrame, Optional[int]]:
+    """
+    Decode an OData response into a data frame of its 'value' records and its '@odata.count'.
+
+    The 'value' array is decoded record by record and only 'columns' are kept (all fields when None),
+    so the full object tree of a page is never held in memory and fields the transform drops are never
+    copied into the data frame. Column dtypes are inferred from the buffered values.
+    """
+    text = payload.decode("utf-8") if isinstance(payload, (bytes, bytearray)) else payload
+    count = None
+    buffers: Dict[str, List[Any]] = {column: [] for column in columns or []}
+    rows = 0
+
+    index = _expect(text, 0, '{')
+    index = _skip_whitespace(text, index)
+    if text[index] == '}':
+        return pd.DataFrame(buffers), count
+
+    while True:
+        key, index = _decoder.raw_decode(text, _skip_whitespace(text, index))
+        index = _expect(text, index, ':')
+        if key == 'value':
+            buffers, rows, index = _decode_records(text, index, columns)
+        else:
+            item, index = _decoder.raw_decode(text, _skip_whitespace(text, index))
+            if key == '@odata.count':
+                count = item
+
+        index = _skip_whitespace(text, index)
+        if text[index] == '}':
+            break
+        index = _expect(text, index, ',')
+
+    return pd.DataFrame(buffers, index=pd.RangeIndex(rows)), count
@@ -1,106 +1,669 @@
+import os
 import requests
 import logging
-import json
-from typing import Any
+import threading
+import time
+from urllib.parse import quote
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import pandas as pd
-from pandas import json_normalize, DataFrame
-from sqlalchemy import create_engine, types
+from pandas import DataFrame
+from sqlalchemy.engine import Engine
+from core.checkpoint import CheckpointStore, status_file_path
+from core.constants import CACHE_DIRECTORY, DEAD_LETTER_FILE
+from core.metrics import registry as metrics
 from core.plugin import PluginCore
-from core.exceptions import StatusFileReadError, StatusFileWriteError, NoDataFoundException
+from core.resources import registry as resources
+from core.pipeline import Stage, StagedJob
+from core.thread import CancellationToken
+from core.transform import TransformPlan
+from .batching import DEFAULT_BATCH_BYTES, DEFAULT_BATCH_ROWS, AdaptivePageSize, PageBatcher, \
+    adaptive_page_size
+from .cache import DEFAULT_MAX_BYTES, DEFAULT_TTL, ResponseCache
+from .deadletter import DEFAULT_MAX_BAD_ROWS, DeadLetterStore, RecoveringLoader, bisect_rows
+from .decode import decode_page
+from .extractors import DEFAULT_TIMEOUT, AsyncExtractor
+from .keyset import keyset_query, last_watermark
+from .loaders import create_loader
+from .schema import Schema
+from .fanout import DEFAULT_BUFFER, SinkWriter
+from .sinks import create_file_sink, destinations_of
+from core.exceptions import CancelledError, StatusFileReadError, StatusFileWriteError, NoDataFoundException, \
+    SchemaMismatchError, TooManyBadRecordsError
 
+DEFAULT_PAGE_SIZE = 100
+# page size used before it became configurable, needed to resume from legacy 'page_num' status entries
+LEGACY_PAGE_SIZE = 2
+PLUGIN_STATUS_KEY = "GHOTopOSTGRES"
 
-class ETL():
+
+class ETL(StagedJob):
     """
-    Class that implements the ETL functions
+    Class that implements the ETL functions.
+    Extract, transform and load run as concurrent stages of a core pipeline. With several destinations,
+    every transformed page is broadcast to a SinkWriter per destination.
     """
-    def __init__(self, config: Any, etl_key: str, logger: logging.Logger):
+    def __init__(self, config: Any, etl_key: str, logger: logging.Logger,
+                 engines: Optional[Dict[str, Engine]] = None, host_limiter: Optional[threading.Semaphore] = None,
+                 session: Optional[requests.Session] = None, base_directory: Optional[str] = None):
         self.logger = logger
         self.key = etl_key
         self.config = config
+        self.metric_labels = {"plugin": PLUGIN_STATUS_KEY, "etl": etl_key}
         self.base_url = config["api"]
-        self.engine = create_engine(config["destination"]["postgres"]["url"])
+        self.destinations = destinations_of(config)
+        # ETLs share an engine, and its connection pool, per database url
+        self.engines: Dict[str, Engine] = engines if engines is not None else {}
+        # caps the requests in flight to the API host across all ETLs of the plugin
+        self.host_limiter = host_limiter
+        # plain requests open a connection per page, a session of the resource registry keeps them alive
+        self.http: Any = session if session is not None else requests
+        # a stuck connection fails the page instead of holding its worker forever
+        self.timeout = float((config.get("http") or {}).get("timeout", DEFAULT_TIMEOUT))
         self.indicator = config["indicator"]
+        # OData '$filter' restricting the rows extracted, e.g. the slice of a sharded indicator
+        self.filter: Optional[str] = config.get("filter")
+        # incremental runs page by keyset on these columns, e.g. [Date, Id], instead of $skip offsets
+        incremental = config.get("incremental") or {}
+        keys = incremental.get("keys") or []
+        self.watermark_keys: List[str] = [keys] if isinstance(keys, str) else list(keys)
+        # records are converted to compact dtypes as they are decoded, the loaders create typed columns from them
+        self.schema: Optional[Schema] = Schema.compile(config["schema"], logger) if config.get("schema") else None
+        # the transform section is compiled once and applied to every page, relative lookup paths are
+        # read from 'base_directory', the plugin directory
+        self.transform_plan = TransformPlan.compile(config["transform"], base_directory)
+        # only the fields kept by the transform, and the watermark keys, are decoded into data frames
+        self.source_columns: Optional[List[str]] = None
+        if self.transform_plan.source_columns is not None:
+            self.source_columns = self.transform_plan.source_columns + [
+                key for key in self.watermark_keys if key not in self.transform_plan.source_columns]
+        # rows failing to transform or load are set aside in a dead letter store instead of stopping the run
+        dead_letters = config.get("dead_letters") or {}
+        self.dead_letters: Optional[DeadLetterStore] = None
+        if dead_letters.get("enabled", bool(dead_letters)):
+            self.dead_letters = DeadLetterStore(
+                os.path.expanduser(dead_letters.get("path", status_file_path(DEAD_LETTER_FILE))), logger)
+        self.max_bad_rows = int(dead_letters.get("max_bad_rows", DEFAULT_MAX_BAD_ROWS))
+        self.replay_dead_letters_on_start = bool(dead_letters.get("replay", False))
+        self._bad_rows = 0
+        self._bad_rows_lock = threading.Lock()
+        self.engine: Optional[Engine] = None
+        loaders = []
+        for name, kind, destination in self.destinations:
+            if kind == "postgres":
+                if destination["url"] not in self.engines:
+                    self.engines[destination["url"]] = resources.engine(destination["url"])
+                engine = self.engines[destination["url"]]
+                self.engine = self.engine or engine
+                loaders.append(create_loader(engine, self.indicator, destination, logger))
+            else:
+                loaders.append(create_file_sink(kind, self.indicator, destination, logger))
+        # the loader of every destination by name, replays write to them directly
+        self.loaders: Dict[str, Any] = {name: loader for (name, _, _), loader in zip(self.destinations, loaders)}
+        if self.dead_letters is not None:
+            loaders = [RecoveringLoader(loader, self.dead_letters, etl_key, name, logger, self.max_bad_rows)
+                       for name, loader in self.loaders.items()]
+        self.loader = loaders[0]
+        # several destinations are loaded concurrently, each with its own checkpoint entry
+        self.sink_writers: List[SinkWriter] = []
+        if len(loaders) > 1:
+            buffer = int((config.get("fanout") or {}).get("buffer", DEFAULT_BUFFER))
+            self.sink_writers = [SinkWriter(self, name, loader, f"{etl_key}/{name}", logger, buffer)
+                                 for (name, _, _), loader in zip(self.destinations, loaders)]
+        self.extractor: Optional[AsyncExtractor] = None
+        if config.get("extractor") == "async":
+            self.extractor = AsyncExtractor(config.get("http") or {}, logger)
+        self.cache: Optional[ResponseCache] = None
+        cache = config.get("cache") or {}
+        if cache.get("enabled", bool(cache)):
+            self.cache = ResponseCache(os.path.expanduser(cache.get("directory", status_file_path(CACHE_DIRECTORY))),
+                                       logger,
+                                       ttl=float(cache.get("ttl", DEFAULT_TTL)),
+                                       max_bytes=int(cache.get("max_bytes", DEFAULT_MAX_BYTES)),
+                                       compression_level=int(cache.get("compression_level", 6)))
+        self.page_size = int(config.get("page_size", DEFAULT_PAGE_SIZE))
+        prefetch = config.get("prefetch") or {}
+        self.prefetch_workers = max(1, int(prefetch.get("workers", 1)))
+        self.prefetch_depth = max(self.prefetch_workers, int(prefetch.get("depth", self.prefetch_workers)))
+        pipeline = config.get("pipeline") or {}
+        self.transform_workers = max(1, int(pipeline.get("transform_workers", 1)))
+        # with a batching section the page size follows latency and row size, and pages are loaded in batches
+        batching = config.get("batching") or {}
+        self.page_sizer: Optional[AdaptivePageSize] = None
+        self.batcher: Optional[PageBatcher] = None
+        if batching:
+            if batching.get("adaptive", True):
+                # pages queued between the stages, and the page each worker holds
+                pages_in_flight = 3 * self.prefetch_depth + self.prefetch_workers + self.transform_workers
+                self.page_sizer = adaptive_page_size(batching, self.page_size, pages_in_flight)
+            self.batcher = PageBatcher(int(batching.get("batch_rows", DEFAULT_BATCH_ROWS)),
+                                       int(batching.get("batch_bytes", DEFAULT_BATCH_BYTES)))
+        self.start_offset = 0
+        self.start_watermark: Optional[Dict[str, Any]] = None
+        self._loaded_checkpoint: Optional[Dict[str, Any]] = None
+        checkpoint = config.get("checkpoint") or {}
+        self.checkpoint_settings = {
+            "flush_every": int(checkpoint.get("flush_every", 1)),
+            "flush_interval": float(checkpoint.get("flush_interval", 0)),
+        }
+        self.checkpoints: Optional[CheckpointStore] = None
+        self._exhausted = threading.Event()
+        # '@odata.count' of the run, rows before it are expected on every page
+        self._total: Optional[int] = None
+        self.token: Optional[CancellationToken] = None
+        # offset of the first page not extracted because of a cancellation, later pages are not loaded
+        self._cancelled_at: Optional[int] = None
+        # offset of the first empty page, the end of the data unless a later page has rows
+        self._empty_at: Optional[int] = None
+        self._cancel_lock = threading.Lock()
+
+    @property
+    def incremental(self) -> bool:
+        return bool(self.watermark_keys)
+
+    def cancelled(self) -> bool:
+        return self.token is not None and self.token.cancelled()
+
+    def current_page_size(self) -> int:
+        return self.page_sizer.size if self.page_sizer is not None else self.page_size
 
     def construct_api_url(self, page_size, calculated_skip) -> str:
-        return f"{self.base_url}/{self.indicator}?$count=true&$top={page_size}&$skip={calculated_skip}"
+        url = f"{self.base_url}/{self.indicator}?$count=true&$top={page_size}&$skip={calculated_skip}"
+        if self.filter:
+            url += f"&$filter={quote(self.filter, safe='')}"
+        return url
+
+    def construct_keyset_url(self, page_size: int, watermark: Optional[Dict[str, Any]]) -> str:
+        """
+        Url of the page of rows ordered after 'watermark' by the watermark keys, the first page when None.
+        The literals of the watermark follow the schema types of the keys.
+        """
+        types = {**self.schema.inferred, **self.schema.columns} if self.schema is not None else {}
+        query = keyset_query(self.watermark_keys, watermark, self.filter, types)
+        return f"{self.base_url}/{self.indicator}?$top={page_size}&{query}"
+
+    def request(self, uri: str) -> bytes:
+        if self.host_limiter is not None:
+            with self.host_limiter:
+                return self._request(uri)
+        return self._request(uri)
+
+    def _request(self, uri: str) -> bytes:
+        # a cached page after a watermark would hide the rows changed upstream for the whole ttl
+        if self.cache is None or self.incremental:
+            with metrics.time("http_request_seconds", **self.metric_labels):
+                if self.extractor is not None:
+                    payload = self.extractor.fetch_raw(uri)
+                else:
+                    response = self.http.post(uri, headers={'Content-type': 'application/json'}, timeout=self.timeout)
+                    response.raise_for_status()
+                    payload = response.content
+            metrics.inc("bytes_fetched_total", len(payload), **self.metric_labels)
+            return payload
+        return self._request_cached(uri)
+
+    def _request_cached(self, uri: str) -> bytes:
+        """
+        Serve a page from the response cache while it is fresh, otherwise revalidate or fetch it
+        """
+        assert self.cache is not None
+        cached = self.cache.get(uri)
+        if cached is not None and cached.fresh:
+            metrics.inc("cache_hits_total", 1, **self.metric_labels)
+            return cached.body
+
+        conditional = cached.conditional_headers() if cached is not None else {}
+        with metrics.time("http_request_seconds", **self.metric_labels):
+            if self.extractor is not None:
+                status, payload, response_headers = self.extractor.fetch_response_raw(uri, conditional)
+            else:
+                response = self.http.post(uri, headers={'Content-type': 'application/json', **conditional},
+                                          timeout=self.timeout)
+                response.raise_for_status()
+                status, payload, response_headers = response.status_code, response.content, dict(response.headers)
+
+        if status == 304 and cached is not None:
+            metrics.inc("cache_revalidated_total", 1, **self.metric_labels)
+            self.cache.refresh(uri)
+            return cached.body
+        metrics.inc("cache_misses_total", 1, **self.metric_labels)
+        metrics.inc("bytes_fetched_total", len(payload), **self.metric_labels)
+        self.cache.put(uri, payload, response_headers)
+        return payload
+
+    def decode(self, payload: bytes, columns: Optional[List[str]] = None) -> Tuple[DataFrame, Optional[int]]:
+        """
+        Build a data frame from the 'value' field of an OData response, keeping only 'columns' if given and
+        converted to the types of the schema, and return it with the '@odata.count' of the response
+        """
+        df, count = decode_page(payload, columns)
+        if len(df) == 0:
+            raise NoDataFoundException("No data available in the 'value' field.")
+        if self.schema is not None:
+            df = self.schema.apply(df)
+        metrics.inc("rows_extracted_total", len(df), **self.metric_labels)
+        return df, count
+
+    def fetch_page(self, uri: str, page_size: int,
+                   columns: Optional[List[str]] = None) -> Tuple[DataFrame, Optional[int]]:
+        """
+        Fetch and decode the page at 'uri', requested with '$top' 'page_size', and adapt the page size to it
+        """
+        started = time.monotonic()
+        payload = self.request(uri)
+        seconds = time.monotonic() - started
+        df, count = self.decode(payload, columns)
+        if self.page_sizer is not None:
+            previous = self.page_sizer.size
+            size = self.page_sizer.observe(page_size, len(df), seconds, len(payload))
+            if size != previous:
+                self.logger.debug(f"Page size of {self.key} is now {size} rows")
+        return df, count
 
-    def extract(self, page_size: int, calculated_skip: int) -> DataFrame:
+    def extract(self, page_size: int, calculated_skip: int, columns: Optional[List[str]] = None) -> DataFrame:
         """
         Fetch data from GHO OData API
         """
-        df = pd.DataFrame()
+        df, _ = self.fetch_page(self.construct_api_url(page_size, calculated_skip), page_size, columns)
+        return self.complete_page(df, page_size, calculated_skip, columns)
+
+    def complete_page(self, df: DataFrame, page_size: int, skip: int, columns: Optional[List[str]] = None) -> DataFrame:
+        """
+        Fetch the rows missing from a page that came back short of 'page_size' without being the last one,
+        e.g. when the API caps '$top', so the page holds every row up to the '$skip' of the next page
+        """
+        parts = [df]
+        rows = len(df)
+        while rows < page_size and (self._total is None or skip + rows < self._total):
+            self.logger.debug(f"Page of {self.key} at offset {skip} has {rows} of {page_size} rows, "
+                              f"fetching the rest")
+            try:
+                rest, _ = self.fetch_page(self.construct_api_url(page_size - rows, skip + rows), page_size - rows,
+                                          columns)
+            except NoDataFoundException:
+                # the last page after all
+                break
+            parts.append(rest)
+            rows += len(rest)
+        return parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+
+    def source(self) -> Iterator[Tuple[Any, int, Optional[DataFrame]]]:
+        """
+        Yield the (skip, page size, data frame) of the pages to extract, starting at the row offset
+        'self.start_offset'. Incremental runs yield (watermark, page size, data frame) instead, see
+        keyset_source.
+
+        The first page is fetched here because its '@odata.count' lets us compute every remaining
+        '$skip' offset, so the extract stage can fetch them concurrently. Without a count we keep
+        yielding offsets until the extract stage sees an empty page. Offsets are computed as the
+        pipeline asks for them, with the page size of the time.
+        """
+        if self.incremental:
+            yield from self.keyset_source()
+            return
+
+        page_size = self.current_page_size()
+        first, total = self.fetch_page(self.construct_api_url(page_size, self.start_offset), page_size,
+                                       self.source_columns)
+        self._total = int(total) if total is not None else None
+        yield self.start_offset, page_size, self.complete_page(first, page_size, self.start_offset,
+                                                               self.source_columns)
+
+        skip = self.start_offset + page_size
+        while (total is None and not self._exhausted.is_set()) or (total is not None and skip < int(total)):
+            page_size = self.current_page_size()
+            yield skip, page_size, None
+            skip += page_size
+
+    def keyset_source(self) -> Iterator[Tuple[Dict[str, Any], int, DataFrame]]:
+        """
+        Yield the pages of rows changed since 'self.start_watermark', each with the watermark of its last row.
+
+        Pages are filtered and ordered on the watermark keys, so each request only depends on the last row
+        of the previous page rather than a growing '$skip', and rows inserted upstream can't shift pages.
+        Pages are fetched one after the other, while transform and load run concurrently.
+        """
+        watermark = self.start_watermark
+        while not self.cancelled():
+            page_size = self.current_page_size()
+            try:
+                df, _ = self.fetch_page(self.construct_keyset_url(page_size, watermark), page_size,
+                                        self.source_columns)
+            except CancelledError:
+                return
+            except NoDataFoundException:
+                if watermark is self.start_watermark:
+                    raise
+                return
+            watermark = last_watermark(df, self.watermark_keys)
+            yield watermark, page_size, df
+            # a page short of the API's cap on '$top' is not the last one
+            capped = self.page_sizer is not None and self.page_sizer.ceiling == len(df)
+            if len(df) < page_size and not capped:
+                return
+
+    def extract_stage(self, item: Tuple[Any, int, Optional[DataFrame]]) -> Optional[Tuple[Any, DataFrame]]:
+        skip, page_size, df = item
+        if df is not None:
+            return skip, df
+        if self.cancelled():
+            self.drop_cancelled(skip)
+            return None
         try:
-            headers = {'Content-type': 'application/json'}
-            uri = self.construct_api_url(page_size, calculated_skip)
-            request = requests.post(uri, headers=headers)
-            data = json.loads(request.text)
-            data_json = data['value']
-            if data_json == []:
-                raise NoDataFoundException("No data available in the 'value' field.")
-            df = json_normalize(data_json)
-        except requests.exceptions.RequestException:
-            raise
+            return skip, self.extract(page_size, skip, self.source_columns)
+        except CancelledError:
+            # the page failed after the run was cancelled, it is not retried
+            self.drop_cancelled(skip)
+            return None
         except NoDataFoundException:
-            raise
-        except Exception:
-            raise
-        return df
+            # past the last page, or rows were removed upstream since the count was taken, which
+            # load_stage tells apart from a missing page in the middle
+            with self._cancel_lock:
+                self._empty_at = skip if self._empty_at is None else min(self._empty_at, skip)
+            self._exhausted.set()
+            return None
+        except ValueError as e:
+            # a malformed page
+            if self.dead_letters is None:
+                raise
+            self.dead_letters.add_page(self.key, self.construct_api_url(page_size, skip), skip, e)
+            self.logger.warning(f"Sent the page of {self.key} at offset {skip} to the dead letter store: {e}")
+            return None
+
+    def drop_cancelled(self, skip: int):
+        """
+        Drop a page not extracted because of a cancellation, the status stays before the first of them
+        """
+        with self._cancel_lock:
+            self._cancelled_at = skip if self._cancelled_at is None else min(self._cancelled_at, skip)
+
+    def transform_stage(self, item: Tuple[Any, DataFrame]) -> Optional[Tuple[Any, int, DataFrame]]:
+        position, df = item
+        if self.dead_letters is None:
+            return position, len(df), self.transform(df)
+        # rows failing the transform are isolated, the rest of the page goes on
+        parts = bisect_rows(df, self.transform,
+                            lambda rows, error: self.reject_rows("transform", position, rows, error))
+        if not parts:
+            return None
+        return position, len(df), parts[0] if len(parts) == 1 else pd.concat(parts)
+
+    def reject_rows(self, stage: str, position: Any, df: DataFrame, error: BaseException):
+        assert self.dead_letters is not None
+        self.dead_letters.add_rows(self.key, stage, "", position, df, error)
+        self.logger.warning(f"Sent a row of {self.key} failing to {stage} to the dead letter store: {error}")
+        with self._bad_rows_lock:
+            self._bad_rows += len(df)
+            if self._bad_rows > self.max_bad_rows:
+                raise TooManyBadRecordsError(f"More than {self.max_bad_rows} rows of {self.key} failed to {stage}, "
+                                             f"the last one with: {error}")
+
+    def replay_dead_letters(self):
+        """
+        Extract, transform and load the records of the dead letter store again, removing the ones that
+        load now, e.g. after a fix of the transform or the destination
+        """
+        assert self.dead_letters is not None
+        letters = self.dead_letters.pending(self.key)
+        if not letters:
+            return
+        replayed = []
+        for letter in letters:
+            # letters left when the run is cancelled stay in the store for the next replay
+            if self.token is not None:
+                self.token.raise_if_cancelled()
+            try:
+                if letter.stage == "extract":
+                    df, _ = self.decode(self.request(letter.record), self.source_columns)
+                    df = self.transform(df)
+                elif letter.stage == "transform":
+                    df = self.transform(letter.frame())
+                else:
+                    df = letter.frame()
+                targets = ([self.loaders[letter.destination]] if letter.destination in self.loaders
+                           else list(self.loaders.values()))
+                for loader in targets:
+                    try:
+                        loader.write(df)
+                        loader.flush()
+                    except Exception:
+                        loader.discard()
+                        raise
+            except Exception as e:
+                self.dead_letters.failed_again(letter.id, e)
+                continue
+            replayed.append(letter.id)
+        self.dead_letters.remove(replayed)
+        self.logger.info(f"Replayed {len(replayed)} of {len(letters)} dead letters of {self.key}")
+
+    def load_stage(self, item: Tuple[Any, int, DataFrame]):
+        if self._cancelled_at is not None and not self.incremental and item[0] >= self._cancelled_at:
+            return
+        if self._empty_at is not None and not self.incremental and item[0] > self._empty_at:
+            # pages are loaded in order, a page with rows after an empty one means the empty page was a gap.
+            # The run stops before it so the status stays at its offset and it is requested again on resume.
+            self.logger.warning(f"The page of {self.key} at offset {self._empty_at} was empty while later "
+                                f"pages have rows, stopping before it")
+            raise NoDataFoundException(f"No data in the page at offset {self._empty_at}")
+        if self.batcher is not None:
+            pages = self.batcher.add(item)
+            if pages:
+                self.deliver(self.merge_pages(pages))
+            return
+        self.deliver(item)
+
+    def merge_pages(self, pages: List[Tuple[Any, int, DataFrame]]) -> Tuple[Any, int, DataFrame]:
+        """
+        A single (position, rows, data frame) page made of consecutive pages: it starts at the offset of the
+        first page, or ends at the watermark of the last page for incremental runs
+        """
+        if len(pages) == 1:
+            return pages[0]
+        position = pages[-1][0] if self.incremental else pages[0][0]
+        df = pd.concat([df for _, _, df in pages], ignore_index=True)
+        return position, sum(rows for _, rows, _ in pages), df
+
+    def deliver(self, item: Tuple[Any, int, DataFrame]):
+        """
+        Load a page, or broadcast it to the writer of every destination
+        """
+        if self.sink_writers:
+            for writer in self.sink_writers:
+                writer.submit(item)
+            return
+        position, rows, df = item
+        self._loaded_checkpoint = self.checkpoint_status(position, rows)
+        if self.load(df):
+            self.save_checkpoint(self._loaded_checkpoint)
+
+    def checkpoint_status(self, position: Any, rows: int) -> Dict[str, Any]:
+        """
+        Status entry to resume after the page at 'position' with 'rows' source rows
+        """
+        if self.incremental:
+            return {'watermark': position}
+        return {'offset': position + rows}
+
+    def unloaded_rows(self, etl_status: Optional[Dict[str, Any]], position: Any, rows: int,
+                      df: DataFrame) -> Optional[DataFrame]:
+        """
+        The page, unless a destination that resumes from 'etl_status' already holds all of it. Pages
+        partly loaded are loaded whole, which upsert mode takes without duplicates.
+        """
+        if etl_status is None:
+            return df
+        if not self.incremental:
+            return None if position + rows <= self.resume_offset(etl_status) else df
+        watermark = etl_status.get('watermark')
+        if not watermark:
+            return df
+        try:
+            loaded = [position[key] for key in self.watermark_keys] <= [watermark[key] for key in self.watermark_keys]
+        except (KeyError, TypeError):
+            return df
+        return None if loaded else df
+
+    def stages(self) -> List[Stage]:
+        return [
+            Stage("extract", self.extract_stage, workers=self.prefetch_workers),
+            Stage("transform", self.transform_stage, workers=self.transform_workers),
+            # pages are loaded in order so the status offset only ever moves past committed pages
+            Stage("load", self.load_stage, ordered=True),
+        ]
 
     def transform(self, data_frame: DataFrame) -> DataFrame:
         """
-        Applies some transformations by removing some columns from the pandas data frame and renaming
-        others inorder to prepare the data frame for storage in the postgres data base
+        Applies the transformations of the config, e.g. removing some columns from the pandas data frame,
+        renaming others, parsing and casting values, inorder to prepare the data frame for storage in the
+        postgres data base
         """
-        columns = self.config["transform"]["columns"]
-        transformed_df = data_frame[list(columns.keys())].rename(columns=columns)
+        transformed_df = self.transform_plan.apply(data_frame)
 
-        self.logger.info(f"DATA FRAME{transformed_df}")
+        self.logger.debug(f"Transformed {len(transformed_df)} rows for {self.key}")
         return transformed_df
 
-    def load(self, df):
+    def load(self, df: DataFrame) -> bool:
         """
-        Save the data in a postgres database
+        Save the data in a postgres database or data files. Returns True once the data, and any data buffered
+        before it, has been committed.
         """
-        df.to_sql(self.indicator,
-                  con=self.engine,
-                  index=False,
-                  if_exists='append',
-                  dtype={col: types.VARCHAR(255) for col in df.columns})
+        return self.write_to(self.loader, df)
 
-    def start(self):
-        try:
-            status_data = PluginCore.read_status_file(".psystem/status.yaml", self.logger)
-            self.logger.info(f"Found status data: {status_data}")
+    def write_to(self, loader: Any, df: DataFrame, **labels: Any) -> bool:
+        with metrics.time("db_write_seconds", **self.metric_labels, **labels):
+            committed = loader.write(df)
+        metrics.inc("rows_loaded_total", len(df), **self.metric_labels, **labels)
+        return committed
 
-            plugin_status_key = "GHOTopOSTGRES"
-            page_size = 2
-            page_num = 1
-            etl_key = self.key
+    def flush_loader(self) -> bool:
+        """
+        Commit rows still buffered by the loader. Returns True if anything was committed.
+        """
+        return self.flush(self.loader)
 
-            if plugin_status_key in status_data['plugins']:
-                if etl_key in status_data['plugins'][plugin_status_key]:
-                    self.logger.info("Plugin status data available. Using it...")
-                    page_num = status_data['plugins'][plugin_status_key][etl_key]['page_num']
-                else:
-                    status_data['plugins'][plugin_status_key][etl_key] = {'page_num': 1}
+    def flush(self, loader: Any, **labels: Any) -> bool:
+        with metrics.time("db_write_seconds", **self.metric_labels, **labels):
+            return loader.flush()
 
+    @staticmethod
+    def resume_offset(etl_status: Dict[str, Any]) -> int:
+        """
+        Row offset to resume from. Older status files recorded a 'page_num' for a fixed page size.
+        """
+        if 'offset' in etl_status:
+            return int(etl_status['offset'])
+        return (int(etl_status.get('page_num', 1)) - 1) * LEGACY_PAGE_SIZE
+
+    def save_checkpoint(self, etl_status: Dict[str, Any], key: Optional[str] = None):
+        """
+        Record the row offset, or the watermark of incremental runs, to resume from
+        """
+        assert self.checkpoints is not None
+        with metrics.time("checkpoint_seconds", **self.metric_labels):
+            self.checkpoints.set(key or self.key, etl_status)
+
+    def resume_from(self, etl_status: Optional[Dict[str, Any]]):
+        """
+        Set the offset, or the watermark of incremental runs, the extraction starts from
+        """
+        self.start_offset = 0
+        self.start_watermark = None
+        if etl_status is None:
+            return
+        if self.incremental:
+            self.start_watermark = etl_status.get('watermark')
+        else:
+            self.start_offset = self.resume_offset(etl_status)
+
+    def fanout_status(self) -> Optional[Dict[str, Any]]:
+        """
+        Resume each destination from its own status entry, or the ETL's entry from before it had several
+        destinations, and return the entry of the destination furthest behind, which the run starts from
+        """
+        assert self.checkpoints is not None
+        etl_status = self.checkpoints.get(self.key)
+        found = []
+        for writer in self.sink_writers:
+            writer.resume_status = self.checkpoints.get(writer.checkpoint_key) or etl_status
+            found.append(writer.resume_status)
+        if any(status is None for status in found):
+            return None
+        statuses: List[Dict[str, Any]] = [status for status in found if status is not None]
+        if not self.incremental:
+            return min(statuses, key=self.resume_offset)
+        try:
+            return min(statuses, key=lambda status: [status['watermark'][key] for key in self.watermark_keys])
+        except (KeyError, TypeError):
+            return None
+
+    def start(self, token: Optional[CancellationToken] = None):
+        """
+        Run the ETL. Once 'token' is cancelled no new pages are extracted, failed requests are not retried,
+        the pages in flight are loaded and the status is saved before returning.
+        """
+        self.token = token
+        self._cancelled_at = None
+        self._empty_at = None
+        if self.extractor is not None:
+            self.extractor.token = token
+        try:
+            if self.checkpoints is None:
+                self.checkpoints = PluginCore.checkpoint_store(PLUGIN_STATUS_KEY, self.logger,
+                                                               **self.checkpoint_settings)
+
+            etl_key = self.key
+            etl_status = self.fanout_status() if self.sink_writers else self.checkpoints.get(etl_key)
+            if etl_status is not None:
+                self.logger.info(f"Found status data: {etl_status}. Using it...")
+            self.resume_from(etl_status)
+            if self.dead_letters is not None and self.replay_dead_letters_on_start:
+                self.replay_dead_letters()
+            self._loaded_checkpoint = None
+            self._exhausted.clear()
+            if self.batcher is not None:
+                self.batcher.drain()
+            for writer in self.sink_writers:
+                writer.start()
+            try:
+                self.run_pipeline(queue_size=self.prefetch_depth, logger=self.logger, metrics=metrics,
+                                  labels=self.metric_labels, token=token)
+                # the last pages collected for a batch
+                pages = self.batcher.drain() if self.batcher is not None else []
+                if pages:
+                    self.deliver(self.merge_pages(pages))
+            finally:
+                if self.extractor is not None:
+                    self.extractor.close()
+                errors = [writer.close() for writer in self.sink_writers]
+            failed = next((error for error in errors if error is not None), None)
+            if failed is not None:
+                raise failed
+            if not self.sink_writers and self.flush_loader() and self._loaded_checkpoint is not None:
+                self.save_checkpoint(self._loaded_checkpoint)
+            if self.cancelled():
+                self.logger.info(f"Stopped loading {etl_key}, its progress is saved")
             else:
-                status_data['plugins'] = {plugin_status_key: {etl_key: {'page_num': 1}}}
-                PluginCore.write_status_file(".psystem/status.yaml", status_data)
-
-            while True:
-                skip = (page_num - 1) * page_size
-                df = self.extract(page_size, skip)
-                transformed_data = self.transform(df)
-                self.load(transformed_data)
-                page_num += 1
-                status_data['plugins'][plugin_status_key][etl_key]['page_num'] = page_num
-                PluginCore.write_status_file(".psystem/status.yaml", status_data)
+                self.logger.info(f"Finished loading {etl_key}")
         except StatusFileReadError as e:
             self.logger.error(f"Error reading status file: {e}")
         except StatusFileWriteError as e:
             self.logger.error(f"Error writing status file: {e}")
         except NoDataFoundException as e:
             self.logger.info(f"No data was found: {e}")
+        except CancelledError:
+            self.logger.info(f"Stopped replaying the dead letters of {self.key}, the rest are kept for the next run")
+        except (TooManyBadRecordsError, SchemaMismatchError) as e:
+            self.logger.error(f"Stopped loading {self.key}: {e}")
         except Exception as e:
             self.logger.error(f"An unexpected error occurred during data extraction: {e}")
+        finally:
+            # offsets are only recorded for committed batches, so pending ones are safe to write on failure
+            self.flush_checkpoints()
+
+    def flush_checkpoints(self):
+        if self.checkpoints is None:
+            return
+        try:
+            with metrics.time("checkpoint_seconds", **self.metric_labels):
+                self.checkpoints.flush()
+        except (StatusFileReadError, StatusFileWriteError) as e:
+            self.logger.error(f"Error writing status file: {e}")
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import logging
+import random
+import threading
+from typing import Any, Dict, Optional, Tuple
+import aiohttp
+from core.thread import CancellationToken
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# seconds a request may take, for the async extractor and plain requests alike
+DEFAULT_TIMEOUT = 30.0
+
+
+class HTTPStatusError(Exception):
+    """
+    Raised when the API answers with an error status that is not retried, or retries are exhausted
+    """
+    def __init__(self, status: int, uri: str):
+        super().__init__(f"HTTP {status} from {uri}")
+        self.status = status
+        self.uri = uri
+
+
+class AsyncExtractor():
+    """
+    Fetches GHO OData pages with asyncio over a single pooled aiohttp session.
+
+    The event loop runs on its own thread so the synchronous pipeline workers can share it through
+    fetch_raw(). Connections are kept alive and reused, the number of open connections per host is
+    capped, every request has a timeout, and 429/5xx responses or connection errors are retried with
+    jittered exponential backoff. Response bodies are returned as bytes, ready to be decoded. Once
+    'token' is cancelled, a failed request raises CancelledError instead of waiting to be retried.
+    """
+    def __init__(self, config: Dict[str, Any], logger: logging.Logger, token: Optional[CancellationToken] = None):
+        self.logger = logger
+        self.token = token
+        self.per_host_limit = int(config.get("per_host_limit", 8))
+        self.timeout = float(config.get("timeout", DEFAULT_TIMEOUT))
+        self.max_retries = int(config.get("max_retries", 5))
+        self.backoff_base = float(config.get("backoff_base", 0.5))
+        self.backoff_max = float(config.get("backoff_max", 30))
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the event loop thread and open the client session. Safe to call more than once.
+        """
+        with self._lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=loop.run_forever, name="async-extractor", daemon=True)
+            self._thread.start()
+            self._loop = loop
+            self._session = asyncio.run_coroutine_threadsafe(self._open_session(), loop).result()
+
+    async def _open_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(limit_per_host=self.per_host_limit)
+        return aiohttp.ClientSession(connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                     headers={'Content-type': 'application/json'})
+
+    def close(self):
+        """
+        Close the session and stop the event loop thread
+        """
+        with self._lock:
+            if self._loop is None:
+                return
+            if self._session is not None:
+                asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            if self._thread is not None:
+                self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+            self._session = None
+
+    def backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        Seconds to wait before retry number 'attempt', honouring a numeric Retry-After header
+        """
+        if retry_after is not None:
+            try:
+                return min(self.backoff_max, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def fetch(self, uri: str) -> bytes:
+        """
+        Request a page and return its raw body, retrying transient failures
+        """
+        _, body, _ = await self.fetch_response(uri)
+        return body
+
+    async def fetch_response(self, uri: str,
+                             headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes, Dict[str, str]]:
+        """
+        Request a page with extra headers, e.g. conditional ones, and return the status, raw body and
+        response headers, retrying transient failures
+        """
+        if self._session is None:
+            raise RuntimeError("AsyncExtractor.start() must be called before fetching")
+
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                async with self._session.post(uri, headers=headers) as response:
+                    if response.status < 400:
+                        return response.status, await response.read(), dict(response.headers)
+                    if response.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                        raise HTTPStatusError(response.status, uri)
+                    retry_after = response.headers.get("Retry-After")
+                    self.logger.warning(f"HTTP {response.status} from {uri}, retrying")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                self.logger.warning(f"Request to {uri} failed ({e!r}), retrying")
+
+            # a cancelled run doesn't wait out the backoff of a page it would drop anyway
+            if self.token is not None:
+                self.token.raise_if_cancelled()
+            await asyncio.sleep(self.backoff(attempt, retry_after))
+            attempt += 1
+
+    def fetch_raw(self, uri: str) -> bytes:
+        """
+        Blocking wrapper around fetch() for callers running on other threads
+        """
+        if self._loop is None:
+            self.start()
+        assert self._loop is not None
+        return asyncio.run_coroutine_threadsafe(self.fetch(uri), self._loop).result()
+
+    def fetch_response_raw(self, uri: str,
+                           headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes, Dict[str, str]]:
+        """
+        Blocking wrapper around fetch_response()
+        """
+        if self._loop is None:
+            self.start()
+        assert self._loop is not None
+        return asyncio.run_coroutine_threadsafe(self.fetch_response(uri, headers), self._loop).result()
+
+    def fetch_json(self, uri: str) -> Dict[str, Any]:
+        """
+        Fetch a page and decode its JSON body straight from the response bytes
+        """
+        return json.loads(self.fetch_raw(uri))
@@ -0,0 +1,86 @@
+import logging
+import queue
+import threading
+from typing import Any, Dict, Optional, Tuple
+from pandas import DataFrame
+from core.metrics import profile_worker
+
+DEFAULT_BUFFER = 4
+
+# marks the end of the pages on a sink queue
+_DONE = object()
+
+
+class SinkWriter():
+    """
+    Loads the pages an ETL broadcasts to one of its destinations, on its own thread.
+
+    Pages wait in a queue of 'buffer' pages, so a slow destination only holds back the others once its
+    buffer is full. The writer skips the rows its destination already holds according to its own
+    checkpoint, and records a new checkpoint whenever its loader commits. A failing destination stops
+    loading and drains its queue, so the other destinations carry on.
+    """
+    def __init__(self, etl: Any, name: str, loader: Any, checkpoint_key: str, logger: logging.Logger,
+                 buffer: int = DEFAULT_BUFFER):
+        self.etl = etl
+        self.name = name
+        self.loader = loader
+        self.checkpoint_key = checkpoint_key
+        self.logger = logger
+        self.buffer = max(1, buffer)
+        # checkpoint of the destination when the run started, None to load every page
+        self.resume_status: Optional[Dict[str, Any]] = None
+        self.loaded_status: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+        self._queue: queue.Queue = queue.Queue(maxsize=self.buffer)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._queue = queue.Queue(maxsize=self.buffer)
+        self.loaded_status = None
+        self.error = None
+        self._thread = threading.Thread(target=profile_worker(self._run), name=f"sink-{self.name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, page: Tuple[Any, int, DataFrame]):
+        """
+        Queue a (position, rows, data frame) page, blocking while the buffer is full
+        """
+        self._queue.put(page)
+
+    def _run(self):
+        while True:
+            page = self._queue.get()
+            if page is _DONE:
+                break
+            if self.error is not None:
+                continue
+            position, rows, df = page
+            try:
+                df = self.etl.unloaded_rows(self.resume_status, position, rows, df)
+                if df is None:
+                    continue
+                self.loaded_status = self.etl.checkpoint_status(position, rows)
+                if self.etl.write_to(self.loader, df, sink=self.name):
+                    self.etl.save_checkpoint(self.loaded_status, self.checkpoint_key)
+            except Exception as e:
+                self.error = e
+                self.logger.error(f"Destination '{self.name}' of {self.etl.key} failed and stopped loading: {e}")
+
+    def close(self) -> Optional[BaseException]:
+        """
+        Wait for the queued pages, then commit buffered rows. Returns the error of the destination, if any.
+        """
+        if self._thread is None:
+            return None
+        self._queue.put(_DONE)
+        self._thread.join()
+        self._thread = None
+        if self.error is None:
+            try:
+                if self.etl.flush(self.loader, sink=self.name) and self.loaded_status is not None:
+                    self.etl.save_checkpoint(self.loaded_status, self.checkpoint_key)
+            except Exception as e:
+                self.error = e
+                self.logger.error(f"Destination '{self.name}' of {self.etl.key} failed to commit: {e}")
+        return self.error
@@ -0,0 +1,75 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote
+
+
+def odata_literal(value: Any, column_type: Optional[str] = None) -> str:
+    """
+    Format a value as an OData literal for a column of the schema type 'column_type', e.g. timestamptz.
+    timestamptz values are written as is, strings of a text column or of a column without a type are
+    quoted, so a code that reads like a date stays a string. Untyped numbers and booleans keep their type.
+    """
+    if value is None:
+        return "null"
+    if column_type == "timestamptz":
+        return str(value)
+    if column_type in ("string", "category"):
+        return "'" + str(value).replace("'", "''") + "'"
+    if isinstance(value, bool) or column_type == "bool":
+        return "true" if value in (True, "true", "True") else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if column_type is not None:
+        # a number of a numeric column
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def keyset_filter(keys: List[str], watermark: Dict[str, Any], types: Optional[Dict[str, str]] = None) -> str:
+    """
+    '$filter' expression matching the rows ordered after 'watermark' by 'keys', e.g. for Date and Id:
+    (Date gt X) or (Date eq X and Id gt Y). 'types' are the schema types of the keys.
+    """
+    types = types or {}
+
+    def literal(key: str) -> str:
+        return odata_literal(watermark[key], types.get(key))
+
+    clauses = []
+    for index, key in enumerate(keys):
+        equal = [f"{previous} eq {literal(previous)}" for previous in keys[:index]]
+        clauses.append("(" + " and ".join(equal + [f"{key} gt {literal(key)}"]) + ")")
+    return " or ".join(clauses)
+
+
+def keyset_query(keys: List[str], watermark: Optional[Dict[str, Any]], base_filter: Optional[str] = None,
+                 types: Optional[Dict[str, str]] = None) -> str:
+    """
+    URL encoded '$filter' and '$orderby' parameters of the page after 'watermark', within the rows
+    matching 'base_filter' if given
+    """
+    query = f"$orderby={quote(','.join(keys))}"
+    filters = [f"({base_filter})"] if base_filter else []
+    if watermark:
+        clause = keyset_filter(keys, watermark, types)
+        # the keyset filter is a disjunction, unparenthesized its tie-break would escape 'base_filter'
+        filters.append(f"({clause})" if base_filter else clause)
+    if filters:
+        query += f"&$filter={quote(' and '.join(filters), safe='')}"
+    return query
+
+
+def last_watermark(df: Any, keys: List[str]) -> Dict[str, Any]:
+    """
+    Watermark of the last row of a page ordered by 'keys', with numpy scalars turned into plain values
+    and timestamps of typed columns into ISO 8601 strings, so it can be stored in the status file
+    """
+    row = df.iloc[-1]
+    watermark = {}
+    for key in keys:
+        value = row[key]
+        if isinstance(value, datetime):
+            watermark[key] = value.isoformat()
+        else:
+            watermark[key] = value.item() if hasattr(value, "item") else value
+    return watermark
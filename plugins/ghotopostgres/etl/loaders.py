@@ -0,0 +1,366 @@
+import io
+import logging
+import re
+import threading
+from typing import Any, Dict, List, Optional
+from pandas import DataFrame
+from pandas.api import types as dtypes
+from sqlalchemy import types
+from sqlalchemy.engine import Engine
+from core.exceptions import SchemaMismatchError
+
+DEFAULT_BATCH_ROWS = 50000
+DEFAULT_BATCH_BYTES = 16 * 1024 * 1024
+
+# loaders of concurrent shards create the same table, CREATE ... IF NOT EXISTS can race in postgres
+_prepare_lock = threading.Lock()
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+# names postgres reports in information_schema for the type names a config can use
+SQL_TYPE_ALIASES = {
+    "int2": "smallint",
+    "int": "integer",
+    "int4": "integer",
+    "int8": "bigint",
+    "float4": "real",
+    "float8": "double precision",
+    "bool": "boolean",
+    "decimal": "numeric",
+    "varchar": "character varying",
+    "char": "character",
+    "timestamptz": "timestamp with time zone",
+    "timestamp": "timestamp without time zone",
+}
+TEXT_TYPES = {"text", "character varying", "character"}
+# types a column can be altered to without losing any of its values
+WIDER_TYPES = {
+    "smallint": {"integer", "bigint", "numeric", "real", "double precision"},
+    "integer": {"bigint", "numeric", "double precision"},
+    "bigint": {"numeric"},
+    "real": {"double precision"},
+    "character varying": {"text"},
+    "character": {"text"},
+}
+SQLALCHEMY_TYPES = {
+    "boolean": types.Boolean(),
+    "smallint": types.SmallInteger(),
+    "integer": types.Integer(),
+    "bigint": types.BigInteger(),
+    "real": types.REAL(),
+    "double precision": types.Float(precision=53),
+    "numeric": types.Numeric(),
+    "timestamp with time zone": types.TIMESTAMP(timezone=True),
+    "timestamp without time zone": types.TIMESTAMP(),
+    "text": types.Text(),
+}
+
+
+def infer_sql_type(series: Any) -> str:
+    """
+    Postgres column type for a pandas series, the narrowest one holding its dtype
+    """
+    if isinstance(series.dtype, dtypes.CategoricalDtype):
+        return infer_sql_type(series.cat.categories)
+    if dtypes.is_bool_dtype(series):
+        return "BOOLEAN"
+    if dtypes.is_integer_dtype(series):
+        # unsigned integers need the next wider type
+        size = series.dtype.itemsize * (2 if dtypes.is_unsigned_integer_dtype(series) else 1)
+        return "SMALLINT" if size <= 2 else "INTEGER" if size == 4 else "BIGINT"
+    if dtypes.is_float_dtype(series):
+        return "REAL" if series.dtype.itemsize == 4 else "DOUBLE PRECISION"
+    if dtypes.is_datetime64_any_dtype(series):
+        return "TIMESTAMPTZ"
+    return "TEXT"
+
+
+def normalize_sql_type(sql_type: str) -> str:
+    """
+    The information_schema name of a postgres type, e.g. 'timestamp with time zone' for TIMESTAMPTZ,
+    without its length or precision
+    """
+    name = re.sub(r"\s+", " ", re.sub(r"\(.*?\)", "", sql_type)).strip().lower()
+    return SQL_TYPE_ALIASES.get(name, name)
+
+
+def evolve_table_sql(table: str, existing: Dict[str, str], column_types: Dict[str, str],
+                     logger: logging.Logger) -> List[str]:
+    """
+    Statements bringing a table with the 'existing' {column: information_schema type} columns in line
+    with 'column_types': missing columns are added and columns are widened, e.g. from INTEGER to
+    BIGINT. Text columns and columns that are already wider hold the new values as they are. Raises
+    SchemaMismatchError for a column that can't hold the values of its new type, e.g. after a config
+    change from a number to text.
+    """
+    statements = []
+    for column, sql_type in column_types.items():
+        current = existing.get(column)
+        expected = normalize_sql_type(sql_type)
+        if current is None:
+            logger.info(f"Adding column {column} {sql_type} to {table}")
+            statements.append(f"ALTER TABLE {quote_identifier(table)} ADD COLUMN {quote_identifier(column)} {sql_type}")
+        elif current == expected or current in TEXT_TYPES or current in WIDER_TYPES.get(expected, ()):
+            continue
+        elif expected in WIDER_TYPES.get(current, ()):
+            logger.warning(f"Widening column {column} of {table} from {current} to {sql_type}, which rewrites "
+                           f"the table")
+            statements.append(f"ALTER TABLE {quote_identifier(table)} ALTER COLUMN {quote_identifier(column)} "
+                              f"TYPE {sql_type}")
+        else:
+            raise SchemaMismatchError(f"Column {column} of {table} is {current} and can't hold the {sql_type} "
+                                      f"values of the config, migrate the table or declare the column as "
+                                      f"{current} in the 'types' of the destination")
+    return statements
+
+
+class ToSqlLoader():
+    """
+    Appends every data frame through DataFrame.to_sql. Columns are created with the types of the 'types'
+    mapping of the postgres destination, or inferred from the first data frame; configured types without
+    a SQLAlchemy equivalent are created as text.
+    """
+    def __init__(self, engine: Engine, table: str, config: Dict[str, Any], logger: logging.Logger):
+        self.engine = engine
+        self.table = table
+        self.logger = logger
+        self.configured_types: Dict[str, str] = config.get("types") or {}
+        self.sql_types: Optional[Dict[str, Any]] = None
+
+    def write(self, df: DataFrame) -> bool:
+        """
+        Load a data frame. Returns True once it and any earlier data frames are committed.
+        """
+        if self.sql_types is None:
+            self.sql_types = {
+                col: SQLALCHEMY_TYPES.get(normalize_sql_type(self.configured_types.get(col) or infer_sql_type(df[col])),
+                                          types.Text())
+                for col in df.columns}
+        df.to_sql(self.table,
+                  con=self.engine,
+                  index=False,
+                  if_exists='append',
+                  dtype=self.sql_types)
+        return True
+
+    def flush(self) -> bool:
+        """
+        Commit buffered data frames. Returns True if anything was committed.
+        """
+        return False
+
+    def discard(self):
+        """
+        Drop buffered data frames, e.g. after a failed commit
+        """
+        pass
+
+
+class CopyLoader():
+    """
+    Streams data frames into postgres with COPY ... FROM STDIN.
+
+    Data frames are serialized as CSV into an in-memory buffer that is shared across pages and only
+    sent to the database once it holds 'batch_rows' rows or 'batch_bytes' bytes, or on flush().
+    Column types come from the 'types' mapping of the postgres destination, or are inferred from
+    the first data frame, and are used to create the table if it does not exist. An existing table
+    gets the columns it misses and has its columns widened, see evolve_table_sql.
+    """
+    def __init__(self, engine: Engine, table: str, config: Dict[str, Any], logger: logging.Logger):
+        self.engine = engine
+        self.table = table
+        self.logger = logger
+        self.batch_rows = int(config.get("batch_rows", DEFAULT_BATCH_ROWS))
+        self.batch_bytes = int(config.get("batch_bytes", DEFAULT_BATCH_BYTES))
+        self.configured_types: Dict[str, str] = config.get("types") or {}
+        self.columns: Optional[List[str]] = None
+        self._buffer = io.StringIO()
+        self._rows = 0
+        self._table_ready = False
+
+    def column_types(self, df: DataFrame) -> Dict[str, str]:
+        return {col: self.configured_types.get(col) or infer_sql_type(df[col]) for col in df.columns}
+
+    def create_table_sql(self, df: DataFrame) -> str:
+        columns = ", ".join(f"{quote_identifier(col)} {sql_type}" for col, sql_type in self.column_types(df).items())
+        return f"CREATE TABLE IF NOT EXISTS {quote_identifier(self.table)} ({columns})"
+
+    def copy_sql(self) -> str:
+        columns = ", ".join(quote_identifier(col) for col in self.columns or [])
+        return f"COPY {quote_identifier(self.table)} ({columns}) FROM STDIN WITH (FORMAT csv)"
+
+    def _execute(self, *statements: str):
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            for sql in statements:
+                cursor.execute(sql)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def table_columns(self, table: str) -> Dict[str, str]:
+        """
+        The {column: type} of a table as information_schema names them, empty if it does not exist
+        """
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT column_name, data_type FROM information_schema.columns "
+                           "WHERE table_schema = current_schema() AND table_name = %s", (table,))
+            return {name: data_type for name, data_type in cursor.fetchall()}
+        finally:
+            connection.close()
+
+    def evolution_types(self, df: DataFrame, existing: Dict[str, str]) -> Dict[str, str]:
+        """
+        The column types to check an existing table against. Existing columns without a configured type
+        that are all null in 'df' are left out, their inferred type says nothing about the data, e.g. in
+        the first page of a resumed run.
+        """
+        return {col: sql_type for col, sql_type in self.column_types(df).items()
+                if col in self.configured_types or col not in existing or df[col].notna().any()}
+
+    def table_sql(self, df: DataFrame) -> List[str]:
+        """
+        Statements creating the table, or evolving it to the columns of 'df'
+        """
+        existing = self.table_columns(self.table)
+        if not existing:
+            return [self.create_table_sql(df)]
+        return evolve_table_sql(self.table, existing, self.evolution_types(df, existing), self.logger)
+
+    def prepare_table(self, df: DataFrame):
+        self._execute(*self.table_sql(df))
+
+    def copy_batch(self, cursor: Any, buffer: io.StringIO):
+        cursor.copy_expert(self.copy_sql(), buffer)
+
+    def write(self, df: DataFrame) -> bool:
+        """
+        Buffer a data frame. Returns True when the buffer was copied to the database.
+        """
+        if self.columns is None:
+            self.columns = list(df.columns)
+        if not self._table_ready:
+            with _prepare_lock:
+                self.prepare_table(df)
+            self._table_ready = True
+
+        df.to_csv(self._buffer, columns=self.columns, index=False, header=False)
+        self._rows += len(df)
+
+        if self._rows >= self.batch_rows or self._buffer.tell() >= self.batch_bytes:
+            return self.flush()
+        return False
+
+    def flush(self) -> bool:
+        """
+        Copy buffered rows to the database in a single transaction. Returns True if anything was copied.
+        """
+        if self._rows == 0:
+            return False
+
+        self._buffer.seek(0)
+        connection = self.engine.raw_connection()
+        try:
+            self.copy_batch(connection.cursor(), self._buffer)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+        self.logger.debug(f"Copied {self._rows} rows into {self.table}")
+        self.discard()
+        return True
+
+    def discard(self):
+        """
+        Drop the buffered rows, e.g. after a failed copy
+        """
+        self._buffer = io.StringIO()
+        self._rows = 0
+
+
+class UpsertLoader(CopyLoader):
+    """
+    COPY loader that makes loads idempotent on a key column.
+
+    Each batch is copied into a temporary staging table and merged into the target with
+    INSERT ... ON CONFLICT (key) DO UPDATE in the same transaction, so loading a page again after a
+    crash or resume updates the rows instead of duplicating them. The staging table is created by the
+    transaction and dropped on commit, so concurrent loads into the same target, e.g. the shards of an
+    indicator, each have their own and don't wait on each other. The target table gets a primary key,
+    or a unique index if it already existed, on the key column.
+    """
+    def __init__(self, engine: Engine, table: str, config: Dict[str, Any], logger: logging.Logger):
+        super().__init__(engine, table, config, logger)
+        self.key = config.get("key", "Id")
+        self.staging_table = f"{table}_staging"
+
+    def create_table_sql(self, df: DataFrame) -> str:
+        if self.key not in df.columns:
+            raise ValueError(f"Upsert key '{self.key}' is not a column of {self.table}")
+        columns = ", ".join(f"{quote_identifier(col)} {sql_type}" for col, sql_type in self.column_types(df).items())
+        return (f"CREATE TABLE IF NOT EXISTS {quote_identifier(self.table)} "
+                f"({columns}, PRIMARY KEY ({quote_identifier(self.key)}))")
+
+    def prepare_table(self, df: DataFrame):
+        self._execute(
+            *self.table_sql(df),
+            # tables created before upsert mode have no key constraint yet
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {quote_identifier(self.table + '_' + self.key + '_key')} "
+            f"ON {quote_identifier(self.table)} ({quote_identifier(self.key)})",
+        )
+
+    def copy_sql(self) -> str:
+        columns = ", ".join(quote_identifier(col) for col in self.columns or [])
+        return f"COPY {quote_identifier(self.staging_table)} ({columns}) FROM STDIN WITH (FORMAT csv)"
+
+    def merge_sql(self) -> str:
+        columns = [quote_identifier(col) for col in self.columns or []]
+        key = quote_identifier(self.key)
+        updates = ", ".join(f"{col} = EXCLUDED.{col}" for col in columns if col != key)
+        on_conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        # a page can repeat a key, keep a single row per key so the merge never updates a row twice
+        return (f"INSERT INTO {quote_identifier(self.table)} ({', '.join(columns)}) "
+                f"SELECT DISTINCT ON ({key}) {', '.join(columns)} FROM {quote_identifier(self.staging_table)} "
+                f"ORDER BY {key} "
+                f"ON CONFLICT ({key}) {on_conflict}")
+
+    def copy_batch(self, cursor: Any, buffer: io.StringIO):
+        # a temporary table is private to the session and takes its columns from the evolved target
+        cursor.execute(f"CREATE TEMPORARY TABLE {quote_identifier(self.staging_table)} "
+                       f"(LIKE {quote_identifier(self.table)} INCLUDING DEFAULTS) ON COMMIT DROP")
+        super().copy_batch(cursor, buffer)
+        cursor.execute(self.merge_sql())
+
+
+LOADERS = {
+    "copy": CopyLoader,
+    "to_sql": ToSqlLoader,
+}
+
+
+def create_loader(engine: Engine, table: str, config: Dict[str, Any], logger: logging.Logger):
+    """
+    Build the loader named by the 'loader' key of a postgres destination, COPY by default.
+    'mode: upsert' merges batches on the 'key' column instead of appending them.
+    """
+    name = config.get("loader", "copy")
+    if name not in LOADERS:
+        raise ValueError(f"Unknown postgres loader '{name}', expected one of {sorted(LOADERS)}")
+
+    mode = config.get("mode", "append")
+    if mode == "upsert":
+        if name != "copy":
+            raise ValueError("Upsert mode needs the copy loader")
+        return UpsertLoader(engine, table, config, logger)
+    if mode != "append":
+        raise ValueError(f"Unknown postgres load mode '{mode}', expected 'append' or 'upsert'")
+    return LOADERS[name](engine, table, config, logger)
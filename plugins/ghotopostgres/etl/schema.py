@@ -0,0 +1,152 @@
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+import pandas as pd
+from pandas import DataFrame
+from pandas.api import types as dtypes
+
+# text columns with fewer distinct values than this fraction of their values are inferred as categories
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+Converter = Callable[[Any], Any]
+
+
+def _numbers(dtype: str) -> Converter:
+    def convert(series: Any) -> Any:
+        return pd.to_numeric(series, errors="coerce").astype(dtype)
+    return convert
+
+
+def _timestamps(series: Any) -> Any:
+    return pd.to_datetime(series, utc=True, errors="coerce", format="ISO8601")
+
+
+# column types of a schema and the conversion of decoded values to their pandas dtype, which the
+# loaders map to SQL types: Int16 SMALLINT, Int32 INTEGER, Int64 BIGINT, float32 REAL,
+# float64 DOUBLE PRECISION, boolean BOOLEAN, datetime TIMESTAMPTZ, category and string TEXT
+COLUMN_TYPES: Dict[str, Converter] = {
+    "int16": _numbers("Int16"),
+    "int32": _numbers("Int32"),
+    "int64": _numbers("Int64"),
+    "float32": _numbers("float32"),
+    "float64": _numbers("float64"),
+    "bool": lambda series: series.astype("boolean"),
+    "category": lambda series: series.astype("category"),
+    "string": lambda series: series.astype("string"),
+    "timestamptz": _timestamps,
+}
+
+ALIASES = {
+    "int": "int64",
+    "integer": "int64",
+    "bigint": "int64",
+    "float": "float64",
+    "double": "float64",
+    "boolean": "bool",
+    "text": "string",
+    "str": "string",
+    "timestamp": "timestamptz",
+    "datetime": "timestamptz",
+}
+
+
+def column_type(name: Any) -> str:
+    """
+    The column type named 'name' in a schema, e.g. int64, or one of its aliases
+    """
+    normalized = ALIASES.get(str(name).strip().lower(), str(name).strip().lower())
+    if normalized not in COLUMN_TYPES:
+        raise ValueError(f"Unknown column type '{name}', expected one of {sorted(COLUMN_TYPES)}")
+    return normalized
+
+
+def infer_column_type(series: Any) -> Optional[str]:
+    """
+    The column type of the values of a decoded column, None while it holds no values. Text holding
+    only numbers or ISO 8601 timestamps is typed as such, numbers with leading zeros stay text.
+    """
+    values = series.dropna()
+    if len(values) == 0:
+        return None
+    kind = dtypes.infer_dtype(values, skipna=True)
+    if kind == "boolean":
+        return "bool"
+    if kind == "integer":
+        return "int64"
+    if kind in ("floating", "mixed-integer-float"):
+        return "float64"
+    if kind in ("datetime", "datetime64"):
+        return "timestamptz"
+    if kind != "string":
+        return None
+
+    text = values.astype(str)
+    numbers = pd.to_numeric(text, errors="coerce")
+    if numbers.notna().all() and not text.str.match(r"^[-+]?0\d").any():
+        return "int64" if (numbers % 1 == 0).all() else "float64"
+    if _timestamps(text).notna().all():
+        return "timestamptz"
+    if values.nunique() <= CATEGORY_MAX_UNIQUE_RATIO * len(values):
+        return "category"
+    return "string"
+
+
+class Schema():
+    """
+    Column types of the records of an ETL, applied to every page as it is decoded, so pages are held in
+    compact pandas dtypes instead of objects and the loaders create typed columns from them.
+
+    Types are declared for the fields of the API records, before the transform renames them:
+
+    columns   {field: type} with type one of int16, int32, int64, float32, float64, bool, category,
+              string, timestamptz
+    infer     give the fields without a declared type the type of their values on the first page holding
+              any, which is then kept for the rest of the run
+
+    Values that don't convert to a numeric or timestamp type become nulls, as with transform casts.
+    Integer fields holding fractions raise a ValueError, which sends the page to the dead letter store.
+    """
+    def __init__(self, columns: Dict[str, str], infer: bool = False, logger: Optional[logging.Logger] = None):
+        self.columns = columns
+        self.infer = infer
+        self.logger = logger
+        self.inferred: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def compile(cls, config: Optional[Dict[str, Any]], logger: Optional[logging.Logger] = None) -> "Schema":
+        config = config or {}
+        unknown = set(config) - {"columns", "infer"}
+        if unknown:
+            raise ValueError(f"Unknown schema sections {sorted(unknown)}")
+        columns = {str(field): column_type(name) for field, name in (config.get("columns") or {}).items()}
+        return cls(columns, bool(config.get("infer", False)), logger)
+
+    def types(self, df: DataFrame) -> Dict[str, str]:
+        """
+        The type of every column of 'df' that has one, inferring the types of new columns if enabled
+        """
+        found = {column: self.columns.get(column) or self.inferred.get(column) for column in df.columns}
+        if self.infer and any(name is None for name in found.values()):
+            with self._lock:
+                inferred = {}
+                for column, name in found.items():
+                    if name is None and column not in self.inferred:
+                        name = infer_column_type(df[column])
+                        if name is not None:
+                            inferred[column] = name
+                self.inferred.update(inferred)
+            if inferred and self.logger is not None:
+                self.logger.info(f"Inferred column types {inferred}")
+            found = {column: name or self.inferred.get(column) for column, name in found.items()}
+        return {column: name for column, name in found.items() if name is not None}
+
+    def apply(self, df: DataFrame) -> DataFrame:
+        # conversions assign whole columns, which a shallow copy keeps off the caller's data frame
+        df = df.copy(deep=False)
+        for column, name in self.types(df).items():
+            try:
+                df[column] = COLUMN_TYPES[name](df[column])
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Column '{column}' does not hold {name} values: {e}") from e
+        return df
@@ -0,0 +1,87 @@
+from typing import Any, Dict, List, Tuple
+from core.resources import registry as resources
+from .keyset import odata_literal
+
+# GHO dimensions listing the values of the columns an indicator can be sharded on
+DIMENSIONS = {
+    "SpatialDim": "COUNTRY",
+    "ParentLocationCode": "REGION",
+}
+
+
+def dimension_values(api: str, dimension: str) -> List[Any]:
+    """
+    Codes of a GHO dimension, e.g. the country codes of COUNTRY, requested over the shared session of the API host
+    """
+    response = resources.session(api).get(f"{api}/DIMENSION/{dimension}/DimensionValues",
+                                          headers={'Content-type': 'application/json'})
+    response.raise_for_status()
+    return [item["Code"] for item in response.json()["value"]]
+
+
+def value_shards(column: str, values: List[Any], remainder: bool = True) -> List[Tuple[str, str]]:
+    """
+    One (name, $filter) shard per value, and a shard for the rows matching none of them. The remainder
+    lists the values once with the 'in' operator, so the ~200 countries of SpatialDim keep its url short.
+    """
+    shards = [(f"{column}={value}", f"{column} eq {odata_literal(value)}") for value in values]
+    if remainder:
+        others = ",".join(odata_literal(value) for value in values)
+        shards.append((f"{column}=other",
+                       f"not ({column} in ({others})) or {column} eq null" if others else f"{column} eq null"))
+    return shards
+
+
+def range_shards(column: str, start: int, stop: int, step: int, remainder: bool = True) -> List[Tuple[str, str]]:
+    """
+    One (name, $filter) shard per [low, low + step) range between 'start' and 'stop', and shards for the
+    rows before, after and outside the ranges
+    """
+    if step < 1:
+        raise ValueError(f"Shard ranges of {column} need a positive step")
+    shards = []
+    for low in range(start, stop, step):
+        high = min(low + step, stop)
+        shards.append((f"{column}={low}-{high - 1}", f"{column} ge {low} and {column} lt {high}"))
+    if remainder:
+        shards.append((f"{column}=other", f"{column} lt {start} or {column} ge {stop} or {column} eq null"))
+    return shards
+
+
+def shard_filters(shards: Dict[str, Any], api: str) -> List[Tuple[str, str]]:
+    """
+    The (name, $filter) shards of a 'shards' section: explicit 'values', a 'range' of numbers such as
+    TimeDim years, or by default the values of the GHO dimension of the 'by' column
+    """
+    column = shards.get("by")
+    if column is None:
+        raise ValueError("Shards need a 'by' column, e.g. SpatialDim, ParentLocationCode or TimeDim")
+    remainder = bool(shards.get("remainder", True))
+    if "range" in shards:
+        bounds = shards["range"]
+        return range_shards(column, int(bounds["start"]), int(bounds["stop"]), int(bounds.get("step", 1)), remainder)
+    values = shards.get("values")
+    if values is None:
+        dimension = shards.get("dimension") or DIMENSIONS.get(column)
+        if dimension is None:
+            raise ValueError(f"Shards by {column} need 'values', a 'range' or a GHO 'dimension' to list")
+        values = dimension_values(shards.get("api", api), dimension)
+    return value_shards(column, list(values), remainder)
+
+
+def shard_configs(key: str, config: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Split an ETL config with a 'shards' section into one config per shard, keyed '<key>/<shard name>'
+    so every shard keeps its own status entry. Configs without shards are returned as they are.
+    """
+    shards = config.get("shards")
+    if not shards:
+        return [(key, config)]
+    configs = []
+    for name, shard_filter in shard_filters(shards, config["api"]):
+        shard_config = dict(config)
+        shard_config.pop("shards")
+        base_filter = config.get("filter")
+        shard_config["filter"] = f"({base_filter}) and ({shard_filter})" if base_filter else shard_filter
+        configs.append((f"{key}/{name}", shard_config))
+    return configs
@@ -0,0 +1,358 @@
+import gzip
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Dict, IO, List, Optional, Tuple, Type
+import pandas as pd
+from pandas import DataFrame
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - pyarrow is only needed by the parquet and arrow sinks
+    pa = None
+
+DEFAULT_BATCH_ROWS = 500000
+DEFAULT_ROW_GROUP_ROWS = 100000
+DEFAULT_MAX_OPEN_FILES = 64
+# hive's name for the partition of null keys, understood by pyarrow, spark and duckdb
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+def partition_directory(keys: List[str], values: Tuple[Any, ...]) -> str:
+    parts = []
+    for key, value in zip(keys, values):
+        text = NULL_PARTITION if pd.isna(value) else str(value).replace("/", "_").replace(os.sep, "_")
+        parts.append(f"{key}={text}")
+    return os.path.join(*parts)
+
+
+class _PartFile(ABC):
+    """
+    A data file being written under a temporary name and renamed into place once its batch is committed,
+    so readers never see a partial file.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.temp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+
+    @abstractmethod
+    def write(self, df: DataFrame):
+        """
+        Append a data frame to the temporary file
+        """
+        pass
+
+    @abstractmethod
+    def close(self):
+        """
+        Finish the temporary file, it can be published afterwards
+        """
+        pass
+
+    def publish(self):
+        os.replace(self.temp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class _ArrowPartFile(_PartFile):
+    """
+    Data frames converted to arrow tables with the schema of the first one, buffered until 'buffer_rows'
+    rows and written as one chunk
+    """
+    def __init__(self, path: str, buffer_rows: int):
+        super().__init__(path)
+        self.buffer_rows = buffer_rows
+        self.schema: Optional[Any] = None
+        self.writer: Optional[Any] = None
+        self._buffer: List[Any] = []
+        self._buffered = 0
+
+    def write(self, df: DataFrame):
+        self._buffer.append(self.table(df))
+        self._buffered += len(df)
+        if self._buffered >= self.buffer_rows:
+            self._write_buffer()
+
+    def _write_buffer(self):
+        if self._buffer:
+            self.write_chunk(pa.concat_tables(self._buffer))
+        self._buffer = []
+        self._buffered = 0
+
+    @abstractmethod
+    def write_chunk(self, table: Any):
+        """
+        Write an arrow table to the open writer
+        """
+        pass
+
+    def table(self, df: DataFrame) -> Any:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.schema is None:
+            # columns that are all null in the first chunk can still hold strings later, and categories
+            # are stored as their values since every chunk has its own dictionary
+            self.schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type)
+                                     else field.with_type(field.type.value_type) if pa.types.is_dictionary(field.type)
+                                     else field for field in table.schema]).remove_metadata()
+            self.writer = self.open_writer(self.schema)
+        try:
+            return table.cast(self.schema)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            raise ValueError(f"Batch does not match the schema of {self.path}, declare the column types "
+                             f"with the schema or transform casts: {e}") from e
+
+    @abstractmethod
+    def open_writer(self, schema: Any) -> Any:
+        """
+        Open a writer of the temporary file for tables of 'schema'
+        """
+        pass
+
+    def close(self):
+        self._write_buffer()
+        if self.writer is not None:
+            self.writer.close()
+        elif not os.path.exists(self.temp_path):
+            open(self.temp_path, "wb").close()
+
+
+class _ParquetPartFile(_ArrowPartFile):
+    def __init__(self, path: str, buffer_rows: int, compression: Optional[str]):
+        super().__init__(path, buffer_rows)
+        self.compression = compression
+
+    def open_writer(self, schema: Any) -> Any:
+        return pq.ParquetWriter(self.temp_path, schema, compression=self.compression)
+
+    def write_chunk(self, table: Any):
+        assert self.writer is not None
+        # each buffered chunk is a single row group
+        self.writer.write_table(table, row_group_size=max(1, len(table)))
+
+
+class _IpcPartFile(_ArrowPartFile):
+    def __init__(self, path: str, buffer_rows: int, compression: Optional[str]):
+        super().__init__(path, buffer_rows)
+        self.compression = compression
+
+    def open_writer(self, schema: Any) -> Any:
+        return pa_ipc.new_file(self.temp_path, schema, options=pa_ipc.IpcWriteOptions(compression=self.compression))
+
+    def write_chunk(self, table: Any):
+        assert self.writer is not None
+        self.writer.write_table(table)
+
+
+class _CsvPartFile(_PartFile):
+    """
+    Data frames appended as CSV rows as they arrive, through the file's own write buffer
+    """
+    def __init__(self, path: str, compression: Optional[str]):
+        super().__init__(path)
+        self.file: IO[str] = (gzip.open(self.temp_path, "wt", newline="") if compression == "gzip"
+                              else open(self.temp_path, "w", newline=""))
+        self.header = True
+
+    def write(self, df: DataFrame):
+        df.to_csv(self.file, index=False, header=self.header)
+        self.header = False
+
+    def close(self):
+        self.file.close()
+
+
+class FileSink(ABC):
+    """
+    Streams data frames into files under '<directory>/<table>', hive partitioned by 'partition_by'
+    columns, e.g. '<table>/Region=AFR/TimeDim=2013/part-....parquet'.
+
+    Like the postgres loaders, rows are committed in batches: once 'batch_rows' rows were written, or
+    on flush(), every open part file is closed and renamed into place, and the next rows go to new part
+    files. Within a part file, rows are buffered per partition and written in chunks of 'row_group_rows'
+    (a parquet row group or an arrow record batch), so memory is bounded by the open partitions rather
+    than the size of the indicator.
+    """
+    format = ""
+    extension = ""
+
+    def __init__(self, table: str, config: Dict[str, Any], logger: logging.Logger):
+        if "directory" not in config:
+            raise ValueError(f"The {self.format} destination needs a 'directory'")
+        self.table = table
+        self.logger = logger
+        self.root = os.path.join(os.path.expanduser(config["directory"]), table)
+        partition_by = config.get("partition_by") or []
+        self.partition_by: List[str] = [partition_by] if isinstance(partition_by, str) else list(partition_by)
+        self.batch_rows = int(config.get("batch_rows", DEFAULT_BATCH_ROWS))
+        self.row_group_rows = int(config.get("row_group_rows", DEFAULT_ROW_GROUP_ROWS))
+        self.max_open_files = int(config.get("max_open_files", DEFAULT_MAX_OPEN_FILES))
+        self.compression = config.get("compression")
+        self._files: Dict[str, _PartFile] = {}
+        # part files closed early to cap open files, published with the rest of their batch
+        self._closed: List[_PartFile] = []
+        self._rows = 0
+        self._batch = 0
+        # unique per sink, the shards of an indicator write to the same directories concurrently
+        self._run = f"{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    @abstractmethod
+    def open_part(self, path: str) -> _PartFile:
+        """
+        Open the part file at 'path' in the format of the sink
+        """
+        pass
+
+    def _part(self, directory: str) -> _PartFile:
+        if directory not in self._files:
+            if len(self._files) >= self.max_open_files:
+                # too many partitions in one batch, finish the oldest part file to cap open files and buffers
+                part = self._files.pop(next(iter(self._files)))
+                part.close()
+                self._closed.append(part)
+            full_directory = os.path.join(self.root, directory)
+            os.makedirs(full_directory, exist_ok=True)
+            name = f"part-{self._run}-{self._batch:05d}-{len(os.listdir(full_directory)):05d}{self.extension}"
+            self._files[directory] = self.open_part(os.path.join(full_directory, name))
+        return self._files[directory]
+
+    def write(self, df: DataFrame) -> bool:
+        """
+        Write a data frame. Returns True when it and all rows before it are in closed files.
+        """
+        if not self.partition_by:
+            self._part("").write(df)
+        else:
+            missing = [key for key in self.partition_by if key not in df.columns]
+            if missing:
+                raise ValueError(f"Partition columns {missing} are not columns of {self.table}")
+            groups = df.groupby(self.partition_by, dropna=False, observed=True, sort=False)
+            for values, part in groups:
+                values = values if isinstance(values, tuple) else (values,)
+                self._part(partition_directory(self.partition_by, values)).write(
+                    part.drop(columns=self.partition_by))
+        self._rows += len(df)
+
+        if self._rows >= self.batch_rows:
+            return self.flush()
+        return False
+
+    def flush(self) -> bool:
+        """
+        Close the part files of the batch and move them into place. Returns True if any rows were committed.
+        """
+        if self._rows == 0:
+            return False
+        for part in self._files.values():
+            part.close()
+        parts = self._closed + list(self._files.values())
+        for part in parts:
+            part.publish()
+        self.logger.debug(f"Wrote {self._rows} rows of {self.table} to {len(parts)} {self.format} files")
+        self._files = {}
+        self._closed = []
+        self._rows = 0
+        self._batch += 1
+        return True
+
+    def discard(self):
+        """
+        Drop the part files of the batch without publishing them, e.g. after a failed write
+        """
+        for part in self._files.values():
+            try:
+                part.close()
+            except Exception as e:
+                self.logger.debug(f"Could not close a discarded part file of {self.table}: {e}")
+        for part in self._closed + list(self._files.values()):
+            part.remove()
+        self._files = {}
+        self._closed = []
+        self._rows = 0
+        self._batch += 1
+
+
+class ParquetSink(FileSink):
+    format = "parquet"
+    extension = ".parquet"
+
+    def __init__(self, table: str, config: Dict[str, Any], logger: logging.Logger):
+        if pa is None:
+            raise ImportError("The parquet destination needs pyarrow, install it with 'pip install pyarrow'")
+        super().__init__(table, config, logger)
+        self.compression = self.compression or "snappy"
+
+    def open_part(self, path: str) -> _PartFile:
+        return _ParquetPartFile(path, self.row_group_rows, self.compression)
+
+
+class ArrowSink(FileSink):
+    format = "arrow"
+    extension = ".arrow"
+
+    def __init__(self, table: str, config: Dict[str, Any], logger: logging.Logger):
+        if pa is None:
+            raise ImportError("The arrow destination needs pyarrow, install it with 'pip install pyarrow'")
+        super().__init__(table, config, logger)
+
+    def open_part(self, path: str) -> _PartFile:
+        return _IpcPartFile(path, self.row_group_rows, self.compression)
+
+
+class CsvSink(FileSink):
+    format = "csv"
+    extension = ".csv"
+
+    def __init__(self, table: str, config: Dict[str, Any], logger: logging.Logger):
+        super().__init__(table, config, logger)
+        if self.compression not in (None, "gzip"):
+            raise ValueError(f"Unknown csv compression '{self.compression}', expected 'gzip'")
+        if self.compression == "gzip":
+            self.extension = ".csv.gz"
+
+    def open_part(self, path: str) -> _PartFile:
+        return _CsvPartFile(path, self.compression)
+
+
+FILE_SINKS: Dict[str, Type[FileSink]] = {
+    "parquet": ParquetSink,
+    "arrow": ArrowSink,
+    "csv": CsvSink,
+}
+
+
+def destinations_of(config: Dict[str, Any]) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """
+    The (name, type, settings) of each ETL destination. 'destination' is a single {type: settings} mapping,
+    e.g. {'postgres': {'url': ...}}, or a list of them. Names default to the type, numbered when repeated,
+    and can be set with a 'name' setting.
+    """
+    destination = config.get("destination") or {}
+    entries = destination if isinstance(destination, list) else [destination]
+    destinations = []
+    names: Dict[str, int] = {}
+    for entry in entries:
+        if not isinstance(entry, dict) or len(entry) != 1:
+            raise ValueError(f"A destination needs exactly one of postgres, {', '.join(FILE_SINKS)}")
+        kind, settings = next(iter(entry.items()))
+        if kind != "postgres" and kind not in FILE_SINKS:
+            raise ValueError(f"Unknown destination '{kind}', expected one of postgres, {', '.join(FILE_SINKS)}")
+        settings = settings or {}
+        name = str(settings.get("name") or kind)
+        names[name] = names.get(name, 0) + 1
+        if names[name] > 1:
+            name = f"{name}{names[name]}"
+        destinations.append((name, kind, settings))
+    if not destinations:
+        raise ValueError("An ETL needs at least one destination")
+    return destinations
+
+
+def create_file_sink(name: str, table: str, config: Dict[str, Any], logger: logging.Logger) -> FileSink:
+    return FILE_SINKS[name](table, config, logger)
@@ -1,15 +1,34 @@
 import os
+import threading
 import yaml
 import logging
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+from sqlalchemy.engine import Engine
+from core.metrics import profile_worker
 from core.plugin import PluginInterface
+from core.resources import registry as resources
+from core.thread import CancellationToken
 from .etl.etl import ETL
+from .etl.shards import shard_configs
+from .etl.sinks import destinations_of
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_HOST_CONCURRENCY = 8
 
 
 class GHOTOPOSTGRES(PluginInterface):
     def __init__(self, path: str, logger: logging.Logger):
+        self._path = path
         self._config = self.load_plugin_config(path)
         self.logger = logger
+        # tokens of the runs in flight, stop() cancels them and leaves later runs alone
+        self._tokens: Set[CancellationToken] = set()
+        self._tokens_lock = threading.Lock()
+        # kept between runs, like the engines and sessions of the resource registry
+        self._host_limiters: Dict[str, threading.BoundedSemaphore] = {}
+        self._host_limiters_lock = threading.Lock()
 
     def load_plugin_config(self, plugin_path: str) -> Any:
         def database_constructor(loader: yaml.SafeLoader, node: yaml.nodes.ScalarNode) -> str:
@@ -32,14 +51,106 @@ class GHOTOPOSTGRES(PluginInterface):
                 self.logger.error(f"Error reading YAML file: {e}")
         return plugin_config
 
-    def execute(self):
-        self.logger.info("Starting GHOTOPOSTGRES plugin")
-        etls_from_config = self._config["etl"]
-        indicator = self._config["run"]
-        etl = ETL(etls_from_config[indicator], indicator, self.logger)
-        etl.start()
+    @staticmethod
+    def etl_keys(config: Any) -> List[str]:
+        """
+        ETL entries selected by 'run': a single key, a list of keys or 'all'
+        """
+        run = config["run"]
+        if run == "all":
+            return list(config["etl"])
+        keys = [run] if isinstance(run, str) else list(run)
+        unknown = [key for key in keys if key not in config["etl"]]
+        if unknown:
+            raise ValueError(f"No ETL configuration for {unknown}")
+        return keys
+
+    def etl_configs(self, keys: List[str]) -> List[Tuple[str, Any]]:
+        """
+        The (key, config) of each ETL to run, with sharded indicators split into one ETL per shard
+        """
+        configs = []
+        for key in keys:
+            try:
+                shards = shard_configs(key, self._config["etl"][key])
+            except Exception as e:
+                self.logger.error(f"Could not list the shards of {key}, skipping it: {e}")
+                continue
+            if len(shards) > 1 or shards[0][0] != key:
+                self.logger.info(f"Split {key} into {len(shards)} shards")
+            configs.extend(shards)
+        return configs
+
+    def schedules(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Each selected ETL runs as its own job in daemon mode, on its 'schedule' or the plugin's
+        """
+        schedules = {}
+        for key in self.etl_keys(self._config):
+            schedule = self._config["etl"][key].get("schedule") or self._config.get("schedule")
+            if schedule:
+                schedules[key] = schedule
+        return schedules
+
+    def create_etls(self, configs: List[Tuple[str, Any]], concurrency: int) -> List[ETL]:
+        """
+        Build the ETLs for the (key, config) pairs. ETLs loading into the same database share the registry's
+        engine, and ETLs extracting from the same API host share its HTTP session and a limit on requests
+        in flight.
+        """
+        host_concurrency = int(self._config.get("host_concurrency", DEFAULT_HOST_CONCURRENCY))
+        engines: Dict[str, Engine] = {}
+        etls = []
+        for key, etl_config in configs:
+            for _, kind, settings in destinations_of(etl_config):
+                if kind == "postgres" and settings["url"] not in engines:
+                    engines[settings["url"]] = resources.engine(settings["url"], pool_size=concurrency)
+            host = urlparse(etl_config["api"]).netloc
+            with self._host_limiters_lock:
+                if host not in self._host_limiters:
+                    self._host_limiters[host] = threading.BoundedSemaphore(host_concurrency)
+            etls.append(ETL(etl_config, key, self.logger, engines=engines, host_limiter=self._host_limiters[host],
+                            session=resources.session(etl_config["api"], pool_size=host_concurrency),
+                            base_directory=self._path))
+        return etls
+
+    def execute(self, token: Optional[CancellationToken] = None, job: Optional[str] = None):
+        """
+        Run the selected ETLs, or only the ETL 'job' when the scheduler runs it. Every run gets a token of
+        its own, so a run after stop() isn't cancelled from the start.
+        """
+        token = token if token is not None else CancellationToken()
+        with self._tokens_lock:
+            self._tokens.add(token)
+        try:
+            self.run_etls(token, job)
+        finally:
+            with self._tokens_lock:
+                self._tokens.discard(token)
+
+    def run_etls(self, token: CancellationToken, job: Optional[str] = None):
+        """
+        Run the ETLs of a run until they finish or 'token' is cancelled
+        """
+        self.logger.info("Starting GHOTOPOSTGRES plugin" if job is None else f"Starting GHOTOPOSTGRES job {job}")
+        configs = self.etl_configs([job] if job is not None else self.etl_keys(self._config))
+        if not configs:
+            self.logger.info("Finishing execution of GHOTOPOSTGRES plugin")
+            return
+        concurrency = max(1, int(self._config.get("concurrency", DEFAULT_CONCURRENCY)))
+        etls = self.create_etls(configs, concurrency)
+        concurrency = min(len(etls), concurrency)
+        # indicators, and the shards of an indicator, are independent of each other, at most 'concurrency'
+        # of them run at a time
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ghotopostgres") as executor:
+            # ETLs still waiting for a worker when the plugin is stopped don't start
+            list(executor.map(profile_worker(lambda etl: None if token.cancelled() else etl.start(token)), etls))
         self.logger.info("Finishing execution of GHOTOPOSTGRES plugin")
 
     def stop(self):
+        with self._tokens_lock:
+            tokens = list(self._tokens)
+        for token in tokens:
+            token.cancel()
         self.logger.info("Configured to pause...")
         self.logger.info("Exiting gracefully...")
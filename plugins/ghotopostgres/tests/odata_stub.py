@@ -0,0 +1,70 @@
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+class ODataStub():
+    """
+    Local stand-in for the GHO OData API serving a fixed list of records with $top/$skip paging.
+    'failures' is a list of HTTP statuses answered, in order, before any real response.
+    Responses carry an ETag and requests with a matching If-None-Match are answered 304 Not Modified.
+    'max_top' caps the rows of a page like servers capping '$top' do.
+    """
+    def __init__(self, records: List[Dict[str, Any]], failures: Optional[List[int]] = None,
+                 max_top: Optional[int] = None):
+        self.records = records
+        self.failures = list(failures or [])
+        self.max_top = max_top
+        self.requests: List[str] = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                stub.requests.append(self.path)
+                if stub.failures:
+                    self.send_response(stub.failures.pop(0))
+                    self.send_header("Retry-After", "0")
+                    self.end_headers()
+                    return
+                query = parse_qs(urlparse(self.path).query)
+                top = int(query.get("$top", ["100"])[0])
+                if stub.max_top is not None:
+                    top = min(top, stub.max_top)
+                skip = int(query.get("$skip", ["0"])[0])
+                body = json.dumps({"@odata.count": len(stub.records),
+                                   "value": stub.records[skip:skip + top]}).encode()
+                etag = f'"{hashlib.sha1(body).hexdigest()}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/api"
+
+    def __enter__(self) -> "ODataStub":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
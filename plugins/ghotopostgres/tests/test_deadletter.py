@@ -0,0 +1,167 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+from urllib.parse import parse_qs, urlparse
+import pandas as pd
+import psycopg2
+
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from etl.deadletter import DeadLetterStore, RecoveringLoader, bisect_rows  # type: ignore
+from etl.etl import ETL  # type: ignore
+from core.checkpoint import CheckpointStore, read_status
+from core.exceptions import TooManyBadRecordsError
+
+
+class FlakyLoader():
+    """
+    Buffers rows and fails to commit a buffer holding a negative Id, like a database rejecting a batch
+    """
+    def __init__(self, batch_rows=4):
+        self.batch_rows = batch_rows
+        self.buffer = []
+        self.committed = []
+
+    def write(self, df):
+        self.buffer.extend(df["Id"])
+        return self.flush() if len(self.buffer) >= self.batch_rows else False
+
+    def flush(self):
+        if not self.buffer:
+            return False
+        if any(i < 0 for i in self.buffer):
+            raise ValueError("invalid input value")
+        self.committed.extend(self.buffer)
+        self.buffer = []
+        return True
+
+    def discard(self):
+        self.buffer = []
+
+
+class TestDeadLetters(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.logger = MagicMock()
+        self.store = DeadLetterStore(os.path.join(self.directory, "dead_letters.sqlite"), self.logger)
+
+    def test_bisect_isolates_failing_rows(self):
+        df = pd.DataFrame({"Id": [1, -2, 3, 4, -5, 6, 7]})
+        rejected = []
+
+        def action(part):
+            if (part["Id"] < 0).any():
+                raise ValueError("bad")
+            return list(part["Id"])
+
+        parts = bisect_rows(df, action, lambda rows, error: rejected.extend(rows["Id"]))
+        self.assertListEqual([i for part in parts for i in part], [1, 3, 4, 6, 7])
+        self.assertListEqual(rejected, [-2, -5])
+
+    def test_recovering_loader_loads_good_rows_of_a_failed_batch(self):
+        flaky = FlakyLoader()
+        loader = RecoveringLoader(flaky, self.store, "NCDMORT3070", "postgres", self.logger)
+        self.assertFalse(loader.write(pd.DataFrame({"Id": [1, 2]})))
+        # the commit of the buffer fails, rows written before the failing page are recovered too
+        self.assertTrue(loader.write(pd.DataFrame({"Id": [-3, 4]})))
+        self.assertTrue(loader.write(pd.DataFrame({"Id": [5, 6, 7, 8]})))
+        self.assertListEqual(sorted(flaky.committed), [1, 2, 4, 5, 6, 7, 8])
+
+        letters = self.store.pending("NCDMORT3070")
+        self.assertEqual(len(letters), 1)
+        self.assertEqual((letters[0].stage, letters[0].destination), ("load", "postgres"))
+        self.assertEqual(letters[0].frame()["Id"].tolist(), [-3])
+        self.assertIn("invalid input value", letters[0].error)
+
+    def test_too_many_bad_rows_stop_the_run(self):
+        loader = RecoveringLoader(FlakyLoader(batch_rows=1), self.store, "NCDMORT3070", "postgres", self.logger,
+                                  max_bad_rows=1)
+        loader.write(pd.DataFrame({"Id": [-1]}))
+        with self.assertRaises(TooManyBadRecordsError):
+            loader.write(pd.DataFrame({"Id": [-2]}))
+
+    def test_broken_connections_fail_the_run_instead_of_being_bisected(self):
+        flaky = FlakyLoader(batch_rows=1)
+        flaky.flush = MagicMock(side_effect=psycopg2.InterfaceError("connection already closed"))
+        loader = RecoveringLoader(flaky, self.store, "NCDMORT3070", "postgres", self.logger)
+        with self.assertRaises(psycopg2.InterfaceError):
+            loader.write(pd.DataFrame({"Id": [1, 2]}))
+        self.assertEqual(flaky.flush.call_count, 1)
+        self.assertListEqual(self.store.pending("NCDMORT3070"), [])
+
+
+class TestETLDeadLetters(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.config = {
+            "api": "http://test_gho/api",
+            "indicator": "NCDMORT3070",
+            "page_size": 2,
+            "transform": {"columns": {"Id": "Id"}},
+            "destination": {"csv": {"directory": self.directory, "batch_rows": 100}},
+            "dead_letters": {"path": os.path.join(self.directory, "dead_letters.sqlite")},
+        }
+        self.logger = MagicMock()
+        self.status_path = os.path.join(self.directory, "status.yaml")
+        self.malformed_skip = None
+
+    def fake_post(self, uri, headers=None, timeout=None):
+        query = parse_qs(urlparse(uri).query)
+        skip, top = int(query["$skip"][0]), int(query["$top"][0])
+        response = MagicMock()
+        if skip == self.malformed_skip:
+            response.content = b'{"@odata.count": 8, "value": [{"Id": 4}, {"Id": '
+        else:
+            response.content = json.dumps({"@odata.count": 8,
+                                           "value": [{"Id": i} for i in range(skip, min(8, skip + top))]}).encode()
+        return response
+
+    def run_etl(self, config=None):
+        with patch('requests.post', side_effect=self.fake_post):
+            etl = ETL(config or self.config, "NCDMORT3070", self.logger)
+            etl.checkpoints = CheckpointStore(self.status_path, "GHOTopOSTGRES", self.logger)
+            etl.start()
+        return etl
+
+    def loaded_ids(self):
+        root = os.path.join(self.directory, "NCDMORT3070")
+        frames = [pd.read_csv(os.path.join(path, file)) for path, _, files in os.walk(root) for file in files]
+        return sorted(pd.concat(frames)["Id"]) if frames else []
+
+    def test_bad_rows_and_pages_are_set_aside_and_replayed(self):
+        self.malformed_skip = 4
+        apply = ETL.transform
+
+        def failing_transform(etl, df):
+            if (df["Id"] == 1).any():
+                raise ValueError("cannot parse 1")
+            return apply(etl, df)
+
+        with patch.object(ETL, "transform", failing_transform):
+            etl = self.run_etl()
+        self.assertListEqual(self.loaded_ids(), [0, 2, 3, 6, 7])
+        self.assertEqual(read_status(self.status_path)["plugins"]["GHOTopOSTGRES"]["NCDMORT3070"], {"offset": 8})
+        # the extract and transform stages record their letters concurrently, in either order
+        letters = {letter.stage: letter for letter in etl.dead_letters.pending("NCDMORT3070")}
+        self.assertListEqual(sorted(letters), ["extract", "transform"])
+        self.assertIn("$skip=4", letters["extract"].record)
+
+        self.malformed_skip = None
+        config = {**self.config, "dead_letters": {**self.config["dead_letters"], "replay": True}}
+        etl = self.run_etl(config)
+        self.assertListEqual(self.loaded_ids(), list(range(8)))
+        self.assertEqual(etl.dead_letters.count("NCDMORT3070"), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import json
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+import pandas as pd
+
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from etl.etl import ETL  # type: ignore
+from etl.keyset import last_watermark  # type: ignore
+from etl.loaders import infer_sql_type  # type: ignore
+from etl.schema import Schema, infer_column_type  # type: ignore
+
+
+class TestSchema(unittest.TestCase):
+
+    def test_applies_declared_types(self):
+        schema = Schema.compile({"columns": {"Id": "int64", "SpatialDim": "category", "NumericValue": "float",
+                                             "TimeDim": "int16", "Date": "timestamptz"}})
+        df = schema.apply(pd.DataFrame({
+            "Id": [11044099, 11044101],
+            "SpatialDim": ["AFG", "AFG"],
+            "NumericValue": [None, "12.5"],
+            "TimeDim": [2013, None],
+            "Date": ["2015-06-01T13:06:16.897+02:00", None],
+            "Value": ["Yes", "No data received"],
+        }))
+        self.assertEqual(str(df["Id"].dtype), "Int64")
+        self.assertEqual(str(df["SpatialDim"].dtype), "category")
+        self.assertEqual(str(df["NumericValue"].dtype), "float64")
+        self.assertEqual(str(df["TimeDim"].dtype), "Int16")
+        self.assertEqual(str(df["Date"].dtype), "datetime64[ns, UTC]")
+        self.assertEqual(df["Date"][0], pd.Timestamp("2015-06-01T11:06:16.897", tz="UTC"))
+        self.assertEqual(df["Value"].dtype, object)
+        self.assertListEqual([infer_sql_type(df[column]) for column in df.columns],
+                             ["BIGINT", "TEXT", "DOUBLE PRECISION", "SMALLINT", "TIMESTAMPTZ", "TEXT"])
+
+    def test_invalid_schemas_and_values(self):
+        with self.assertRaises(ValueError):
+            Schema.compile({"columns": {"Id": "uuid"}})
+        with self.assertRaises(ValueError):
+            Schema.compile({"types": {"Id": "int64"}})
+        with self.assertRaises(ValueError):
+            Schema.compile({"columns": {"Id": "int64"}}).apply(pd.DataFrame({"Id": [1.5]}))
+
+    def test_infers_types_from_the_first_values(self):
+        self.assertEqual(infer_column_type(pd.Series(["2013", "2014", None])), "int64")
+        self.assertEqual(infer_column_type(pd.Series(["0123", "0456"])), "string")
+        self.assertEqual(infer_column_type(pd.Series(["2015-06-01T13:06:16+02:00"])), "timestamptz")
+        self.assertEqual(infer_column_type(pd.Series(["EMR", "EMR", "AFR", "EMR"])), "category")
+        self.assertIsNone(infer_column_type(pd.Series([None, None])))
+
+        schema = Schema.compile({"columns": {"Id": "int32"}, "infer": True})
+        first = schema.apply(pd.DataFrame({"Id": [1, 2], "NumericValue": [None, None], "TimeDim": ["2013", "2014"]}))
+        self.assertEqual(str(first["Id"].dtype), "Int32")
+        self.assertEqual(schema.inferred, {"TimeDim": "int64"})
+        # the type of a column is kept once inferred, columns without values get theirs later
+        second = schema.apply(pd.DataFrame({"Id": [3], "NumericValue": [1.5], "TimeDim": ["2015.0"]}))
+        self.assertEqual(schema.inferred, {"TimeDim": "int64", "NumericValue": "float64"})
+        self.assertEqual(str(second["TimeDim"].dtype), "Int64")
+
+    def test_watermark_of_typed_timestamps(self):
+        df = Schema.compile({"columns": {"Date": "timestamptz", "Id": "int64"}}).apply(
+            pd.DataFrame({"Date": ["2015-06-01T13:06:16+02:00"], "Id": [7]}))
+        self.assertEqual(last_watermark(df, ["Date", "Id"]), {"Date": "2015-06-01T11:06:16+00:00", "Id": 7})
+
+    def test_etl_decodes_pages_into_schema_types(self):
+        config = {
+            "api": "http://test_gho/api",
+            "indicator": "NCD_CCS_BreastCancer",
+            "schema": {"columns": {"Id": "int64", "SpatialDim": "category", "NumericValue": "float64"}},
+            "transform": {"columns": {"Id": "Id", "SpatialDim": "Country", "NumericValue": "NumericValue"}},
+            "destination": {"csv": {"directory": "unused"}},
+        }
+        records = [{"Id": 1, "SpatialDim": "AFG", "NumericValue": None},
+                   {"Id": 2, "SpatialDim": "AFG", "NumericValue": None}]
+        payload = {"@odata.count": 2, "value": records}
+        with patch('requests.post') as mock_post:
+            mock_post.return_value.content = json.dumps(payload).encode()
+            etl = ETL(config, "NCD_CCS_BreastCancer", MagicMock())
+            df = etl.transform(etl.extract(2, 0, etl.source_columns))
+        self.assertDictEqual({column: str(dtype) for column, dtype in df.dtypes.items()},
+                             {"Id": "Int64", "Country": "category", "NumericValue": "float64"})
+
+
+if __name__ == '__main__':
+    unittest.main()
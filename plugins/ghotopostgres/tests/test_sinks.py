@@ -0,0 +1,114 @@
+import gzip
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+import pandas as pd
+
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from etl.sinks import CsvSink, ParquetSink, ArrowSink, destinations_of  # type: ignore
+from etl.etl import ETL  # type: ignore
+
+try:
+    import pyarrow  # noqa: F401
+    import pyarrow.dataset as ds
+except ImportError:
+    ds = None
+
+
+def page(ids):
+    return pd.DataFrame({"Id": ids,
+                         "Region": ["AFR" if i % 2 else "EMR" for i in ids],
+                         "NumericValue": [float(i) if i % 3 else None for i in ids]})
+
+
+def data_files(root):
+    return sorted(os.path.join(path, name) for path, _, names in os.walk(root) for name in names)
+
+
+class TestFileSinks(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_csv_batches_are_published_on_commit(self):
+        sink = CsvSink("NCDMORT3070", {"directory": self.directory, "batch_rows": 4, "row_group_rows": 2},
+                       MagicMock())
+        self.assertFalse(sink.write(page([1, 2, 3])))
+        # nothing is visible until the batch is committed
+        self.assertTrue(all(os.path.basename(path).startswith(".") for path in data_files(self.directory)))
+        self.assertTrue(sink.write(page([4, 5])))
+        self.assertFalse(sink.flush())
+        self.assertTrue(sink.write(page([6, 7, 8, 9])))
+
+        files = data_files(self.directory)
+        self.assertEqual(len(files), 2)
+        combined = pd.concat([pd.read_csv(path) for path in files])
+        self.assertListEqual(sorted(combined["Id"]), list(range(1, 10)))
+
+    def test_csv_partitioned_and_compressed(self):
+        sink = CsvSink("NCDMORT3070", {"directory": self.directory, "partition_by": "Region",
+                                       "compression": "gzip"}, MagicMock())
+        sink.write(page([1, 2, 3, 4]))
+        self.assertTrue(sink.flush())
+
+        files = data_files(self.directory)
+        self.assertListEqual([os.path.relpath(os.path.dirname(path), self.directory) for path in files],
+                             [os.path.join("NCDMORT3070", "Region=AFR"), os.path.join("NCDMORT3070", "Region=EMR")])
+        with gzip.open(files[0], "rt") as file:
+            afr = pd.read_csv(file)
+        self.assertListEqual(list(afr.columns), ["Id", "NumericValue"])
+        self.assertListEqual(list(afr["Id"]), [1, 3])
+
+    @unittest.skipIf(ds is None, "pyarrow is not installed")
+    def test_parquet_partitions_round_trip(self):
+        sink = ParquetSink("NCDMORT3070", {"directory": self.directory, "partition_by": ["Region"],
+                                           "row_group_rows": 2, "max_open_files": 1}, MagicMock())
+        sink.write(page([1, 2, 3]))
+        sink.write(page([4, 5, 6]))
+        self.assertTrue(sink.flush())
+
+        table = ds.dataset(os.path.join(self.directory, "NCDMORT3070"), format="parquet",
+                           partitioning="hive").to_table().to_pandas()
+        self.assertListEqual(sorted(table["Id"]), [1, 2, 3, 4, 5, 6])
+        self.assertListEqual(sorted(table[table["Region"] == "AFR"]["Id"]), [1, 3, 5])
+        self.assertEqual(table["NumericValue"].isna().sum(), 2)
+
+    @unittest.skipIf(ds is None, "pyarrow is not installed")
+    def test_arrow_ipc(self):
+        sink = ArrowSink("NCDMORT3070", {"directory": self.directory, "compression": "zstd"}, MagicMock())
+        sink.write(page([1, 2]))
+        sink.write(page([3]))
+        sink.flush()
+
+        table = ds.dataset(os.path.join(self.directory, "NCDMORT3070"), format="arrow").to_table().to_pandas()
+        self.assertListEqual(list(table["Id"]), [1, 2, 3])
+
+    def test_destinations_of(self):
+        self.assertEqual(destinations_of({"destination": {"csv": {"directory": "out"}}}),
+                         [("csv", "csv", {"directory": "out"})])
+        destinations = destinations_of({"destination": [{"postgres": {"url": "a"}}, {"postgres": {"url": "b"}},
+                                                        {"csv": {"name": "lake", "directory": "out"}}]})
+        self.assertListEqual([name for name, _, _ in destinations], ["postgres", "postgres2", "lake"])
+        with self.assertRaises(ValueError):
+            destinations_of({"destination": {"s3": {}}})
+        with self.assertRaises(ValueError):
+            destinations_of({"destination": []})
+
+    def test_etl_without_postgres(self):
+        config = {"api": "http://test_gho/api", "indicator": "NCDMORT3070",
+                  "transform": {"columns": {"Id": "Id"}},
+                  "destination": {"csv": {"directory": self.directory}}}
+        etl = ETL(config, "NCDMORT3070", MagicMock())
+        self.assertIsNone(etl.engine)
+        self.assertTrue(etl.load(pd.DataFrame({"Id": [1]})) is False)
+        self.assertTrue(etl.flush_loader())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,17 @@
+from core.plugin import PluginInterface
+
+raise ImportError("disabled plugins must not be imported")
+
+
+class Disabled(PluginInterface):
+    def __init__(self, path, logger):
+        pass
+
+    def load_plugin_config(self, path):
+        pass
+
+    def execute(self):
+        pass
+
+    def stop(self):
+        pass
@@ -3,13 +3,13 @@ from core.plugin import PluginInterface
 
 class Sample(PluginInterface):
     def __init__(self, path, logger):
-        pass
+        self.logger = logger
 
     def load_plugin_config(self, path):
         pass
 
-    def execute(self):
-        pass
+    def execute(self, token=None):
+        self.logger.info("Sample executed")
 
     def stop(self):
         pass
@@ -0,0 +1,24 @@
+import os
+from core.plugin import PluginInterface
+
+
+class Jobs(PluginInterface):
+    """
+    Schedules two jobs and logs the process running each of them
+    """
+    def __init__(self, path, logger):
+        self.logger = logger
+
+    def load_plugin_config(self, path):
+        pass
+
+    def execute(self, token=None, job=None):
+        if job == "failing":
+            raise ValueError("Job failed")
+        self.logger.info(f"Ran {job} in {os.getpid()}")
+
+    def stop(self):
+        pass
+
+    def schedules(self):
+        return {"hourly": {"interval": 3600}, "failing": {"interval": 3600}}
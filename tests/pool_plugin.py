@@ -0,0 +1,22 @@
+import os
+from core.plugin import PluginInterface
+from core.resources import registry as resources
+
+
+class PoolSize(PluginInterface):
+    """
+    Logs the size of the pool it gets from the resource registry, asking for more connections than the cap
+    """
+    def __init__(self, path, logger):
+        self.path = path
+        self.logger = logger
+
+    def load_plugin_config(self, path):
+        pass
+
+    def execute(self, token=None):
+        engine = resources.engine(f"sqlite:///{os.path.join(self.path, 'pool.db')}", pool_size=8)
+        self.logger.info(f"Pool size {engine.pool.size()}")
+
+    def stop(self):
+        pass
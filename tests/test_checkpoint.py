@@ -0,0 +1,59 @@
+import logging
+import os
+import tempfile
+import time
+import unittest
+from core.checkpoint import CheckpointStore, read_status, write_status_atomically
+
+
+class TestCheckpointStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "status.yaml")
+        self.logger = logging.getLogger(__name__)
+
+    def plugin_status(self, plugin_key):
+        return read_status(self.path)["plugins"].get(plugin_key)
+
+    def test_flushes_every_n_updates(self):
+        store = CheckpointStore(self.path, "Plugin", self.logger, flush_every=3)
+        store.set("etl", {"offset": 1})
+        store.set("etl", {"offset": 2})
+        self.assertIsNone(self.plugin_status("Plugin"))
+
+        store.set("etl", {"offset": 3})
+        self.assertEqual(self.plugin_status("Plugin"), {"etl": {"offset": 3}})
+        self.assertEqual(store.get("etl"), {"offset": 3})
+
+    def test_flushes_after_interval(self):
+        store = CheckpointStore(self.path, "Plugin", self.logger, flush_every=100, flush_interval=0.05)
+        store.set("etl", {"offset": 1})
+        deadline = time.time() + 5
+        while self.plugin_status("Plugin") is None and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.plugin_status("Plugin"), {"etl": {"offset": 1}})
+
+    def test_flush_keeps_other_entries(self):
+        write_status_atomically(self.path, {"plugins": {"Other": {"etl": {"offset": 9}}}})
+        first = CheckpointStore(self.path, "Plugin", self.logger, flush_every=10)
+        second = CheckpointStore(self.path, "Plugin", self.logger, flush_every=10)
+        first.set("first_etl", {"offset": 1})
+        second.set("second_etl", {"offset": 2})
+        first.flush()
+        second.flush()
+
+        self.assertEqual(self.plugin_status("Plugin"), {"first_etl": {"offset": 1}, "second_etl": {"offset": 2}})
+        self.assertEqual(self.plugin_status("Other"), {"etl": {"offset": 9}})
+        # only the status file and its lock file remain, no temporary files
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ["status.yaml", "status.yaml.lock"])
+
+    def test_reads_existing_entries(self):
+        write_status_atomically(self.path, {"plugins": {"Plugin": {"etl": {"offset": 40}}}})
+        store = CheckpointStore(self.path, "Plugin", self.logger)
+        self.assertEqual(store.get("etl"), {"offset": 40})
+        self.assertIsNone(store.get("missing"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+import pstats
+import tempfile
+import unittest
+import urllib.request
+from core.metrics import JsonFileExporter, MetricsRegistry, PrometheusExporter, profiled
+from core.pipeline import Pipeline, Stage
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self):
+        self.metrics = MetricsRegistry(buckets=(0.1, 1.0))
+
+    def test_counters_and_histograms_render_as_prometheus_text(self):
+        self.metrics.inc("rows_loaded_total", 10, plugin="GHO", etl="NCDMORT3070")
+        self.metrics.inc("rows_loaded_total", 5, plugin="GHO", etl="NCDMORT3070")
+        self.metrics.observe("db_write_seconds", 0.05, plugin="GHO")
+        self.metrics.observe("db_write_seconds", 0.5, plugin="GHO")
+        self.metrics.observe("db_write_seconds", 5, plugin="GHO")
+
+        lines = self.metrics.render_prometheus().splitlines()
+        self.assertIn('rows_loaded_total{etl="NCDMORT3070",plugin="GHO"} 15', lines)
+        self.assertIn('db_write_seconds_bucket{plugin="GHO",le="0.1"} 1', lines)
+        self.assertIn('db_write_seconds_bucket{plugin="GHO",le="1.0"} 2', lines)
+        self.assertIn('db_write_seconds_bucket{plugin="GHO",le="+Inf"} 3', lines)
+        self.assertIn('db_write_seconds_count{plugin="GHO"} 3', lines)
+
+    def test_timer_and_snapshot(self):
+        with self.metrics.time("checkpoint_seconds", plugin="GHO"):
+            pass
+        snapshot = self.metrics.snapshot()
+        histogram = snapshot["histograms"]["checkpoint_seconds"][0]
+        self.assertEqual(histogram["labels"], {"plugin": "GHO"})
+        self.assertEqual(histogram["count"], 1)
+        json.dumps(snapshot)
+
+    def test_pipeline_records_stage_timings(self):
+        Pipeline(range(4), [Stage("transform", lambda value: value), Stage("load", lambda value: None)],
+                 metrics=self.metrics, labels={"plugin": "GHO"}).run()
+        series = {tuple(sorted(entry["labels"].items())): entry["count"]
+                  for entry in self.metrics.snapshot()["histograms"]["pipeline_stage_seconds"]}
+        self.assertEqual(series[(("plugin", "GHO"), ("stage", "transform"))], 4)
+        self.assertEqual(series[(("plugin", "GHO"), ("stage", "load"))], 4)
+
+
+class TestExporters(unittest.TestCase):
+    def setUp(self):
+        self.metrics = MetricsRegistry()
+        self.metrics.inc("rows_extracted_total", 3, plugin="GHO")
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_prometheus_endpoint(self):
+        exporter = PrometheusExporter(self.metrics, 0)
+        exporter.start()
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{exporter.port}/metrics") as response:
+                body = response.read().decode()
+        finally:
+            exporter.stop()
+        self.assertIn('rows_extracted_total{plugin="GHO"} 3', body)
+
+    def test_json_dump_on_stop(self):
+        path = os.path.join(self.directory.name, "metrics.json")
+        exporter = JsonFileExporter(self.metrics, path, interval=60)
+        exporter.start()
+        exporter.stop()
+        with open(path) as file:
+            self.assertEqual(json.load(file)["counters"]["rows_extracted_total"][0]["value"], 3)
+
+    def test_profiled_writes_stats(self):
+        with profiled("sample", self.directory.name, logging.getLogger(__name__)):
+            sum(range(1000))
+        [profile] = os.listdir(self.directory.name)
+        self.assertTrue(profile.startswith("sample-"))
+        pstats.Stats(os.path.join(self.directory.name, profile))
+
+    def test_profiled_includes_pipeline_workers(self):
+        def extract_numbers(value):
+            return sum(range(value))
+
+        loaded = []
+        with profiled("pipeline", self.directory.name):
+            Pipeline(range(50), [Stage("extract", extract_numbers, workers=2),
+                                 Stage("load", loaded.append, ordered=True)]).run()
+        [profile] = os.listdir(self.directory.name)
+        stats = pstats.Stats(os.path.join(self.directory.name, profile))
+        functions = {function for _, _, function in stats.stats}  # type: ignore
+        self.assertIn("extract_numbers", functions)
+        self.assertIn("_work", functions)
+
+
+if __name__ == "__main__":
+    unittest.main()
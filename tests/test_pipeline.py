@@ -0,0 +1,80 @@
+import threading
+import time
+import unittest
+from core.pipeline import Pipeline, Stage
+from core.thread import CancellationToken
+
+
+class TestPipeline(unittest.TestCase):
+    def test_ordered_stage_sees_source_order(self):
+        loaded = []
+
+        def slow_double(value):
+            # later items finish first
+            time.sleep(0.01 * (5 - value % 5))
+            return value * 2
+
+        stages = [
+            Stage("extract", slow_double, workers=4),
+            Stage("load", loaded.append, ordered=True),
+        ]
+        Pipeline(range(10), stages, queue_size=2).run()
+        self.assertListEqual(loaded, [value * 2 for value in range(10)])
+
+    def test_dropped_items_skip_later_stages(self):
+        loaded = []
+        stages = [
+            Stage("filter", lambda value: value if value % 2 else None, workers=2),
+            Stage("load", loaded.append, ordered=True),
+        ]
+        Pipeline(range(6), stages).run()
+        self.assertListEqual(loaded, [1, 3, 5])
+
+    def test_stage_error_is_raised(self):
+        def fail(value):
+            if value == 3:
+                raise RuntimeError("bad item")
+            return value
+
+        with self.assertRaises(RuntimeError):
+            Pipeline(range(100), [Stage("transform", fail, workers=2), Stage("load", lambda value: None)]).run()
+
+    def test_bounded_in_flight(self):
+        in_flight = []
+        lock = threading.Lock()
+        current = [0]
+
+        def enter(value):
+            with lock:
+                current[0] += 1
+                in_flight.append(current[0])
+            return value
+
+        def leave(value):
+            time.sleep(0.005)
+            with lock:
+                current[0] -= 1
+
+        Pipeline(range(30), [Stage("extract", enter, workers=3), Stage("load", leave)],
+                 queue_size=1, max_in_flight=3).run()
+        self.assertLessEqual(max(in_flight), 3)
+
+    def test_cancelled_token_drains_items_in_flight(self):
+        token = CancellationToken()
+        loaded = []
+
+        def load(value):
+            if value == 5:
+                token.cancel()
+            loaded.append(value)
+
+        Pipeline(range(1000), [Stage("extract", lambda value: value, workers=2), Stage("load", load, ordered=True)],
+                 queue_size=2, token=token).run()
+        # items fed before the cancellation are still loaded, in order and without gaps
+        self.assertGreaterEqual(len(loaded), 6)
+        self.assertLess(len(loaded), 1000)
+        self.assertListEqual(loaded, list(range(len(loaded))))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,13 @@
+import json
+import os
+import sys
+import tempfile
 import unittest
 import logging
-from core.plugin import PluginCore
+from unittest.mock import patch
+from core.plugin import PluginCore, PluginSpec, execute_plugin
+from core.process import PluginProcess, StoppableProcess, start_log_listener
+from core.thread import CancellationToken
 
 
 def create_test_home_dir(dir_name, logger):
@@ -10,13 +17,126 @@ def create_test_home_dir(dir_name, logger):
 class TestPluginCore(unittest.TestCase):
     def setUp(self):
         logger = logging.getLogger(__name__)
-        self.plugin_core = PluginCore(logger, "test_plugins", create_test_home_dir)
+        self.directory = tempfile.TemporaryDirectory()
+        self.manifest_path = os.path.join(self.directory.name, "manifest.json")
+        self.plugin_core = PluginCore(logger, "test_plugins", create_test_home_dir, self.manifest_path)
+
+    def tearDown(self):
+        self.directory.cleanup()
 
     def test_loaded_plugins(self):
         plugins = self.plugin_core.load_plugins()
-        # 2 plugin folders exist in the configured plugin path.
+        # 2 enabled plugin folders exist in the configured plugin path.
         self.assertEqual(len(plugins), 2)
 
+    def test_discovery_skips_disabled_plugins_without_importing(self):
+        specs = self.plugin_core.discover_plugins()
+        self.assertEqual(sorted(spec.name for spec in specs), ["sample", "sample1"])
+        self.assertEqual({spec.class_name for spec in specs}, {"Sample", "Sample1"})
+        self.assertNotIn("test_plugins.disabled.plugin", sys.modules)
+
+    def test_discovery_uses_and_refreshes_the_manifest(self):
+        self.plugin_core.discover_plugins()
+        with open(self.manifest_path) as file:
+            entries = json.load(file)["plugins"]
+        self.assertEqual(entries[os.path.join("test_plugins", "sample")]["classes"], ["Sample"])
+
+        # a cached entry with a matching fingerprint is used as is
+        entries[os.path.join("test_plugins", "sample")]["metadata"]["executor"] = "cached"
+        # a stale fingerprint makes discovery read the plugin again
+        entries[os.path.join("test_plugins", "sample1")]["fingerprint"] = []
+        entries[os.path.join("test_plugins", "sample1")]["metadata"]["executor"] = "stale"
+        with open(self.manifest_path, "w") as file:
+            json.dump({"plugins": entries}, file)
+
+        specs = {spec.name: spec for spec in self.plugin_core.discover_plugins()}
+        self.assertEqual(specs["sample"].executor, "cached")
+        self.assertEqual(specs["sample1"].executor, "thread")
+
+    def test_discovered_plugin_executor(self):
+        specs = {spec.name: spec for spec in self.plugin_core.discover_plugins()}
+        self.assertEqual(specs["sample"].executor, "process")
+        self.assertEqual(specs["sample1"].executor, "thread")
+
+    def test_execute_passes_token_when_accepted(self):
+        specs = {spec.name: spec for spec in self.plugin_core.discover_plugins()}
+        token = CancellationToken()
+        received = []
+
+        sample = specs["sample"].create(logging.getLogger(__name__))
+        sample.execute = lambda token=None: received.append(token)
+        execute_plugin(sample, token)
+        # plugins implementing execute() without a token still run
+        sample1 = specs["sample1"].create(logging.getLogger(__name__))
+        sample1.execute = lambda: received.append("no token")
+        execute_plugin(sample1, token)
+
+        self.assertListEqual(received, [token, "no token"])
+
+    def test_plugin_process_forwards_logs(self):
+        spec = next(spec for spec in self.plugin_core.discover_plugins() if spec.name == "sample")
+        logger = logging.getLogger("test_plugin_process")
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append  # type: ignore
+        logger.addHandler(handler)
+
+        log_queue, listener = start_log_listener(logger)
+        process = StoppableProcess(spec, log_queue)
+        process.start()
+        process.join(30)
+        listener.stop()
+
+        self.assertFalse(process.is_alive())
+        self.assertIn("Sample executed", [record.getMessage() for record in records])
+
+    def test_plugin_process_applies_the_pool_caps(self):
+        spec = PluginSpec("pool", self.directory.name, "tests.pool_plugin", "PoolSize", {"executor": "process"})
+        logger = logging.getLogger("test_plugin_process_pool")
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append  # type: ignore
+        logger.addHandler(handler)
+
+        log_queue, listener = start_log_listener(logger)
+        with patch.dict(os.environ, {"PSYSTEM_DB_POOL_SIZE": "3"}):
+            process = StoppableProcess(spec, log_queue)
+            process.start()
+            process.join(30)
+        listener.stop()
+
+        self.assertFalse(process.is_alive())
+        self.assertIn("Pool size 3", [record.getMessage() for record in records])
+
+    def test_plugin_process_runs_jobs_in_one_process(self):
+        spec = PluginSpec("jobs", self.directory.name, "tests.jobs_plugin", "Jobs", {"executor": "process"})
+        logger = logging.getLogger("test_plugin_process_jobs")
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append  # type: ignore
+        logger.addHandler(handler)
+
+        log_queue, listener = start_log_listener(logger)
+        process = PluginProcess(spec, log_queue)
+        process.start()
+        try:
+            self.assertEqual(set(process.schedules(30)), {"hourly", "failing"})
+            token = CancellationToken()
+            process.run(token, job="hourly")
+            process.run(token, job="hourly")
+            with self.assertRaisesRegex(RuntimeError, "Job failed"):
+                process.run(token, job="failing")
+        finally:
+            process.stop()
+            process.join(30)
+            listener.stop()
+
+        self.assertFalse(process.is_alive())
+        runs = [record.getMessage() for record in records if record.getMessage().startswith("Ran hourly")]
+        # both runs were served by the same, warm, process
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(len(set(runs)), 1)
+
 
 if __name__ == "__main__":
     unittest.main()
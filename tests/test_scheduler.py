@@ -0,0 +1,107 @@
+import threading
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock
+from core.scheduler import CronSchedule, IntervalSchedule, Job, Scheduler, schedule_from
+
+
+class TestSchedules(unittest.TestCase):
+    def test_cron_next_time(self):
+        every_quarter = CronSchedule("*/15 * * * *")
+        self.assertEqual(every_quarter.next_time(datetime(2024, 3, 1, 10, 7, 30)), datetime(2024, 3, 1, 10, 15))
+        self.assertEqual(every_quarter.next_time(datetime(2024, 3, 1, 10, 45)), datetime(2024, 3, 1, 11, 0))
+
+        nightly = CronSchedule("30 2 * * *")
+        self.assertEqual(nightly.next_time(datetime(2024, 12, 31, 3, 0)), datetime(2025, 1, 1, 2, 30))
+
+        # 2024-03-04 is a Monday
+        weekdays = CronSchedule("0 6 * * 1-5")
+        self.assertEqual(weekdays.next_time(datetime(2024, 3, 8, 7, 0)), datetime(2024, 3, 11, 6, 0))
+        sundays = CronSchedule("0 0 * * 7")
+        self.assertEqual(sundays.next_time(datetime(2024, 3, 4)), datetime(2024, 3, 10))
+
+        # restricted days of month and of week match on either
+        either = CronSchedule("0 0 1 * 0")
+        self.assertEqual(either.next_time(datetime(2024, 3, 2)), datetime(2024, 3, 3))
+
+    def test_invalid_schedules(self):
+        for expression in ("* * * *", "61 * * * *", "a * * * *", "5-1 * * * *"):
+            with self.assertRaises(ValueError):
+                CronSchedule(expression)
+        with self.assertRaises(ValueError):
+            schedule_from({"every": 5})
+        self.assertIsInstance(schedule_from({"interval": 5}), IntervalSchedule)
+
+    def test_interval_does_not_make_up_for_missed_runs(self):
+        schedule = IntervalSchedule(10)
+        self.assertEqual(schedule.first_run(100), 100)
+        self.assertEqual(schedule.next_run(100, 105), 110)
+        self.assertEqual(schedule.next_run(100, 135), 135)
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.logger = MagicMock()
+        self.scheduler = Scheduler(self.logger, workers=1, clock=lambda: self.now)
+
+    def test_skips_runs_of_a_job_still_in_flight(self):
+        release = threading.Event()
+        started = threading.Event()
+        runs = []
+
+        def slow(token):
+            runs.append(token)
+            started.set()
+            release.wait(5)
+
+        self.scheduler.add(Job("slow", slow, IntervalSchedule(10)))
+        self.scheduler.start()
+        self.scheduler.dispatch(self.now)
+        self.assertTrue(started.wait(5))
+
+        self.now += 10
+        self.scheduler.dispatch(self.now)
+        self.assertTrue(self.scheduler.in_flight("slow"))
+        self.logger.info.assert_any_call("Skipping the run of slow, the previous one is still in flight")
+
+        release.set()
+        self.assertListEqual(self.scheduler.stop(5), [])
+        self.assertEqual(len(runs), 1)
+        self.assertIs(runs[0], self.scheduler.token)
+
+    def test_runs_higher_priority_jobs_first(self):
+        order = []
+        blocker = threading.Event()
+        self.scheduler.add(Job("blocker", lambda token: blocker.wait(5), IntervalSchedule(60)))
+        self.scheduler.start()
+        self.scheduler.dispatch(self.now)
+
+        done = threading.Event()
+        self.scheduler.add(Job("low", lambda token: order.append("low"), IntervalSchedule(60), priority=0))
+        self.scheduler.add(Job("high", lambda token: order.append("high"), IntervalSchedule(60), priority=5))
+        self.scheduler.add(Job("last", lambda token: done.set(), IntervalSchedule(60), priority=-1))
+        self.scheduler.dispatch(self.now)
+        blocker.set()
+        self.assertTrue(done.wait(5))
+        self.assertListEqual(order, ["high", "low"])
+        self.scheduler.stop(5)
+
+    def test_failing_job_is_logged(self):
+        finished = threading.Event()
+
+        def failing(token):
+            finished.set()
+            raise RuntimeError("boom")
+
+        self.scheduler.add(Job("failing", failing, IntervalSchedule(1)))
+        self.scheduler.start()
+        self.scheduler.dispatch(self.now)
+        self.assertTrue(finished.wait(5))
+        self.scheduler.stop(5)
+        self.logger.error.assert_any_call("Scheduled run of failing failed: boom")
+        self.assertFalse(self.scheduler.in_flight("failing"))
+
+
+if __name__ == '__main__':
+    unittest.main()
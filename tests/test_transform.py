@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+from core.transform import TransformPlan
+
+
+class TestTransformPlan(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({
+            "Id": [1, 2, 3, 4],
+            "SpatialDim": ["AFG", "AGO", "ALB", "XXX"],
+            "ParentLocationCode": ["EMR", "AFR", "EUR", None],
+            "TimeDim": [2013, 2014, 2015, None],
+            "Value": ["12.3 [10.5-14.2]", "1 234", "No data", None],
+            "Date": ["2015-06-01T13:06:16.897+02:00", "2015-06-01T13:06:16.95+02:00", "not a date", None],
+        })
+
+    def test_columns_only_matches_select_and_rename(self):
+        plan = TransformPlan.compile({"columns": {"Id": "Id", "SpatialDim": "Country"}})
+        self.assertEqual(plan.source_columns, ["Id", "SpatialDim"])
+        result = plan.apply(self.df)
+        pd.testing.assert_frame_equal(result, self.df[["Id", "SpatialDim"]].rename(columns={"SpatialDim": "Country"}))
+
+    def test_parses_and_casts(self):
+        plan = TransformPlan.compile({
+            "columns": {"Id": "Id", "TimeDim": "TimeDim", "Value": "Value", "Date": "Date",
+                        "ParentLocationCode": "Region"},
+            "numeric": {"Value": "NumericValue"},
+            "dates": ["Date"],
+            "casts": {"TimeDim": "Int64", "Region": "category"},
+        })
+        result = plan.apply(self.df)
+        self.assertListEqual(list(result["NumericValue"].head(2)), [12.3, 1234.0])
+        self.assertTrue(result["NumericValue"].iloc[2:].isna().all())
+        self.assertEqual(str(result["Date"].dtype), "datetime64[ns, UTC]")
+        self.assertEqual(result["Date"].iloc[0], pd.Timestamp("2015-06-01T11:06:16.897Z"))
+        self.assertTrue(result["Date"].iloc[2:].isna().all())
+        self.assertEqual(str(result["TimeDim"].dtype), "Int64")
+        self.assertEqual(str(result["Region"].dtype), "category")
+        # the input data frame is left untouched
+        self.assertNotIn("NumericValue", self.df.columns)
+        self.assertEqual(self.df["Date"].dtype, object)
+
+    def test_steps_before_columns_read_unprojected_fields(self):
+        plan = TransformPlan.compile({"numeric": {"Value": "Parsed"}, "columns": {"Id": "Id", "Parsed": "Parsed"}})
+        self.assertIsNone(plan.source_columns)
+        result = plan.apply(self.df)
+        self.assertListEqual(list(result.columns), ["Id", "Parsed"])
+        self.assertListEqual(list(result["Parsed"].head(2)), [12.3, 1234.0])
+
+    def test_derive_lookup_and_filter(self):
+        plan = TransformPlan.compile({
+            "derive": {"Decade": "TimeDim // 10 * 10"},
+            "lookups": [{"on": "ParentLocationCode", "values": {"AFR": "Africa", "EMR": "Eastern Mediterranean"},
+                         "target": "Region", "default": "Other"}],
+            "filters": [{"column": "Region", "op": "ne", "value": "Other"},
+                        {"column": "TimeDim", "op": "ge", "value": 2013}],
+        })
+        self.assertIsNone(plan.source_columns)
+        result = plan.apply(self.df)
+        self.assertListEqual(list(result["Id"]), [1, 2])
+        self.assertListEqual(list(result["Region"]), ["Eastern Mediterranean", "Africa"])
+        self.assertListEqual(list(result["Decade"]), [2010.0, 2010.0])
+
+    def test_lookup_joins_dimension_table(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "countries.csv")
+            pd.DataFrame({"Code": ["AFG", "AGO"], "Name": ["Afghanistan", "Angola"],
+                          "Income": ["Low", "Lower middle"]}).to_csv(path, index=False)
+            plan = TransformPlan.compile({"lookups": [{"on": "SpatialDim", "path": path, "key": "Code"}]})
+        result = plan.apply(self.df)
+        self.assertListEqual(list(result["Name"].fillna("")), ["Afghanistan", "Angola", "", ""])
+        self.assertListEqual(list(result["Income"].fillna("")), ["Low", "Lower middle", "", ""])
+
+    def test_invalid_config(self):
+        with self.assertRaises(ValueError):
+            TransformPlan.compile({"unknown": {}})
+        with self.assertRaises(ValueError):
+            TransformPlan.compile({"casts": {"Id": "not a dtype"}})
+        with self.assertRaises(ValueError):
+            TransformPlan.compile({"filters": [{"column": "Id", "op": "like"}]})
+
+
+if __name__ == "__main__":
+    unittest.main()